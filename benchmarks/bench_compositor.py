@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""compare compositing backends on synthetic RGBA layers
+
+python benchmarks/bench_compositor.py --size 1024 --layers 8 --tokens 50
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+# third-party
+from PIL import Image
+import numpy as np
+
+# src
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(BENCH_DIR, ".."))
+import src.compositing as sc
+
+
+def make_args():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", action="store", type=int, help="layer width/height")
+    parser.add_argument("--layers", action="store", type=int, help="layers per token")
+    parser.add_argument("--values", action="store", type=int, help="values per layer")
+    parser.add_argument(
+        "--tokens", action="store", type=int, help="tokens to composite"
+    )
+    parser.set_defaults(size=512, layers=8, values=4, tokens=50)
+    return parser.parse_args()
+
+
+def make_layers(fdpath, size, num_layers, num_values, rng):
+    layers = []
+    for layer_num in range(num_layers):
+        values = []
+        for value_num in range(num_values):
+            # traits are mostly transparent, the bottom layer is opaque
+            rgba = np.zeros((size, size, 4), dtype=np.uint8)
+            if layer_num == 0:
+                y0, x0, y1, x1 = 0, 0, size, size
+            else:
+                y0, x0 = rng.integers(0, size // 2, size=2)
+                y1, x1 = y0 + size // 3, x0 + size // 3
+            rgba[y0:y1, x0:x1] = rng.integers(
+                0, 256, size=(y1 - y0, x1 - x0, 4), dtype=np.uint8
+            )
+            fpath = os.path.join(fdpath, f"{layer_num}-{value_num}.png")
+            Image.fromarray(rgba, "RGBA").save(fpath, "PNG", compress_level=1)
+            values.append(fpath)
+        layers.append(values)
+    return layers
+
+
+def bench_backend(name, image_plans):
+    backend = sc.make_backend(name=name)
+    compositor = sc.PrefixCompositor(
+        layer_cache=sc.LayerCache(max_bytes=2**34, loader=backend.load),
+        backend=backend,
+        max_depth=0,
+    )
+
+    # decode outside of the timed loop, we only compare blending
+    for image_plan in image_plans:
+        for fpath in image_plan:
+            compositor.layer_cache.get(fpath)
+
+    start = time.perf_counter()
+    for image_plan in image_plans:
+        compositor.composite(image_plan=image_plan).tobytes()
+    return time.perf_counter() - start, compositor.blends
+
+
+def main():
+    args = make_args()
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as fdpath:
+        layers = make_layers(fdpath, args.size, args.layers, args.values, rng)
+        image_plans = [
+            [values[rng.integers(len(values))] for values in layers]
+            for _ in range(args.tokens)
+        ]
+        for name in sc.BACKENDS:
+            elapsed, blends = bench_backend(name=name, image_plans=image_plans)
+            print(
+                f"{name:>6}: {elapsed:.3f}s for {args.tokens} tokens, "
+                f"{1000 * elapsed / blends:.2f}ms per blend"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""cost of per-token logging while generating metadata and image plans
+
+Runs the same synthetic combo collection with the src loggers at INFO, the
+default, and at DEBUG, where every per-token message is formatted as it was
+when they were logged at INFO. Log output goes to /dev/null.
+
+python benchmarks/bench_logging.py --tokens 10000 --types 8
+"""
+
+import logging
+import os
+import sys
+import tempfile
+import time
+
+# src
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(BENCH_DIR, ".."))
+import src.utils as su
+import synthetic
+
+
+def make_args():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", action="store", type=int, help="tokens to generate")
+    parser.add_argument("--types", action="store", type=int, help="trait types")
+    parser.add_argument("--values", action="store", type=int, help="values per type")
+    parser.set_defaults(tokens=5000, types=8, values=6)
+    return parser.parse_args()
+
+
+def bench_level(config, level):
+    src_logger = logging.getLogger("src")
+    src_logger.setLevel(level)
+    tt = su.TokenTool(config=config, project_name="bench")
+    num_tokens = config["bench"]["settings"]["num_tokens"]
+
+    start = time.perf_counter()
+    for metadata in tt.iter_metadatas_combo(0, num_tokens, seed=0):
+        tt.create_image_plan(metadata=metadata)
+    return time.perf_counter() - start
+
+
+def main():
+    args = make_args()
+    with open(os.devnull, "w") as devnull:
+        handler = logging.StreamHandler(devnull)
+        logging.getLogger().handlers = [handler]
+
+        with tempfile.TemporaryDirectory() as working_dir:
+            config = synthetic.make_config(
+                working_dir=working_dir,
+                num_tokens=args.tokens,
+                num_types=args.types,
+                num_values=args.values,
+            )
+            for name, level in [("INFO", logging.INFO), ("DEBUG", logging.DEBUG)]:
+                elapsed = bench_level(config=config, level=level)
+                print(
+                    f"{name:>5}: {elapsed:.3f}s for {args.tokens} tokens, "
+                    f"{args.tokens / elapsed:.0f} tokens/s"
+                )
+
+
+if __name__ == "__main__":
+    main()
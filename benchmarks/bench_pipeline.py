@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""time every pipeline stage on a synthetic combo project
+
+Stages are timed separately: sampling, metadata, planning, compositing,
+combining and validation. Results are written as json, pass a previous
+result to --compare to report slower stages and fail on regressions.
+
+python benchmarks/bench_pipeline.py --tokens 1000 --types 6 --values 4 \
+    --size 256 --output bench.json
+python benchmarks/bench_pipeline.py --compare bench.json
+"""
+
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+# third-party
+import numpy as np
+
+# src
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(BENCH_DIR, ".."))
+import src.sampler as ss
+import src.utils as su
+import synthetic
+
+RESULT_VERSION = 1
+PROJECT_NAME = "bench"
+STAGES = [
+    "sampling",
+    "metadata",
+    "planning",
+    "compositing",
+    "combining",
+    "validation",
+]
+
+
+def make_args():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", action="store", type=int, help="tokens (K)")
+    parser.add_argument("--types", action="store", type=int, help="trait types (N)")
+    parser.add_argument("--values", action="store", type=int, help="values (M)")
+    parser.add_argument("--size", action="store", type=int, help="layer width/height")
+    parser.add_argument(
+        "--workers", action="store", type=int, help="compositing processes"
+    )
+    parser.add_argument(
+        "--compositor", action="store", choices=["pil", "numpy"], help="backend"
+    )
+    parser.add_argument(
+        "--repeat", action="store", type=int, help="runs per stage, best is kept"
+    )
+    parser.add_argument(
+        "--output", action="store", metavar="FPATH", help="json results"
+    )
+    parser.add_argument(
+        "--compare",
+        action="store",
+        metavar="FPATH",
+        help="previous json results, same parameters are used",
+    )
+    parser.add_argument(
+        "--threshold",
+        action="store",
+        type=float,
+        help="with --compare, fail if a stage is this much slower, default 1.2",
+    )
+    parser.set_defaults(
+        tokens=500,
+        types=6,
+        values=4,
+        size=256,
+        workers=1,
+        compositor="pil",
+        repeat=3,
+        threshold=1.2,
+    )
+    return parser.parse_args()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BENCH_DIR,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def run_stages(config, params):
+    """
+    Returns:
+        dict: key=stage, value=seconds of one run
+    """
+    project_name = PROJECT_NAME
+    num_tokens = params["tokens"]
+    tt = su.TokenTool(config=config, project_name=project_name)
+    project_fdpath = su.get_project_fdpath(config=config, project_name=project_name)
+    metadata_fdpath = os.path.join(project_fdpath, "metadata")
+
+    def sampling():
+        sampler = ss.TraitSampler.from_traits(config[project_name]["traits"])
+        for _ in ss.generate_attributes(
+            sampler=sampler, rng=ss.TokenRNG(seed=0), start=0, end=num_tokens
+        ):
+            pass
+
+    def metadata():
+        su.generate_metadata_project(
+            config=config, project_name=project_name, overwrite=True, seed=0
+        )
+
+    image_plans = []
+
+    def planning():
+        image_plans.clear()
+        for token_num in range(num_tokens):
+            fpath = os.path.join(metadata_fdpath, f"{token_num}.json")
+            with open(fpath, "r", encoding="utf-8") as f:
+                image_plans.append((token_num, tt.create_image_plan(json.load(f))))
+
+    def compositing():
+        tt.save_image_plans(
+            image_plans=image_plans, overwrite=True, workers=params["workers"]
+        )
+
+    def combining():
+        su.combine_assets_project(
+            config=config,
+            project_name=project_name,
+            overwrite=True,
+            workers=params["workers"],
+        )
+
+    def validation():
+        su.validate_project(config=config, project_name=project_name)
+
+    fns = {
+        "sampling": sampling,
+        "metadata": metadata,
+        "planning": planning,
+        "compositing": compositing,
+        "combining": combining,
+        "validation": validation,
+    }
+    return {stage: timed(fns[stage]) for stage in STAGES}
+
+
+def bench(params):
+    """
+    Args:
+        params (dict): tokens, types, values, size, workers, compositor, repeat
+
+    Returns:
+        dict: results, see RESULT_VERSION
+    """
+    with tempfile.TemporaryDirectory() as working_dir:
+        config = synthetic.make_config(
+            working_dir=working_dir,
+            num_tokens=params["tokens"],
+            num_types=params["types"],
+            num_values=params["values"],
+            project_name=PROJECT_NAME,
+        )
+        config[PROJECT_NAME]["settings"]["compositor"] = params["compositor"]
+        su.initialize_project_folder(config=config, project_name=PROJECT_NAME)
+        tt = su.TokenTool(config=config, project_name=PROJECT_NAME)
+        synthetic.make_trait_layers(
+            tt=tt, size=params["size"], rng=np.random.default_rng(0)
+        )
+
+        runs = [
+            run_stages(config=config, params=params) for _ in range(params["repeat"])
+        ]
+
+    stages = {}
+    for stage in STAGES:
+        seconds = min(run[stage] for run in runs)
+        stages[stage] = {
+            "seconds": round(seconds, 6),
+            "tokens_per_second": round(params["tokens"] / seconds, 3),
+        }
+    return {
+        "version": RESULT_VERSION,
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+        "stages": stages,
+    }
+
+
+def compare(previous, current, threshold):
+    """
+    Returns:
+        list of str: stages slower than threshold times the previous run
+    """
+    regressions = []
+    for stage in STAGES:
+        before = previous["stages"][stage]["seconds"]
+        after = current["stages"][stage]["seconds"]
+        ratio = after / before if before else float("inf")
+        flag = ""
+        if ratio > threshold:
+            flag = "  REGRESSION"
+            regressions.append(stage)
+        print(f"{stage:>12}: {before:.3f}s -> {after:.3f}s ({ratio:.2f}x){flag}")
+    return regressions
+
+
+def main():
+    args = make_args()
+    logging.getLogger("src").setLevel(logging.WARNING)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        if previous.get("version") != RESULT_VERSION:
+            sys.exit(f"unsupported result version {previous.get('version')}")
+        params = previous["params"]
+    else:
+        previous = None
+        params = {
+            "tokens": args.tokens,
+            "types": args.types,
+            "values": args.values,
+            "size": args.size,
+            "workers": args.workers,
+            "compositor": args.compositor,
+            "repeat": args.repeat,
+        }
+
+    result = bench(params=params)
+    payload = json.dumps(result, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
+    elif previous is None:
+        print(payload)
+
+    if previous is not None:
+        print(f"{previous['commit']} -> {result['commit']}")
+        if compare(previous=previous, current=result, threshold=args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
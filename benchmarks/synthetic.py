@@ -0,0 +1,101 @@
+"""synthetic combo projects shared by the benchmarks"""
+
+import os
+
+# third-party
+from PIL import Image
+import numpy as np
+
+
+def make_config(working_dir, num_tokens, num_types, num_values, project_name="bench"):
+    """
+    Args:
+        working_dir (str): projects folder
+        num_tokens (int): tokens in the collection
+        num_types (int): trait types, the first one is the wildcard base
+        num_values (int): values per trait type and sublevel
+
+    Returns:
+        dict: config with one combo project
+    """
+    trait_types = ["base"] + [f"type{i}" for i in range(num_types - 1)]
+    trait_values = {
+        "base": {"any": {f"base{v}": v + 1 for v in range(num_values)}},
+    }
+    for trait_type in trait_types[1:]:
+        # a sublevel per base value, like the combo example
+        trait_values[trait_type] = {
+            f"base{b}": {f"{trait_type}-{b}-{v}": 1 for v in range(num_values)}
+            for b in range(num_values)
+        }
+    return {
+        project_name: {
+            "settings": {
+                "working_dir": working_dir,
+                "address": "BENCH",
+                "num_tokens": num_tokens,
+                "name_prefix": "bench",
+                "description": "bench description",
+                "collection": "bench collection",
+                "symbol": "BCH",
+                "seller_fee_basis_points": 100,
+            },
+            "validation": {"min_rarity_basis": 1},
+            "traits": {
+                "trait_algorithm": "combo",
+                "trait_types": trait_types,
+                "trait_hidden": [],
+                "trait_values": trait_values,
+            },
+        }
+    }
+
+
+def make_layer(size, opaque, rng):
+    """
+    Args:
+        size (int): width and height
+        opaque (bool): fill the whole layer, otherwise a patch on transparency
+        rng (numpy.random.Generator): pixel source
+
+    Returns:
+        PIL.Image.Image: RGBA layer
+    """
+    rgba = np.zeros((size, size, 4), dtype=np.uint8)
+    if opaque:
+        y0, x0, y1, x1 = 0, 0, size, size
+    else:
+        y0, x0 = rng.integers(0, size // 2, size=2)
+        y1, x1 = y0 + size // 3, x0 + size // 3
+    rgba[y0:y1, x0:x1] = rng.integers(
+        0, 256, size=(y1 - y0, x1 - x0, 4), dtype=np.uint8
+    )
+    if opaque:
+        rgba[..., 3] = 255
+    return Image.fromarray(rgba, "RGBA")
+
+
+def make_trait_layers(tt, size, rng):
+    """write one layer per trait value where the project expects it
+
+    Args:
+        tt (su.TokenTool): synthetic project, folders already initialized
+        size (int): layer width and height
+        rng (numpy.random.Generator): pixel source
+
+    Returns:
+        int: number of layers written
+    """
+    traits = tt.config[tt.project_name]["traits"]
+    num_layers = 0
+    for type_num, trait_type in enumerate(traits["trait_types"]):
+        for values in traits["trait_values"][trait_type].values():
+            for trait_value in values:
+                fpath = tt.create_image_fpath(
+                    trait_type=trait_type, trait_value=trait_value
+                )
+                os.makedirs(os.path.dirname(fpath), exist_ok=True)
+                layer = make_layer(size=size, opaque=type_num == 0, rng=rng)
+                layer.save(fpath, "PNG", compress_level=1)
+                num_layers += 1
+    return num_layers
@@ -5,7 +5,9 @@ import os
 import yaml
 
 # utils
+import src.timers as st
 import src.utils as su
+import src.writers as sw
 
 # logging
 import logging
@@ -39,22 +41,78 @@ def make_args():
         action="store_true",
         help="generate metadata from example template",
     )
+    parser.add_argument(
+        "--seed",
+        action="store",
+        type=int,
+        help="seed for --generate-metadata, same seed regenerates the same tokens",
+    )
+    parser.add_argument(
+        "--shard",
+        action="store",
+        metavar="I/N",
+        help="run stages on the I-th of N contiguous token ranges, 0 <= I < N",
+    )
+    parser.add_argument(
+        "--range",
+        action="store",
+        metavar="A:B",
+        help="run stages on tokens A to B - 1",
+    )
+    parser.add_argument(
+        "--merge-shards",
+        action="store_true",
+        help="merge metadata and manifests of --shard or --range runs, then verify every stage",
+    )
+    parser.add_argument(
+        "--preflight",
+        action="store_true",
+        help="check trait layer sizes and convert them to RGBA once, --generate-images also does this",
+    )
     parser.add_argument(
         "--generate-images",
         action="store_true",
         help="generate imates from traits",
     )
+    parser.add_argument(
+        "--preview",
+        action="store_true",
+        help="with --generate-images, fastest encoder settings instead of the image_* settings",
+    )
     parser.add_argument(
         "--combine-assets", action="store_true", help="images and metadata into assets"
     )
+    parser.add_argument(
+        "--link-mode",
+        action="store",
+        choices=sw.LINK_MODES,
+        help="how --combine-assets puts images into assets, default is copy",
+    )
     parser.add_argument(
         "--validate",
         action="store_true",
         help="validate images and metadata with project validation settings",
     )
+    parser.add_argument(
+        "--validate-report",
+        action="store",
+        metavar="FPATH",
+        help="json report of --validate, default is projects/<project>/validation.json",
+    )
     parser.add_argument(
         "--overwrite", action="store_true", help="allow overwriting metadata"
     )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="with --generate-images or --combine-assets, rebuild only tokens whose inputs changed",
+    )
+    parser.add_argument(
+        "--workers",
+        action="store",
+        type=int,
+        help="number of processes for compositing images and threads for combining assets, default is 1",
+    )
     parser.add_argument(
         "--react-env", action="store_true", help="frontend env to stdout"
     )
@@ -74,7 +132,24 @@ def make_args():
         metavar="KEYPAIR",
         help="override treasury address to use keypair instead of creator address",
     )
-    parser.set_defaults(project="example", env="devnet")
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="time every stage and its inner steps, log a summary table at the end",
+    )
+    parser.add_argument(
+        "--profile-pstats",
+        action="store",
+        metavar="FPATH",
+        help="also write cProfile stats of the main process, implies --profile",
+    )
+    parser.add_argument(
+        "--profile-trace",
+        action="store",
+        metavar="FPATH",
+        help="also write a Chrome trace json including workers, implies --profile",
+    )
+    parser.set_defaults(project="example", env="devnet", workers=1, link_mode="copy")
     args = parser.parse_args()
     return args
 
@@ -83,6 +158,8 @@ def main():
     args = make_args()
     if args.debug:
         logger.setLevel(logging.DEBUG)
+        # per token details of every stage
+        logging.getLogger("src").setLevel(logging.DEBUG)
 
     # config
     # ------
@@ -95,53 +172,132 @@ def main():
     with open(config_fpath, "r", encoding="utf-8") as f:
         config = yaml.load(f, Loader=yaml.FullLoader)
     su.validate_config(config=config, project_name=args.project)
+    start, end = su.parse_token_range(
+        num_tokens=config[args.project]["settings"]["num_tokens"],
+        shard=args.shard,
+        token_range=args.range,
+    )
+
+    profiler = start_profile(args)
+    try:
+        run_stages(args=args, config=config, start=start, end=end)
+    finally:
+        stop_profile(args=args, profiler=profiler)
+
 
+def run_stages(args, config, start, end):
     # initialize
     # ----------
     if args.initialize:
-        su.initialize_project_folder(config=config, project_name=args.project)
+        with st.timer("stage.initialize"):
+            su.initialize_project_folder(config=config, project_name=args.project)
 
     # generate
     # --------
     if args.generate_metadata:
-        su.generate_metadata_project(
-            config=config, project_name=args.project, overwrite=args.overwrite
-        )
+        with st.timer("stage.generate_metadata"):
+            su.generate_metadata_project(
+                config=config,
+                project_name=args.project,
+                overwrite=args.overwrite,
+                seed=args.seed,
+                start=start,
+                end=end,
+            )
+
+    # merge
+    # -----
+    if args.merge_shards:
+        with st.timer("stage.merge_shards"):
+            su.merge_shards_project(config=config, project_name=args.project)
 
     # validate
     # --------
     if args.validate:
-        su.validate_project(
-            config=config,
-            project_name=args.project,
-        )
+        with st.timer("stage.validate"):
+            su.validate_project(
+                config=config,
+                project_name=args.project,
+                report_fpath=args.validate_report,
+            )
 
     # images
     # ------
+    if args.preflight:
+        with st.timer("stage.preflight"):
+            su.preflight_project(
+                config=config, project_name=args.project, workers=args.workers
+            )
 
     if args.generate_images:
-        su.generate_images_project(
-            config=config, project_name=args.project, overwrite=args.overwrite
-        )
+        with st.timer("stage.generate_images"):
+            su.generate_images_project(
+                config=config,
+                project_name=args.project,
+                overwrite=args.overwrite,
+                workers=args.workers,
+                incremental=args.incremental,
+                start=start,
+                end=end,
+                preview=args.preview,
+            )
 
     # assets
     # ------
     if args.combine_assets:
-        su.combine_assets_project(
-            config=config, project_name=args.project, overwrite=args.overwrite
-        )
+        with st.timer("stage.combine_assets"):
+            su.combine_assets_project(
+                config=config,
+                project_name=args.project,
+                overwrite=args.overwrite,
+                link_mode=args.link_mode,
+                workers=args.workers,
+                incremental=args.incremental,
+                start=start,
+                end=end,
+            )
 
     # react env for frontend
     # ----------------------
     if args.react_env:
-        su.react_env_for_project(
-            config=config,
-            project_name=args.project,
-            react_env_candy_machine_id=args.react_env_candy_machine_id,
-            env=args.env,
-            react_env_start_date=args.react_env_start_date,
-            override_treasury_address=args.override_treasury_address,
-        )
+        with st.timer("stage.react_env"):
+            su.react_env_for_project(
+                config=config,
+                project_name=args.project,
+                react_env_candy_machine_id=args.react_env_candy_machine_id,
+                env=args.env,
+                react_env_start_date=args.react_env_start_date,
+                override_treasury_address=args.override_treasury_address,
+            )
+
+
+def start_profile(args):
+    """
+    Returns:
+        cProfile.Profile: running profiler with --profile-pstats, else None
+    """
+    if not (args.profile or args.profile_pstats or args.profile_trace):
+        return None
+    st.enable(trace=bool(args.profile_trace))
+    if not args.profile_pstats:
+        return None
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profile(args, profiler):
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile_pstats)
+        logger.info(f"pstats of the main process in {args.profile_pstats}")
+    if args.profile_trace:
+        st.write_trace(args.profile_trace)
+        logger.info(f"Chrome trace in {args.profile_trace}")
+    if st.enabled():
+        logger.info("profile\n" + st.summary_table())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,275 @@
+"""tokens as a matrix of trait value codes
+
+A token is one row of small integers, one column per trait type, each code
+indexing the string table of its column. A million tokens of 8 trait types
+take 16MB instead of a million nested metadata dicts; metadata json is only
+built when a token is written.
+"""
+
+from array import array
+
+# third-party
+import numpy as np
+
+# src
+import src.layers as sl
+import src.sampler as ss
+
+# logging
+import logging
+
+logger = logging.getLogger(__name__)
+
+ABSENT = -1
+
+
+class Collection:
+    """rows of trait value codes with shared string tables
+
+    Usage:
+        collection = Collection.generate(sampler, rng, start=0, end=num_tokens)
+        counts = collection.value_counts()
+        for token_num, attributes in collection.iter_attributes():
+            ...
+
+    Attributes:
+        trait_types (list of str): one per column, in metadata order
+        values (list of list of str): string table of every column
+        codes (numpy.ndarray): (num_tokens, num_columns) int16 when the tables
+            allow it, else int32, ABSENT where a token lacks the trait type
+        token_nums (numpy.ndarray): token number of every row, increasing
+    """
+
+    def __init__(self, trait_types, values, codes, start=0, token_nums=None):
+        """
+        Args:
+            trait_types (list of str): one per column
+            values (list of list): string table of every column
+            codes (array-like): (num_tokens, num_columns) codes
+            start (int): token number of the first row, rows are consecutive
+                tokens unless token_nums is given
+            token_nums (optional, array-like): increasing token numbers, i.e.
+                a collection read from disk with tokens missing
+        """
+        self.trait_types = list(trait_types)
+        self.values = [list(column_values) for column_values in values]
+        max_values = max((len(v) for v in self.values), default=0)
+        dtype = np.int16 if max_values <= np.iinfo(np.int16).max else np.int32
+        self.codes = np.asarray(codes).astype(dtype, copy=False)
+        self.codes = self.codes.reshape(-1, len(self.trait_types))
+        if token_nums is None:
+            token_nums = np.arange(start, start + len(self.codes))
+        self.token_nums = np.asarray(token_nums, dtype=np.int64)
+
+    @classmethod
+    def from_sampler(cls, sampler, codes, start=0):
+        """
+        Args:
+            sampler (ss.TraitSampler): codes index into its node values
+            codes (numpy.ndarray): see ss.TraitSampler.sample_codes
+            start (int): token number of the first row
+        """
+        return cls(
+            trait_types=[node.trait_type for node in sampler.nodes],
+            values=[node.values for node in sampler.nodes],
+            codes=codes,
+            start=start,
+        )
+
+    @classmethod
+    def generate(
+        cls,
+        sampler,
+        rng,
+        start,
+        end,
+        num_tokens=None,
+        unique=False,
+        allocation="random",
+    ):
+        """same tokens as ss.generate_attributes, without building dicts
+
+        Args:
+            see ss.generate_codes
+        """
+        codes = ss.generate_codes(
+            sampler=sampler,
+            rng=rng,
+            start=start,
+            end=end,
+            num_tokens=num_tokens,
+            unique=unique,
+            allocation=allocation,
+        )
+        return cls.from_sampler(sampler=sampler, codes=codes, start=start)
+
+    @classmethod
+    def from_attributes(cls, tokens, trait_types=None):
+        """encode attributes as they are read, i.e. from metadata on disk
+
+        Args:
+            tokens (iterable of tuple): (token_num, dict of key=trait_type,
+                value=trait_value) in increasing token order
+            trait_types (optional, list of str): first columns, trait types
+                not listed get a column when first seen
+
+        Returns:
+            Collection
+        """
+        trait_types = list(trait_types or [])
+        columns = {trait_type: i for i, trait_type in enumerate(trait_types)}
+        tables = [{} for _ in trait_types]
+        codes = [array("i") for _ in trait_types]
+        token_nums = array("q")
+        for token_num, attributes in tokens:
+            row = [ABSENT] * len(trait_types)
+            for trait_type, value in attributes.items():
+                try:
+                    column = columns[trait_type]
+                except KeyError:
+                    column = columns[trait_type] = len(trait_types)
+                    trait_types.append(trait_type)
+                    tables.append({})
+                    codes.append(array("i", [ABSENT]) * len(token_nums))
+                    row.append(ABSENT)
+                table = tables[column]
+                try:
+                    row[column] = table[value]
+                except KeyError:
+                    row[column] = table[value] = len(table)
+            for column, code in enumerate(row):
+                codes[column].append(code)
+            token_nums.append(token_num)
+
+        matrix = np.empty((len(token_nums), len(trait_types)), dtype=np.int32)
+        for column, column_codes in enumerate(codes):
+            matrix[:, column] = np.frombuffer(column_codes, dtype=np.int32)
+        return cls(
+            trait_types=trait_types,
+            values=[list(table) for table in tables],
+            codes=matrix,
+            token_nums=np.frombuffer(token_nums, dtype=np.int64),
+        )
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes
+
+    def attributes(self, token_num):
+        """
+        Returns:
+            dict: key=trait_type, value=trait_value in metadata order
+        """
+        row = int(np.searchsorted(self.token_nums, token_num))
+        if row == len(self) or self.token_nums[row] != token_num:
+            raise KeyError(token_num)
+        return self._decode(self.codes[row].tolist())
+
+    def _decode(self, row):
+        return {
+            trait_type: column_values[code]
+            for trait_type, column_values, code in zip(
+                self.trait_types, self.values, row
+            )
+            if code != ABSENT
+        }
+
+    def iter_attributes(self):
+        """
+        Yields:
+            tuple: (token_num, dict) see attributes, built one token at a time
+        """
+        for token_num, row in zip(self.token_nums.tolist(), self.codes.tolist()):
+            yield token_num, self._decode(row)
+
+    def value_counts(self):
+        """
+        Returns:
+            list of numpy.ndarray: per column, number of tokens with each code
+        """
+        return [
+            np.bincount(
+                column[column != ABSENT].astype(np.intp),
+                minlength=len(column_values),
+            )
+            for column, column_values in zip(self.codes.T, self.values)
+        ]
+
+    def duplicates(self):
+        """
+        Returns:
+            list of int: token numbers with the same attributes as an earlier
+                token
+        """
+        if not len(self):
+            return []
+        _, first = np.unique(self.codes, axis=0, return_index=True)
+        repeated = np.ones(len(self), dtype=bool)
+        repeated[first] = False
+        return self.token_nums[repeated].tolist()
+
+    def layer_ids(self, index):
+        """
+        Args:
+            index (sl.TraitIndex): layers of the same traits
+
+        Returns:
+            numpy.ndarray: int32 (num_tokens, len(index.trait_types)) layer
+                ids bottom first, ABSENT where a token lacks the trait type
+        """
+        columns = {trait_type: i for i, trait_type in enumerate(self.trait_types)}
+        layer_ids = np.full((len(self), len(index.trait_types)), ABSENT, np.int32)
+
+        def find(trait_type, key):
+            layer_id = index.layer_id(trait_type, key)
+            return ABSENT if layer_id is None else layer_id
+
+        for k, trait_type in enumerate(index.trait_types):
+            column = self.codes[:, columns[trait_type]].astype(np.intp)
+            present = column != ABSENT
+            column_values = self.values[columns[trait_type]]
+            if index.restriction is None or index.restriction == trait_type:
+                # code -> layer id
+                lookup = np.array(
+                    [find(trait_type, value) for value in column_values], np.int32
+                )
+                layer_ids[present, k] = lookup[column[present]]
+                continue
+
+            # (restriction code, code) -> layer id
+            restriction = columns[index.restriction]
+            restriction_values = self.values[restriction]
+            lookup = np.array(
+                [
+                    [find(trait_type, (r, value)) for value in column_values]
+                    for r in restriction_values
+                ],
+                np.int32,
+            ).reshape(len(restriction_values), len(column_values))
+            restriction_codes = self.codes[:, restriction].astype(np.intp)
+            layer_ids[present, k] = lookup[restriction_codes[present], column[present]]
+
+        missing = layer_ids == ABSENT
+        for k, trait_type in enumerate(index.trait_types):
+            column = self.codes[:, columns[trait_type]]
+            rows = np.nonzero(missing[:, k] & (column != ABSENT))[0]
+            if len(rows):
+                value = self.values[columns[trait_type]][column[rows[0]]]
+                raise sl.PreflightError(f"no layer for {trait_type}={value!r}")
+        return layer_ids
+
+    def iter_plans(self, index):
+        """
+        Args:
+            index (sl.TraitIndex): layers of the same traits
+
+        Yields:
+            tuple: (token_num, list of str) layer fpaths bottom first
+        """
+        fpaths = index.fpaths
+        layer_ids = self.layer_ids(index).tolist()
+        for token_num, row in zip(self.token_nums.tolist(), layer_ids):
+            yield token_num, [fpaths[layer_id] for layer_id in row if layer_id >= 0]
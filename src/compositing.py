@@ -0,0 +1,589 @@
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import itertools
+import os
+import time
+
+# third-party
+from PIL import Image
+import numpy as np
+
+# src
+import src.encoders as se
+import src.layers as sl
+import src.progress as sp
+import src.timers as st
+import src.writers as sw
+
+# logging
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LAYER_CACHE_MB = 256
+DEFAULT_WINDOW = 1024
+
+
+def load_pil_layer(fpath):
+    """
+    Args:
+        fpath (str): layer fpath
+
+    Returns:
+        tuple: decoded PIL.Image.Image, approximate size in bytes
+    """
+    with Image.open(fpath) as f:
+        f.load()
+        layer = f.copy()
+    width, height = layer.size
+    return layer, width * height * len(layer.getbands())
+
+
+class LayerCache:
+    """decoded trait layers shared across tokens, least recently used are evicted
+
+    Layers are keyed by fpath and mtime, so an edited trait image is decoded
+    again instead of served stale. Each fpath is stat once per build, see
+    start_build, not once per lookup.
+    """
+
+    def __init__(
+        self, max_bytes=DEFAULT_LAYER_CACHE_MB * 1024 * 1024, loader=load_pil_layer
+    ):
+        """
+        Args:
+            max_bytes (int): memory budget
+            loader (callable): fpath -> (layer, nbytes)
+        """
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self.num_bytes = 0
+        self.layers = OrderedDict()
+        # fpath -> mtime_ns, stat once per build
+        self.mtimes = {}
+        self.build = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def start_build(self, build):
+        """layers edited since the previous build are decoded again
+
+        Args:
+            build (hashable): id of the current build, the same for every
+                chunk of jobs of one save_image_jobs call
+        """
+        if build != self.build:
+            self.mtimes.clear()
+            self.build = build
+
+    def get(self, fpath):
+        """
+        Args:
+            fpath (str): layer fpath
+
+        Returns:
+            object: decoded layer, callers must not modify it
+        """
+        try:
+            mtime_ns = self.mtimes[fpath]
+        except KeyError:
+            mtime_ns = self.mtimes[fpath] = os.stat(fpath).st_mtime_ns
+        key = (fpath, mtime_ns)
+        try:
+            layer, _ = self.layers[key]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            self.layers.move_to_end(key)
+            return layer
+
+        self.misses += 1
+        with st.timer("images.decode"):
+            layer, nbytes = self.loader(fpath)
+        if nbytes > self.max_bytes:
+            return layer
+
+        self.layers[key] = (layer, nbytes)
+        self.num_bytes += nbytes
+        while self.num_bytes > self.max_bytes:
+            _, (_, evicted_nbytes) = self.layers.popitem(last=False)
+            self.num_bytes -= evicted_nbytes
+            self.evictions += 1
+        return layer
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def composite_image_plan(image_plan, layer_cache=None):
+    """layer images in order, each layer is pasted on top of the previous ones
+
+    Args:
+        image_plan (list of str): layer fpaths, bottom layer first
+        layer_cache (optional, LayerCache): reuse decoded layers
+
+    Returns:
+        PIL.Image.Image: composited image
+    """
+    if layer_cache is None:
+        layer_cache = LayerCache()
+
+    img = None
+    for input_fpath in image_plan:
+        layer = layer_cache.get(input_fpath)
+        if img is None:
+            img = layer.copy()
+            continue
+        img.paste(layer, (0, 0), layer)
+    return img
+
+
+class PilBackend:
+    """blend with Image.paste, each partial composite is a new image"""
+
+    name = "pil"
+
+    def load(self, fpath):
+        return load_pil_layer(fpath)
+
+    def from_atlas(self, rgba, bbox):
+        # shares the atlas pages, PIL never writes to a pasted layer
+        height, width, _ = rgba.shape
+        layer = Image.frombuffer("RGBA", (width, height), rgba, "raw", "RGBA", 0, 1)
+        return layer, 0
+
+    def start(self, layer, depth):
+        return layer
+
+    def blend(self, composite, layer, depth):
+        img = composite.copy()
+        img.paste(layer, (0, 0), layer)
+        return img
+
+    def to_image(self, composite):
+        return composite
+
+
+class NumpyLayer:
+    """RGBA layer preconverted for blending
+
+    Only the bounding box of non transparent pixels is blended, blending a fully
+    transparent pixel leaves the composite unchanged.
+
+    Layers of an atlas are not preconverted, premultiplied and inverse_alpha
+    are then None and computed while blending, so no memory is held per layer.
+
+    Attributes:
+        rgba (numpy.ndarray): uint8 (height, width, 4), used as a bottom layer
+        info (dict): PIL image info, i.e. icc_profile, kept from a bottom layer
+        bbox (tuple or None): y0, y1, x0, x1 of non transparent pixels
+        premultiplied (numpy.ndarray): uint16 rgba * alpha + 128 within bbox,
+            the 128 is the rounding term of PIL's DIV255
+        inverse_alpha (numpy.ndarray): uint16 (h, w, 1) 255 - alpha within bbox
+    """
+
+    def __init__(self, rgba, info=None, bbox=None, preconvert=True):
+        """
+        Args:
+            rgba (numpy.ndarray): uint8 (height, width, 4)
+            info (optional, dict): PIL image info
+            bbox (optional, tuple): y0, y1, x0, x1, skips scanning alpha
+            preconvert (bool): compute premultiplied and inverse_alpha now
+        """
+        self.rgba = rgba
+        self.info = info or {}
+        self.bbox = bbox
+        self.premultiplied = None
+        self.inverse_alpha = None
+        if not preconvert:
+            return
+
+        ys, xs = np.nonzero(rgba[..., 3])
+        if not len(ys):
+            return
+        y0, y1, x0, x1 = ys.min(), ys.max() + 1, xs.min(), xs.max() + 1
+        self.bbox = (y0, y1, x0, x1)
+        cropped = rgba[y0:y1, x0:x1]
+        alpha = cropped[..., 3:4].astype(np.uint16)
+        self.premultiplied = cropped.astype(np.uint16) * alpha + 128
+        self.inverse_alpha = 255 - alpha
+
+    @property
+    def nbytes(self):
+        nbytes = self.rgba.nbytes
+        if self.premultiplied is not None:
+            nbytes += self.premultiplied.nbytes + self.inverse_alpha.nbytes
+        return nbytes
+
+
+class NumpyBackend:
+    """blend preconverted layers in place into buffers reused across tokens
+
+    Matches Image.paste(layer, (0, 0), layer) for RGBA layers, which blends every
+    band including alpha as (dst * (255 - a) + src * a) / 255 rounded the way
+    PIL does, so the output pixels are identical to PilBackend.
+    """
+
+    name = "numpy"
+
+    def __init__(self):
+        # one output buffer per layer depth, reused by every token
+        self.buffers = {}
+        self.work = None
+        self.shifted = None
+        self.info = {}
+
+    def load(self, fpath):
+        with Image.open(fpath) as f:
+            rgba = np.array(f.convert("RGBA") if f.mode != "RGBA" else f)
+            info = dict(f.info)
+        layer = NumpyLayer(rgba=rgba, info=info)
+        return layer, layer.nbytes
+
+    def from_atlas(self, rgba, bbox):
+        return NumpyLayer(rgba=rgba, bbox=bbox, preconvert=False), 0
+
+    def _buffer(self, depth, shape):
+        buffer = self.buffers.get(depth)
+        if buffer is None or buffer.shape != shape:
+            buffer = np.empty(shape, dtype=np.uint8)
+            self.buffers[depth] = buffer
+        if self.work is None or self.work.shape != shape:
+            self.work = np.empty(shape, dtype=np.uint16)
+            self.shifted = np.empty(shape, dtype=np.uint16)
+        return buffer
+
+    def start(self, layer, depth):
+        # like pasting onto the bottom layer, the output keeps its info
+        self.info = layer.info
+        return layer.rgba
+
+    def blend(self, composite, layer, depth):
+        if composite.shape != layer.rgba.shape:
+            raise ValueError(
+                f"layer size {layer.rgba.shape[1::-1]} does not match "
+                f"{composite.shape[1::-1]}"
+            )
+        out = self._buffer(depth=depth, shape=composite.shape)
+        np.copyto(out, composite)
+        if layer.bbox is None:
+            return out
+
+        y0, y1, x0, x1 = layer.bbox
+        work = self.work[: y1 - y0, : x1 - x0]
+        shifted = self.shifted[: y1 - y0, : x1 - x0]
+
+        # dst * (255 - a) + src * a + 128, at most 65153 so it fits in uint16
+        if layer.premultiplied is None:
+            cropped = layer.rgba[y0:y1, x0:x1]
+            alpha = cropped[..., 3:4]
+            np.multiply(cropped, alpha, out=shifted, dtype=np.uint16)
+            np.multiply(
+                composite[y0:y1, x0:x1],
+                np.subtract(255, alpha, dtype=np.uint16),
+                out=work,
+            )
+            np.add(work, shifted, out=work)
+            np.add(work, 128, out=work)
+        else:
+            np.multiply(composite[y0:y1, x0:x1], layer.inverse_alpha, out=work)
+            np.add(work, layer.premultiplied, out=work)
+
+        # rest of PIL's DIV255: ((tmp >> 8) + tmp) >> 8
+        np.right_shift(work, 8, out=shifted)
+        np.add(shifted, work, out=shifted)
+        np.right_shift(shifted, 8, out=out[y0:y1, x0:x1], casting="unsafe")
+        return out
+
+    def to_image(self, composite):
+        img = Image.fromarray(composite, "RGBA")
+        img.info = dict(self.info)
+        return img
+
+
+BACKENDS = {
+    PilBackend.name: PilBackend,
+    NumpyBackend.name: NumpyBackend,
+}
+
+
+def make_backend(name="pil"):
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"invalid compositor {name=}, choose from {list(BACKENDS)}")
+
+
+class PrefixCompositor:
+    """composite plans in order, reusing the partial stack shared with the last plan
+
+    Plans sorted by layer fpaths put tokens with the same bottom layers next to
+    each other, so only the layers above the shared prefix are blended. Blending
+    is deterministic, so a reused partial stack has the same pixels as one
+    blended from scratch.
+    """
+
+    def __init__(self, layer_cache, backend=None, max_depth=None):
+        """
+        Args:
+            layer_cache (LayerCache): decoded layers, loaded by the backend
+            backend (optional, PilBackend or NumpyBackend): default is pil
+            max_depth (optional, int): max number of partial composites kept,
+                default keeps one per layer
+        """
+        self.layer_cache = layer_cache
+        self.backend = backend or PilBackend()
+        self.max_depth = max_depth
+        self.image_plan = ()
+        # stack[i] is the composite of image_plan[: i + 1]
+        self.stack = []
+        self.blends = 0
+        self.reused_blends = 0
+
+    def composite(self, image_plan):
+        """
+        Args:
+            image_plan (list of str): layer fpaths, bottom layer first
+
+        Returns:
+            PIL.Image.Image: composited image, callers must not modify it
+        """
+        image_plan = tuple(image_plan)
+        shared = 0
+        for previous_fpath, fpath in zip(self.image_plan, image_plan):
+            if previous_fpath != fpath:
+                break
+            shared += 1
+        shared = min(shared, len(self.stack))
+        del self.stack[shared:]
+        self.reused_blends += max(shared - 1, 0)
+
+        composite = self.stack[-1] if self.stack else None
+        for depth in range(shared, len(image_plan)):
+            layer = self.layer_cache.get(image_plan[depth])
+            if composite is None:
+                composite = self.backend.start(layer=layer, depth=depth)
+            else:
+                with st.timer("images.blend"):
+                    composite = self.backend.blend(
+                        composite=composite, layer=layer, depth=depth
+                    )
+                self.blends += 1
+            if self.max_depth is None or depth < self.max_depth:
+                self.stack.append(composite)
+
+        self.image_plan = image_plan
+        with st.timer("images.to_image"):
+            return self.backend.to_image(composite)
+
+    def stats(self):
+        return {"blends": self.blends, "reused_blends": self.reused_blends}
+
+
+# one compositor per process, workers keep theirs for the lifetime of the pool
+_COMPOSITOR = None
+_COMPOSITOR_OPTIONS = None
+
+
+def get_compositor(options):
+    """
+    Args:
+        options (dict): see save_image_jobs
+
+    Returns:
+        PrefixCompositor: compositor of the current process
+    """
+    global _COMPOSITOR, _COMPOSITOR_OPTIONS
+    if _COMPOSITOR is None or _COMPOSITOR_OPTIONS != options:
+        backend = make_backend(name=options.get("compositor") or "pil")
+        max_bytes = options.get("layer_cache_bytes")
+        if max_bytes is None:
+            max_bytes = DEFAULT_LAYER_CACHE_MB * 1024 * 1024
+        loader = backend.load
+        if options.get("atlas"):
+            atlas = sl.LayerAtlas(options["atlas"])
+
+            def loader(fpath):
+                rgba, bbox = atlas.get(fpath)
+                return backend.from_atlas(rgba=rgba, bbox=bbox)
+
+        layer_cache = LayerCache(max_bytes=max_bytes, loader=loader)
+        _COMPOSITOR = PrefixCompositor(
+            layer_cache=layer_cache,
+            backend=backend,
+            max_depth=options.get("prefix_cache_depth"),
+        )
+        _COMPOSITOR_OPTIONS = dict(options)
+    return _COMPOSITOR
+
+
+def _save_image_jobs(jobs, options=None, progress=None, build=None):
+    """worker entrypoint, only plain paths cross the process boundary
+
+    Args:
+        jobs (list of tuple): (token_num, image_fpath, image_plan), sorted by
+            image_plan to share partial composites
+        options (optional, dict): see save_image_jobs
+        progress (optional, sp.Progress): updated per image, in process only
+        build (optional, hashable): see LayerCache.start_build, default stats
+            layers again for these jobs
+
+    Returns:
+        dict: number of images saved and compositing counters for these jobs,
+            with a st.snapshot under "profile" when profiling a worker
+    """
+    options = options or {}
+    profile = options.get("profile")
+    if profile is not None:
+        # a pool worker, collect this chunk only and send it back
+        st.enable(trace=profile["trace"])
+        st.reset()
+
+    compositor = get_compositor(options=options)
+    compositor.layer_cache.start_build(build if build is not None else object())
+    encoder = se.ImageEncoder(**(options.get("encoder") or {}))
+    before = {**compositor.layer_cache.stats(), **compositor.stats()}
+    for token_num, image_fpath, image_plan in jobs:
+        logger.debug("Processing %s -> %s", token_num, image_fpath)
+        with st.timer("images.composite"):
+            img = compositor.composite(image_plan=image_plan)
+
+        # a new file instead of rewriting one that assets may hard link to
+        temp_fpath = sw.temp_fpath_for(image_fpath)
+        with st.timer("images.encode"):
+            encoder.save(img, temp_fpath)
+        with st.timer("images.replace"):
+            os.replace(temp_fpath, image_fpath)
+        st.count("images.saved")
+        if progress is not None:
+            progress.update()
+
+    after = {**compositor.layer_cache.stats(), **compositor.stats()}
+    stats = {k: v - before[k] for k, v in after.items()}
+    stats["saved"] = len(jobs)
+    if profile is not None:
+        stats["profile"] = st.snapshot()
+    return stats
+
+
+def chunk_jobs(jobs, workers):
+    """split jobs into contiguous chunks, several per worker to balance load
+
+    Args:
+        jobs (list): jobs
+        workers (int): number of worker processes
+
+    Returns:
+        list of list: chunks of jobs
+    """
+    chunksize = max(1, min(64, -(-len(jobs) // (workers * 4))))
+    return [jobs[i : i + chunksize] for i in range(0, len(jobs), chunksize)]
+
+
+def log_image_stats(stats):
+    lookups = stats["hits"] + stats["misses"]
+    hit_rate = stats["hits"] / lookups if lookups else 0.0
+    logger.info(
+        f"layer cache: hits={stats['hits']} misses={stats['misses']} "
+        f"evictions={stats['evictions']} hit_rate={hit_rate:.1%}"
+    )
+    logger.info(
+        f"prefix sharing: blends={stats['blends']} "
+        f"reused_blends={stats['reused_blends']}"
+    )
+
+
+def iter_windows(jobs, window):
+    """
+    Args:
+        jobs (iterable of tuple): (token_num, image_fpath, image_plan)
+        window (int): jobs per window
+
+    Yields:
+        list of tuple: jobs of one window, sorted by image_plan so neighbours
+            share the most bottom layers
+    """
+    jobs = iter(jobs)
+    while True:
+        chunk = list(itertools.islice(jobs, window))
+        if not chunk:
+            return
+        chunk.sort(key=lambda job: tuple(job[2]))
+        yield chunk
+
+
+def merge_stats(stats, more):
+    profile = more.pop("profile", None)
+    if profile is not None:
+        st.merge(profile)
+    for k, v in more.items():
+        stats[k] = stats.get(k, 0) + v
+
+
+def save_image_jobs(jobs, workers=1, options=None, progress=None):
+    """composite and save images, optionally across a process pool
+
+    Jobs are consumed lazily, one window at a time, and at most two chunks per
+    worker are in flight, so memory stays flat however many jobs there are and
+    the first images are saved before the last jobs are planned.
+
+    Args:
+        jobs (iterable of tuple): (token_num, image_fpath, image_plan)
+        workers (int): number of processes, 1 runs in the current process
+        options (optional, dict): compositing options, passed to every worker
+            - layer_cache_bytes (int): layer cache budget per process
+            - prefix_cache_depth (int): max partial composites kept per process
+            - compositor (str): pil or numpy
+            - window (int): jobs sorted together to share partial composites
+            - encoder (dict): se.ImageEncoder kwargs, default is png
+            - atlas (str): sl.LayerStore.atlas_fdpath, layers are read from
+              its mmap instead of decoded per process
+        progress (optional, sp.Progress): updated as images are saved
+
+    Returns:
+        dict: number of images saved and compositing counters
+    """
+    window = (options or {}).get("window") or DEFAULT_WINDOW
+    # unique across processes, layers are stat once per build in each worker
+    build = (os.getpid(), time.time_ns())
+    stats = {"saved": 0}
+    if progress is None:
+        progress = sp.Progress("images")
+
+    if workers is None or workers <= 1:
+        for chunk in iter_windows(jobs=jobs, window=window):
+            merge_stats(stats, _save_image_jobs(chunk, options, progress, build))
+        if stats["saved"]:
+            log_image_stats(stats)
+        return stats
+
+    logger.info(f"Compositing images with {workers=} in windows of {window}")
+    if st.enabled():
+        options = {**(options or {}), "profile": {"trace": st.tracing()}}
+    max_in_flight = workers * 2
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for chunk in iter_windows(jobs=jobs, window=window):
+            for worker_chunk in chunk_jobs(jobs=chunk, workers=workers):
+                if len(pending) >= max_in_flight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        merge_stats(stats, future.result())
+                        progress.update(future.result()["saved"])
+                pending.add(
+                    executor.submit(
+                        _save_image_jobs, worker_chunk, options, None, build
+                    )
+                )
+        for future in wait(pending).done:
+            merge_stats(stats, future.result())
+            progress.update(future.result()["saved"])
+    if stats["saved"]:
+        log_image_stats(stats)
+    return stats
@@ -0,0 +1,207 @@
+"""encode composited images in settings.image_format
+
+Encoding large images is the largest cost after decoding layers, so the
+tradeoff between file size and speed is configurable per project:
+
+    image_format: png          # png, jpg, jpeg or webp
+    image_compress_level: 6    # png zlib level 0-9
+    image_optimize: false      # png and jpeg, smaller files, much slower
+    image_quality: 90          # jpeg and webp 1-100
+    image_quantize: 256        # png only, palette of at most this many colors
+    image_lossless: false      # webp only
+    image_method: 4            # webp 0-6, slower is smaller
+
+Preview mode ignores the size settings and encodes as fast as possible, for
+checking layers and traits before the final run.
+"""
+
+# third-party
+from PIL import Image
+
+# logging
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IMAGE_FORMAT = "png"
+PIL_FORMATS = {
+    "png": "PNG",
+    "jpg": "JPEG",
+    "jpeg": "JPEG",
+    "webp": "WEBP",
+}
+# jpeg has no alpha, transparent pixels are flattened onto this
+JPEG_BACKGROUND = (255, 255, 255)
+PREVIEW_COMPRESS_LEVEL = 1
+PREVIEW_METHOD = 0
+
+
+class ImageEncoder:
+    """save images with the encoder settings of a project
+
+    Usage:
+        encoder = ImageEncoder(image_format="webp", quality=85)
+        encoder.save(img, "0.webp")
+    """
+
+    def __init__(
+        self,
+        image_format=DEFAULT_IMAGE_FORMAT,
+        compress_level=None,
+        optimize=False,
+        quality=None,
+        quantize=None,
+        lossless=False,
+        method=None,
+        preview=False,
+    ):
+        """
+        Args:
+            image_format (str): png, jpg, jpeg or webp
+            compress_level (optional, int): png zlib level 0-9, default is 6
+            optimize (bool): png and jpeg, extra pass for smaller files
+            quality (optional, int): jpeg and webp 1-100
+            quantize (optional, int): png only, number of palette colors
+            lossless (bool): webp only
+            method (optional, int): webp 0-6, default is 4
+            preview (bool): fastest settings, ignores the size settings above
+        """
+        try:
+            self.pil_format = PIL_FORMATS[image_format]
+        except KeyError:
+            raise ValueError(
+                f"invalid {image_format=}, choose from {list(PIL_FORMATS)}"
+            )
+        if compress_level is not None and not 0 <= compress_level <= 9:
+            raise ValueError(f"invalid {compress_level=}, must be 0 to 9")
+        if quality is not None and not 1 <= quality <= 100:
+            raise ValueError(f"invalid {quality=}, must be 1 to 100")
+        if method is not None and not 0 <= method <= 6:
+            raise ValueError(f"invalid {method=}, must be 0 to 6")
+        if quantize is not None:
+            if self.pil_format != "PNG":
+                raise ValueError(
+                    f"quantize is only supported for png, not {image_format}"
+                )
+            if not 2 <= quantize <= 256:
+                raise ValueError(f"invalid {quantize=}, must be 2 to 256")
+
+        self.image_format = image_format
+        self.compress_level = compress_level
+        self.optimize = optimize
+        self.quality = quality
+        self.quantize = quantize
+        self.lossless = lossless
+        self.method = method
+        self.preview = preview
+
+    @classmethod
+    def from_settings(cls, settings, preview=False):
+        """
+        Args:
+            settings (dict): config[project_name]["settings"], see module docstring
+            preview (bool): see __init__
+
+        Returns:
+            ImageEncoder
+        """
+        kwargs = {"preview": preview}
+        keys = {
+            "image_format": "image_format",
+            "compress_level": "image_compress_level",
+            "optimize": "image_optimize",
+            "quality": "image_quality",
+            "quantize": "image_quantize",
+            "lossless": "image_lossless",
+            "method": "image_method",
+        }
+        for kwarg, key in keys.items():
+            try:
+                kwargs[kwarg] = settings[key]
+            except KeyError:
+                pass
+        return cls(**kwargs)
+
+    def to_options(self):
+        """
+        Returns:
+            dict: plain kwargs of __init__, picklable for compositing workers
+        """
+        return {
+            "image_format": self.image_format,
+            "compress_level": self.compress_level,
+            "optimize": self.optimize,
+            "quality": self.quality,
+            "quantize": self.quantize,
+            "lossless": self.lossless,
+            "method": self.method,
+            "preview": self.preview,
+        }
+
+    def key(self):
+        """
+        Returns:
+            str: settings that change the encoded bytes, part of the image digest
+                so images are rebuilt when they change
+        """
+        quantize = None if self.preview else self.quantize
+        return repr(sorted(self.save_kwargs().items()) + [("quantize", quantize)])
+
+    def save_kwargs(self):
+        """
+        Returns:
+            dict: keyword arguments of PIL.Image.Image.save
+        """
+        kwargs = {"format": self.pil_format}
+        if self.pil_format == "PNG":
+            if self.preview:
+                kwargs["compress_level"] = PREVIEW_COMPRESS_LEVEL
+                return kwargs
+            if self.compress_level is not None:
+                kwargs["compress_level"] = self.compress_level
+            if self.optimize:
+                kwargs["optimize"] = True
+        elif self.pil_format == "JPEG":
+            if self.quality is not None:
+                kwargs["quality"] = self.quality
+            if self.optimize and not self.preview:
+                kwargs["optimize"] = True
+        elif self.pil_format == "WEBP":
+            if self.quality is not None:
+                kwargs["quality"] = self.quality
+            if self.lossless:
+                kwargs["lossless"] = True
+            if self.preview:
+                kwargs["method"] = PREVIEW_METHOD
+            elif self.method is not None:
+                kwargs["method"] = self.method
+        return kwargs
+
+    def prepare(self, img):
+        """
+        Args:
+            img (PIL.Image.Image): composited image, not modified
+
+        Returns:
+            PIL.Image.Image: image in a mode the format can encode
+        """
+        if self.pil_format == "JPEG" and img.mode != "RGB":
+            rgba = img.convert("RGBA")
+            flattened = Image.new("RGB", rgba.size, JPEG_BACKGROUND)
+            flattened.paste(rgba, (0, 0), rgba)
+            flattened.info = dict(img.info)
+            return flattened
+        if self.quantize is not None and not self.preview:
+            # fast octree is the only builtin method that keeps alpha
+            quantized = img.quantize(colors=self.quantize, method=Image.FASTOCTREE)
+            quantized.info = dict(img.info)
+            return quantized
+        return img
+
+    def save(self, img, fpath):
+        """
+        Args:
+            img (PIL.Image.Image): composited image, not modified
+            fpath (str): destination
+        """
+        self.prepare(img).save(fpath, **self.save_kwargs())
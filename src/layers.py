@@ -0,0 +1,528 @@
+"""trait layers: where they are, and preflight into a canonical RGBA store
+
+TraitIndex resolves every trait value to its layer once per run.
+
+Artists deliver layers in mixed modes (P, LA, RGB, RGBA) and, by mistake,
+mixed sizes. Preflight scans traits/ once, fails on every layer of the wrong
+size before a single token is composited, and writes each layer converted
+to RGBA to projects/<project_name>/.cache/layers/<width>x<height>/, keeping
+its path below traits/. Compositing reads only from there, so no layer is
+converted per token. Every file is written to a temp file unique to its
+writer and renamed into place, so shards on several machines sharing the
+cache can preflight it at the same time.
+
+A cached layer is converted again when the size or mtime of its source
+differs from the ones it was converted from, recorded in sources.json next
+to it, so restoring an older source also refreshes the cache.
+
+Optionally the canonical layers are packed into one uncompressed atlas next
+to them, raw RGBA plus a json index of offsets. Compositing workers mmap it
+read-only, so every process shares the same pages of the OS cache instead
+of decoding its own copy of each layer.
+"""
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import json
+import mmap
+import os
+
+# third-party
+from PIL import Image
+import numpy as np
+
+# src
+import src.progress as sp
+import src.timers as st
+import src.writers as sw
+
+# logging
+import logging
+
+logger = logging.getLogger(__name__)
+
+CANONICAL_MODE = "RGBA"
+LAYER_EXTENSION = ".png"
+ANY_SUBLEVEL = "any"
+# layers are decoded far more often than written, zlib level barely changes decode
+CACHE_COMPRESS_LEVEL = 1
+ATLAS_VERSION = 1
+ATLAS_FNAME = "atlas.rgba"
+ATLAS_INDEX_FNAME = "atlas.json"
+SOURCES_FNAME = "sources.json"
+
+
+class PreflightError(ValueError):
+    pass
+
+
+class TraitIndex:
+    """layer id, fpath and sublevel of every (trait_type, value), built once
+
+    Layouts below traits/, the same ones initialize_project_folder creates:
+        combo: <type>/<sublevel>/<type>-<sublevel>-<value>.png, hidden types
+            have no layer, types without trait_values use the any sublevel
+        basic: <type>/<value>.png
+        basic with trait_restrictions: restriction types are <type>/<value>.png,
+            other types <type>/<restriction value>/<value>.png
+
+    Planning a token is then one dict lookup per trait type and its layers
+    are integer ids into fpaths.
+
+    Attributes:
+        trait_types (list of str): layered trait types, bottom first
+        fpaths (list of str): key=layer id, value=layer fpath
+        sublevels (list of str or None): key=layer id, value=sublevel
+        ids (dict): key=trait_type, value=dict of key=value, or
+            (restriction value, value) for restricted types, value=layer id
+        restriction (str or None): trait type selecting the sublevel of the
+            other types in the basic layout
+        any_types (set of str): combo types without trait_values, a value is
+            added with the any sublevel when first planned
+    """
+
+    def __init__(self, traits_fdpath, trait_types, restriction=None):
+        self.traits_fdpath = traits_fdpath
+        self.trait_types = list(trait_types)
+        self.restriction = restriction
+        self.fpaths = []
+        self.sublevels = []
+        self.ids = {trait_type: {} for trait_type in self.trait_types}
+        self.any_types = set()
+
+    def add(self, trait_type, key, fpath, sublevel=None):
+        layer_id = len(self.fpaths)
+        self.fpaths.append(fpath)
+        self.sublevels.append(sublevel)
+        self.ids[trait_type][key] = layer_id
+        return layer_id
+
+    def add_combo(self, trait_type, value, sublevel=ANY_SUBLEVEL):
+        fname = f"{trait_type}-{sublevel}-{value}{LAYER_EXTENSION}"
+        fpath = os.path.join(self.traits_fdpath, trait_type, sublevel, fname)
+        return self.add(trait_type, value, fpath, sublevel=sublevel)
+
+    def layer_id(self, trait_type, key):
+        """
+        Args:
+            trait_type (str): layered trait type
+            key (str or tuple): value, or (restriction value, value)
+
+        Returns:
+            int or None: layer id, None if the value has no layer
+        """
+        try:
+            return self.ids[trait_type][key]
+        except KeyError:
+            if trait_type not in self.any_types:
+                return None
+        return self.add_combo(trait_type, key)
+
+    @classmethod
+    def from_traits(cls, traits, traits_fdpath, check=True):
+        """
+        Args:
+            traits (dict): config[project_name]["traits"]
+            traits_fdpath (str): projects/<project_name>/traits
+            check (bool): raise PreflightError listing every missing layer
+
+        Returns:
+            TraitIndex
+        """
+        trait_values = traits["trait_values"]
+        if traits["trait_algorithm"] == "combo":
+            index = cls(
+                traits_fdpath=traits_fdpath,
+                trait_types=[
+                    trait_type
+                    for trait_type in traits["trait_types"]
+                    if trait_type not in traits["trait_hidden"]
+                ],
+            )
+            for trait_type in index.trait_types:
+                if trait_type not in trait_values:
+                    index.any_types.add(trait_type)
+                for sublevel, values in trait_values.get(trait_type, {}).items():
+                    for value in values:
+                        index.add_combo(trait_type, value, sublevel)
+        else:
+            try:
+                restrictions = traits["trait_restrictions"]
+            except KeyError:
+                restrictions = []
+            index = cls(
+                traits_fdpath=traits_fdpath,
+                trait_types=traits["trait_types"],
+                restriction=restrictions[0] if restrictions else None,
+            )
+            for trait_type in index.trait_types:
+                if not restrictions or trait_type in restrictions:
+                    for value in trait_values[trait_type]:
+                        fpath = os.path.join(
+                            traits_fdpath, trait_type, value + LAYER_EXTENSION
+                        )
+                        index.add(trait_type, value, fpath)
+                    continue
+                for sublevel, values in trait_values[trait_type].items():
+                    for value in values:
+                        fpath = os.path.join(
+                            traits_fdpath, trait_type, sublevel, value + LAYER_EXTENSION
+                        )
+                        index.add(trait_type, (sublevel, value), fpath, sublevel)
+
+        if check:
+            index.check()
+        return index
+
+    def check(self):
+        missing = [fpath for fpath in self.fpaths if not os.path.exists(fpath)]
+        if missing:
+            missing = [os.path.relpath(fpath, self.traits_fdpath) for fpath in missing]
+            raise PreflightError(
+                f"{len(missing)} layers missing in {self.traits_fdpath}, "
+                f"i.e. {missing[:10]}"
+            )
+
+    def plan_ids(self, attributes):
+        """
+        Args:
+            attributes (dict): key=trait_type, value=trait value, types a
+                token does not have are skipped
+
+        Returns:
+            list of int: layer ids, bottom first
+        """
+        layer_ids = []
+        for trait_type in self.trait_types:
+            try:
+                value = attributes[trait_type]
+            except KeyError:
+                continue
+            key = value
+            if self.restriction is not None and self.restriction != trait_type:
+                key = (attributes[self.restriction], value)
+            layer_id = self.layer_id(trait_type, key)
+            if layer_id is None:
+                raise PreflightError(f"no layer for {trait_type}={value!r}")
+            layer_ids.append(layer_id)
+        return layer_ids
+
+    def plan(self, attributes):
+        """
+        Returns:
+            list of str: layer fpaths, see plan_ids
+        """
+        return [self.fpaths[layer_id] for layer_id in self.plan_ids(attributes)]
+
+
+class LayerStore:
+    """canonical copies of the layers below traits/
+
+    Usage:
+        store = LayerStore(traits_fdpath, cache_fdpath)
+        store.preflight()
+        image_plan = store.plan(image_plan)
+    """
+
+    def __init__(self, traits_fdpath, cache_fdpath, size=None):
+        """
+        Args:
+            traits_fdpath (str): projects/<project_name>/traits
+            cache_fdpath (str): projects/<project_name>/.cache/layers
+            size (optional, tuple of int): width and height every layer is
+                resized to, default requires every layer to have the size
+                most layers have
+        """
+        self.traits_fdpath = os.path.normpath(traits_fdpath)
+        self.cache_fdpath = cache_fdpath
+        self.size = tuple(size) if size is not None else None
+        self.num_converted = 0
+        # set once build_atlas packed the current layers
+        self.atlas_fdpath = None
+        self.layers = {}
+        # relpath below traits -> [size, mtime_ns] of the converted source
+        self.sources = None
+        self._cached_fpaths = {}
+
+    @property
+    def layers_fdpath(self):
+        width, height = self.size
+        return os.path.join(self.cache_fdpath, f"{width}x{height}")
+
+    def scan(self):
+        """
+        Returns:
+            dict: key=layer fpath below traits, value=(mode, size), headers only
+        """
+        layers = {}
+        unreadable = []
+        for fdpath, fdnames, fnames in os.walk(self.traits_fdpath):
+            fdnames.sort()
+            for fname in sorted(fnames):
+                if not fname.endswith(LAYER_EXTENSION) or fname.startswith("."):
+                    continue
+                fpath = os.path.join(fdpath, fname)
+                try:
+                    with Image.open(fpath) as f:
+                        layers[fpath] = (f.mode, f.size)
+                except OSError:
+                    unreadable.append(fpath)
+        if unreadable:
+            raise PreflightError(
+                f"{len(unreadable)} unreadable layers, i.e. {unreadable[:10]}"
+            )
+        return layers
+
+    def cached_fpath(self, fpath):
+        """
+        Args:
+            fpath (str): layer below traits
+
+        Returns:
+            str: its canonical copy
+        """
+        relpath = os.path.relpath(os.path.normpath(fpath), self.traits_fdpath)
+        return os.path.join(self.layers_fdpath, relpath)
+
+    def plan(self, image_plan):
+        """
+        Args:
+            image_plan (list of str): layer fpaths below traits, bottom first
+
+        Returns:
+            list of str: canonical copies of the same layers
+        """
+        plan = []
+        for fpath in image_plan:
+            try:
+                plan.append(self._cached_fpaths[fpath])
+            except KeyError:
+                cached_fpath = self._cached_fpaths[fpath] = self.cached_fpath(fpath)
+                plan.append(cached_fpath)
+        return plan
+
+    def source_key(self, fpath):
+        """
+        Returns:
+            list of int: size and mtime_ns of a layer below traits
+        """
+        stat = os.stat(fpath)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def load_sources(self):
+        try:
+            with open(
+                os.path.join(self.layers_fdpath, SOURCES_FNAME), "r", encoding="utf-8"
+            ) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def save_sources(self):
+        """merged with entries saved meanwhile, i.e. by another shard"""
+        sources_fpath = os.path.join(self.layers_fdpath, SOURCES_FNAME)
+        os.makedirs(self.layers_fdpath, exist_ok=True)
+        sources = self.load_sources()
+        sources.update(self.sources)
+        self.sources = sources
+
+        def write(temp_fpath):
+            with open(temp_fpath, "w", encoding="utf-8") as f:
+                json.dump(sources, f)
+
+        sw.replace_from_temp(sources_fpath, write)
+
+    def is_current(self, fpath):
+        """
+        Returns:
+            bool: True if the cached copy was converted from this exact source
+        """
+        if self.sources is None:
+            self.sources = self.load_sources()
+        relpath = os.path.relpath(os.path.normpath(fpath), self.traits_fdpath)
+        if self.sources.get(relpath) != self.source_key(fpath):
+            return False
+        return os.path.exists(self.cached_fpath(fpath))
+
+    def convert(self, fpath):
+        """
+        Returns:
+            list of int: source_key of the layer that was converted
+        """
+        source_key = self.source_key(fpath)
+        cached_fpath = self.cached_fpath(fpath)
+        os.makedirs(os.path.dirname(cached_fpath), exist_ok=True)
+        with st.timer("layers.convert"):
+            with Image.open(fpath) as f:
+                layer = f.convert(CANONICAL_MODE) if f.mode != CANONICAL_MODE else f
+                if layer.size != self.size:
+                    layer = layer.resize(self.size, Image.LANCZOS)
+                kwargs = {"compress_level": CACHE_COMPRESS_LEVEL}
+                if "icc_profile" in f.info:
+                    kwargs["icc_profile"] = f.info["icc_profile"]
+                # shards on several machines may preflight the same cache
+                sw.replace_from_temp(
+                    cached_fpath,
+                    lambda temp_fpath: layer.save(temp_fpath, "PNG", **kwargs),
+                )
+        return source_key
+
+    def preflight(self, workers=1):
+        """check every layer and convert the ones not in the cache yet
+
+        Args:
+            workers (int): number of conversion threads
+
+        Returns:
+            int: number of layers converted
+        """
+        layers = self.layers = self.scan()
+        sizes = Counter(size for _, size in layers.values())
+        if self.size is None:
+            if not sizes:
+                raise PreflightError(f"no layers in {self.traits_fdpath}")
+            self.size = sizes.most_common(1)[0][0]
+            wrong_size = [
+                f"{os.path.relpath(fpath, self.traits_fdpath)} is {size[0]}x{size[1]}"
+                for fpath, (_, size) in layers.items()
+                if size != self.size
+            ]
+            if wrong_size:
+                raise PreflightError(
+                    f"{len(wrong_size)} layers are not "
+                    f"{self.size[0]}x{self.size[1]}, i.e. {wrong_size[:10]}"
+                )
+
+        modes = Counter(mode for mode, _ in layers.values())
+        logger.info(
+            f"preflight: {len(layers)} layers, {dict(modes)} to "
+            f"{CANONICAL_MODE} {self.size[0]}x{self.size[1]}"
+        )
+        stale = [fpath for fpath in layers if not self.is_current(fpath)]
+        if not stale:
+            return 0
+
+        progress = sp.Progress("layers", total=len(stale), unit="layers")
+        with ThreadPoolExecutor(max_workers=max(1, workers or 1)) as executor:
+            for fpath, source_key in zip(stale, executor.map(self.convert, stale)):
+                relpath = os.path.relpath(fpath, self.traits_fdpath)
+                self.sources[relpath] = source_key
+                progress.update()
+        progress.done()
+        self.save_sources()
+        self.num_converted += len(stale)
+        return len(stale)
+
+    def build_atlas(self):
+        """pack every canonical layer into the atlas, after preflight
+
+        Returns:
+            bool: True if the atlas was written, False if it was current
+        """
+        index_fpath = os.path.join(self.layers_fdpath, ATLAS_INDEX_FNAME)
+        mtimes = {
+            os.path.relpath(self.cached_fpath(fpath), self.layers_fdpath): os.stat(
+                self.cached_fpath(fpath)
+            ).st_mtime_ns
+            for fpath in self.layers
+        }
+        try:
+            with open(index_fpath, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            index = {}
+        if index.get("version") == ATLAS_VERSION and mtimes == {
+            relpath: entry["mtime_ns"] for relpath, entry in index["layers"].items()
+        }:
+            self.atlas_fdpath = self.layers_fdpath
+            return False
+
+        width, height = self.size
+        layer_nbytes = width * height * 4
+        atlas_fpath = os.path.join(self.layers_fdpath, ATLAS_FNAME)
+        entries = {}
+
+        def write_atlas(temp_fpath):
+            with open(temp_fpath, "wb") as f:
+                for num, (relpath, mtime_ns) in enumerate(sorted(mtimes.items())):
+                    with Image.open(os.path.join(self.layers_fdpath, relpath)) as layer:
+                        rgba = np.asarray(layer.convert(CANONICAL_MODE))
+                    ys, xs = np.nonzero(rgba[..., 3])
+                    bbox = None
+                    if len(ys):
+                        bbox = [
+                            int(ys.min()),
+                            int(ys.max()) + 1,
+                            int(xs.min()),
+                            int(xs.max()) + 1,
+                        ]
+                    f.write(rgba.tobytes())
+                    entries[relpath] = {
+                        "offset": num * layer_nbytes,
+                        "bbox": bbox,
+                        "mtime_ns": mtime_ns,
+                    }
+
+        with st.timer("layers.atlas"):
+            sw.replace_from_temp(atlas_fpath, write_atlas)
+
+        index = {
+            "version": ATLAS_VERSION,
+            "width": width,
+            "height": height,
+            "layers": entries,
+        }
+
+        def write_index(temp_fpath):
+            with open(temp_fpath, "w", encoding="utf-8") as f:
+                json.dump(index, f)
+
+        sw.replace_from_temp(index_fpath, write_index)
+        logger.info(
+            f"Packed {len(entries)} layers into {atlas_fpath}, "
+            f"{len(entries) * layer_nbytes / 1024 / 1024:.0f}MB"
+        )
+        self.atlas_fdpath = self.layers_fdpath
+        return True
+
+
+class LayerAtlas:
+    """read-only view of an atlas written by LayerStore.build_atlas
+
+    Layers are numpy views into the mmap, nothing is decoded or copied. The
+    icc_profile of layers is not kept in the atlas.
+    """
+
+    def __init__(self, fdpath):
+        """
+        Args:
+            fdpath (str): LayerStore.atlas_fdpath
+        """
+        self.fdpath = fdpath
+        with open(os.path.join(fdpath, ATLAS_INDEX_FNAME), "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index["version"] != ATLAS_VERSION:
+            raise PreflightError(f"unsupported atlas version {index['version']}")
+        self.width = index["width"]
+        self.height = index["height"]
+        self.layers = index["layers"]
+        with open(os.path.join(fdpath, ATLAS_FNAME), "rb") as f:
+            # the mapping stays valid after the file is closed
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.pixels = np.frombuffer(self.mmap, dtype=np.uint8)
+
+    def get(self, fpath):
+        """
+        Args:
+            fpath (str): canonical layer, see LayerStore.cached_fpath
+
+        Returns:
+            tuple: read-only uint8 (height, width, 4) view, bbox of non
+                transparent pixels as y0, y1, x0, x1 or None
+        """
+        entry = self.layers[os.path.relpath(fpath, self.fdpath)]
+        offset = entry["offset"]
+        nbytes = self.width * self.height * 4
+        rgba = self.pixels[offset : offset + nbytes].reshape(self.height, self.width, 4)
+        bbox = tuple(entry["bbox"]) if entry["bbox"] is not None else None
+        return rgba, bbox
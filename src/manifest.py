@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import threading
+
+# src
+import src.timers as st
+import src.writers as sw
+
+# logging
+import logging
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def sha256_file(fpath):
+    h = hashlib.sha256()
+    with open(fpath, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def digest(*parts):
+    """
+    Args:
+        parts (str): hashes or settings, order matters
+
+    Returns:
+        str: sha256 of the parts
+    """
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+class BuildManifest:
+    """hashes of the inputs each token was last built from
+
+    Files are hashed once and remembered with their size and mtime, so later
+    runs only stat unchanged files. Each stage records one digest per token
+    over the hashes of its inputs; a token whose digest differs from the
+    recorded one has to be rebuilt.
+
+    Layout of projects/<project_name>/.cache/manifest.json:
+        files: key=fpath, value=[size, mtime_ns, sha256]
+        stages: key=stage, value=dict of key=token_num, value=digest
+
+    Runs over part of the collection save to manifest-<shard>.json instead,
+    so machines sharing the project folder never rewrite each other's
+    records; merge_manifests folds them back in.
+    """
+
+    def __init__(self, fpath):
+        """
+        Args:
+            fpath (str): manifest json
+        """
+        self.fpath = fpath
+        self.files = {}
+        self.stages = {}
+        self.num_hashed = 0
+        # combining assets records from several threads
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_project(cls, project_fdpath, shard=None):
+        """
+        Args:
+            project_fdpath (str): projects/<project_name>
+            shard (optional, str): token range of a partial run, reads the
+                project manifest and saves to the one of the shard
+        """
+        cache_fdpath = os.path.join(project_fdpath, ".cache")
+        if shard is None:
+            manifest = cls(os.path.join(cache_fdpath, "manifest.json"))
+        else:
+            manifest = cls(os.path.join(cache_fdpath, f"manifest-{shard}.json"))
+            manifest.load(os.path.join(cache_fdpath, "manifest.json"))
+        manifest.load()
+        return manifest
+
+    def load(self, fpath=None):
+        """
+        Args:
+            fpath (optional, str): manifest to merge in, default is self.fpath
+        """
+        fpath = fpath or self.fpath
+        try:
+            with open(fpath, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logger.warning(f"Ignoring unreadable manifest {fpath}")
+            return
+        if payload.get("version") != MANIFEST_VERSION:
+            logger.warning(f"Ignoring manifest version {payload.get('version')}")
+            return
+        self.files.update(payload["files"])
+        for stage, records in payload["stages"].items():
+            self.stages.setdefault(stage, {}).update(records)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.fpath), exist_ok=True)
+        payload = {
+            "version": MANIFEST_VERSION,
+            "files": self.files,
+            "stages": self.stages,
+        }
+        temp_fpath = sw.temp_fpath_for(self.fpath)
+        with open(temp_fpath, "w", encoding="utf-8") as f:
+            json.dump(payload, f, separators=(",", ":"))
+        os.replace(temp_fpath, self.fpath)
+        logger.info(f"Saved manifest, hashed {self.num_hashed} changed files")
+
+    def file_hash(self, fpath):
+        """
+        Args:
+            fpath (str): input file
+
+        Returns:
+            str: sha256 of the contents, rehashed only if size or mtime changed
+        """
+        file_stat = os.stat(fpath)
+        entry = self.files.get(fpath)
+        if (
+            entry is not None
+            and entry[0] == file_stat.st_size
+            and entry[1] == file_stat.st_mtime_ns
+        ):
+            return entry[2]
+
+        with st.timer("manifest.hash"):
+            file_hash = sha256_file(fpath)
+        with self.lock:
+            self.files[fpath] = [file_stat.st_size, file_stat.st_mtime_ns, file_hash]
+            self.num_hashed += 1
+        return file_hash
+
+    def plan_digest(self, image_plan, *settings):
+        """
+        Args:
+            image_plan (list of str): layer fpaths, bottom first
+            settings (str): i.e. encoder settings, changing them also rebuilds
+
+        Returns:
+            str: digest over the contents of every layer, in order
+        """
+        return digest(*[self.file_hash(fpath) for fpath in image_plan], *settings)
+
+    def is_current(self, stage, token_num, token_digest):
+        """
+        Returns:
+            bool: True if token_num was last built from the same inputs
+        """
+        return self.stages.get(stage, {}).get(str(token_num)) == token_digest
+
+    def record(self, stage, token_num, token_digest):
+        with self.lock:
+            self.stages.setdefault(stage, {})[str(token_num)] = token_digest
+
+
+def merge_manifests(project_fdpath):
+    """fold the manifests of shards into the project manifest
+
+    Returns:
+        int: number of shard manifests merged
+    """
+    cache_fdpath = os.path.join(project_fdpath, ".cache")
+    try:
+        shard_fnames = sorted(
+            fname
+            for fname in os.listdir(cache_fdpath)
+            if fname.startswith("manifest-") and fname.endswith(".json")
+        )
+    except FileNotFoundError:
+        return 0
+    if not shard_fnames:
+        return 0
+
+    manifest = BuildManifest.for_project(project_fdpath)
+    for fname in shard_fnames:
+        manifest.load(os.path.join(cache_fdpath, fname))
+    manifest.save()
+    for fname in shard_fnames:
+        os.unlink(os.path.join(cache_fdpath, fname))
+    logger.info(f"Merged {len(shard_fnames)} shard manifests")
+    return len(shard_fnames)
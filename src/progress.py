@@ -0,0 +1,87 @@
+import threading
+import time
+
+# logging
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 5.0
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return f"{hours}h{minutes:02}m"
+    if minutes:
+        return f"{minutes}m{seconds:02}s"
+    return f"{seconds}s"
+
+
+class Progress:
+    """periodic progress line for a stage instead of a log line per token
+
+    Usage:
+        progress = Progress("images", total=num_tokens)
+        for ...:
+            progress.update()
+        progress.done()
+    """
+
+    def __init__(
+        self, label, total=None, interval=DEFAULT_INTERVAL, clock=None, unit="tokens"
+    ):
+        """
+        Args:
+            label (str): stage name, starts every line
+            total (optional, int): expected number of tokens, enables the ETA
+            interval (float): seconds between progress lines
+            clock (optional, callable): seconds, default is time.monotonic
+            unit (str): what is counted, i.e. layers
+        """
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.clock = clock or time.monotonic
+        self.unit = unit
+        self.count = 0
+        self.started = self.clock()
+        self.last_logged = self.started
+        # combining assets updates from several threads
+        self.lock = threading.Lock()
+
+    def update(self, n=1):
+        with self.lock:
+            self.count += n
+            now = self.clock()
+            if now - self.last_logged < self.interval:
+                return
+            self.last_logged = now
+        logger.info(self.line(now))
+
+    def rate(self, now=None):
+        elapsed = (now or self.clock()) - self.started
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    def line(self, now=None):
+        now = now or self.clock()
+        rate = self.rate(now)
+        if self.total is None:
+            return f"{self.label}: {self.count} {self.unit}, {rate:.1f} {self.unit}/s"
+
+        line = (
+            f"{self.label}: {self.count}/{self.total} {self.unit}, "
+            f"{rate:.1f} {self.unit}/s"
+        )
+        if rate > 0 and self.count < self.total:
+            line += f", ETA {format_duration((self.total - self.count) / rate)}"
+        return line
+
+    def done(self):
+        now = self.clock()
+        logger.info(
+            f"{self.label}: {self.count} {self.unit} in "
+            f"{format_duration(now - self.started)}, {self.rate(now):.1f} {self.unit}/s"
+        )
@@ -0,0 +1,156 @@
+"""rarity of every (trait_type, value) and of every token
+
+Counts come straight from the code matrix of a scol.Collection, one
+bincount per trait type, so values with the same name in different trait
+types are never merged. Tokens lacking a trait type count as having its
+absent value, so a rare missing trait also makes a token rare.
+
+Token scores, rank 1 is the rarest token:
+    rarity: sum of 1 / frequency of its values, as listed by marketplaces,
+        higher is rarer, dominated by its single rarest value
+    information: information content, sum of -log2(frequency) of its values
+        in bits, higher is rarer, the log of the probability of the whole
+        combination, so several uncommon values can outrank one rare value
+
+Ties share the best rank (1, 2, 2, 4).
+"""
+
+import csv
+
+# third-party
+import numpy as np
+
+# src
+import src.collection as scol
+
+# logging
+import logging
+
+logger = logging.getLogger(__name__)
+
+ABSENT_VALUE = ""
+# scores equal up to float rounding are ties
+SCORE_DECIMALS = 9
+
+
+def competition_ranks(scores, descending=False):
+    """
+    Args:
+        scores (numpy.ndarray): one per token
+        descending (bool): highest score gets rank 1
+
+    Returns:
+        numpy.ndarray: int64 ranks starting at 1, ties share the best rank
+    """
+    keys = np.round(-scores if descending else scores, SCORE_DECIMALS)
+    return np.searchsorted(np.sort(keys), keys, side="left") + 1
+
+
+class Rarity:
+    """frequencies, scores and ranks of a collection
+
+    Usage:
+        rarity = Rarity(collection)
+        rarity.trait_value_counts()
+        rarity.write_csv("rarity.csv")
+
+    Attributes:
+        collection (scol.Collection): scored tokens
+        counts (list of numpy.ndarray): per column, index 0 counts tokens
+            without the trait type, index code + 1 tokens with that value
+        rarity_scores (numpy.ndarray): float64 per token
+        information_scores (numpy.ndarray): float64 per token, in bits
+        rarity_ranks (numpy.ndarray): int64 per token
+        information_ranks (numpy.ndarray): int64 per token
+    """
+
+    def __init__(self, collection):
+        """
+        Args:
+            collection (scol.Collection): tokens to score
+        """
+        self.collection = collection
+        num_tokens = len(collection)
+        self.counts = [
+            np.concatenate([[num_tokens - value_counts.sum()], value_counts])
+            for value_counts in collection.value_counts()
+        ]
+
+        codes = collection.codes.astype(np.intp) + 1
+        self.rarity_scores = np.zeros(num_tokens)
+        self.information_scores = np.zeros(num_tokens)
+        for column, counts in enumerate(self.counts):
+            # every looked up value has a positive count
+            frequencies = (counts / max(num_tokens, 1))[codes[:, column]]
+            self.rarity_scores += 1.0 / frequencies
+            self.information_scores -= np.log2(frequencies)
+        self.rarity_ranks = competition_ranks(self.rarity_scores, descending=True)
+        self.information_ranks = competition_ranks(
+            self.information_scores, descending=True
+        )
+
+    def trait_type_counts(self):
+        """
+        Returns:
+            dict: key=trait_type, value=number of tokens with it
+        """
+        num_tokens = len(self.collection)
+        return {
+            trait_type: int(num_tokens - counts[0])
+            for trait_type, counts in zip(self.collection.trait_types, self.counts)
+        }
+
+    def trait_value_counts(self):
+        """
+        Returns:
+            dict: key=trait_type, value=dict of key=value, value=number of tokens
+        """
+        return {
+            trait_type: {
+                value: int(count) for value, count in zip(values, counts[1:]) if count
+            }
+            for trait_type, values, counts in zip(
+                self.collection.trait_types, self.collection.values, self.counts
+            )
+        }
+
+    def write_csv(self, fpath):
+        """one row per token, by information rank, with its values for listings
+
+        Args:
+            fpath (str): rarity csv
+        """
+        collection = self.collection
+        order = np.lexsort((collection.token_nums, self.information_ranks))
+        with open(fpath, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(
+                [
+                    "token_num",
+                    "information_rank",
+                    "information_score",
+                    "rarity_rank",
+                    "rarity_score",
+                ]
+                + collection.trait_types
+            )
+            codes = collection.codes[order].tolist()
+            columns = [
+                collection.token_nums[order].tolist(),
+                self.information_ranks[order].tolist(),
+                self.information_scores[order].tolist(),
+                self.rarity_ranks[order].tolist(),
+                self.rarity_scores[order].tolist(),
+            ]
+            for (token_num, i_rank, i_score, r_rank, r_score), row in zip(
+                zip(*columns), codes
+            ):
+                values = [
+                    column_values[code] if code != scol.ABSENT else ABSENT_VALUE
+                    for column_values, code in zip(collection.values, row)
+                ]
+                writer.writerow(
+                    [token_num, i_rank, f"{i_score:.6f}", r_rank, f"{r_score:.6f}"]
+                    + values
+                )
+        logger.info(f"Rarity of {len(collection)} tokens in {fpath}")
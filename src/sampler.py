@@ -0,0 +1,785 @@
+import itertools
+import math
+import random
+
+# third-party
+import numpy as np
+
+# logging
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+MASK64 = (1 << 64) - 1
+
+
+def splitmix64(x):
+    """
+    Args:
+        x (int): any integer, used modulo 2**64
+
+    Returns:
+        int: well mixed 64 bit integer
+    """
+    x = (x + 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+
+def splitmix64_array(x):
+    """splitmix64 of a uint64 numpy array, wraps around like the int version"""
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+class TokenRNG:
+    """counter based uniforms, a pure function of (seed, token_num, draw)
+
+    No state is carried from one token to the next, so any range of tokens can
+    be regenerated on its own, in any order or in parallel, with identical
+    results.
+    """
+
+    def __init__(self, seed):
+        """
+        Args:
+            seed (int): collection seed
+        """
+        self.seed = seed
+        self.key = splitmix64(seed & MASK64)
+
+    def token_key(self, token_num):
+        return splitmix64(self.key ^ token_num)
+
+    def uniforms(self, token_num, num_draws, offset=0):
+        """
+        Args:
+            token_num (int): token number
+            num_draws (int): number of uniforms
+            offset (int): index of the first draw, i.e. for redraws
+
+        Returns:
+            list of float: uniforms in [0, 1)
+        """
+        token_key = self.token_key(token_num)
+        return [
+            (splitmix64(token_key + draw) >> 11) * 2.0**-53
+            for draw in range(offset, offset + num_draws)
+        ]
+
+    def uniforms_batch(self, token_nums, num_draws, offset=0):
+        """
+        Args:
+            token_nums (sequence of int): token numbers
+            num_draws (int): number of uniforms per token
+            offset (int): index of the first draw
+
+        Returns:
+            numpy.ndarray: (len(token_nums), num_draws) same values as uniforms
+        """
+        token_nums = np.asarray(token_nums, dtype=np.uint64)
+        token_keys = splitmix64_array(np.uint64(self.key) ^ token_nums)
+        draws = np.arange(offset, offset + num_draws, dtype=np.uint64)
+        mixed = splitmix64_array(token_keys[:, None] + draws[None, :])
+        return (mixed >> np.uint64(11)).astype(np.float64) * 2.0**-53
+
+
+def make_seed():
+    """random seed for runs without --seed, log it to regenerate the run"""
+    return random.SystemRandom().getrandbits(63)
+
+
+class AliasTable:
+    """Vose's alias method, one uniform draw picks a weighted value in O(1)"""
+
+    def __init__(self, values, weights):
+        """
+        Args:
+            values (list of str): trait values
+            weights (list of number): relative weights, same order as values
+        """
+        n = len(values)
+        try:
+            total = sum(weights)
+        except TypeError:
+            raise ValueError(f"bad rarity in {values=} {weights=}")
+        if not n or total <= 0:
+            raise ValueError(f"no positive weights in {values=}")
+
+        scaled = [w * n / total for w in weights]
+        prob = [1.0] * n
+        alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+
+        self.values = list(values)
+        self.probabilities = [w / total for w in weights]
+        self.prob = prob
+        self.alias = alias
+        self.prob_array = np.array(prob, dtype=np.float64)
+        self.alias_array = np.array(alias, dtype=np.int64)
+
+    def draw(self, u):
+        """
+        Args:
+            u (float): uniform in [0, 1)
+
+        Returns:
+            int: index into values
+        """
+        n = len(self.prob)
+        x = u * n
+        i = min(int(x), n - 1)
+        if x - i < self.prob[i]:
+            return i
+        return self.alias[i]
+
+    def draw_batch(self, u):
+        """
+        Args:
+            u (numpy.ndarray): uniforms in [0, 1)
+
+        Returns:
+            numpy.ndarray: indices into values
+        """
+        n = len(self.prob)
+        x = u * n
+        i = np.minimum(x.astype(np.int64), n - 1)
+        keep = (x - i) < self.prob_array[i]
+        return np.where(keep, i, self.alias_array[i])
+
+
+class TraitNode:
+    """one trait type, drawn from a flat table or from the table picked by the
+    value of a parent trait
+
+    Attributes:
+        trait_type (str): trait type
+        parents (list of str): trait types, the last one whose selected value
+            has a table picks it, empty for a flat table
+        tables (dict): key=parent value or None for flat, value=AliasTable
+        values (list of str): every value of the node, codes index into it
+    """
+
+    def __init__(self, trait_type, tables, parents=None):
+        self.trait_type = trait_type
+        self.parents = parents or []
+        self.tables = tables
+        self.values = []
+        codes = {}
+        # table index -> node code, so batches are decoded with one lookup
+        self.code_lists = {}
+        self.code_maps = {}
+        for key, table in tables.items():
+            for value in table.values:
+                if value not in codes:
+                    codes[value] = len(self.values)
+                    self.values.append(value)
+            self.code_lists[key] = [codes[value] for value in table.values]
+            self.code_maps[key] = np.array(self.code_lists[key], dtype=np.int32)
+        self.codes = codes
+
+    def table_for(self, selected):
+        """
+        Args:
+            selected (dict): key=parent trait type, value=selected value
+
+        Returns:
+            tuple: table key and AliasTable, None if no parent value has a table
+        """
+        if not self.parents:
+            return None, self.tables[None]
+        for parent in reversed(self.parents):
+            key = selected.get(parent)
+            if key in self.tables:
+                return key, self.tables[key]
+        return None, None
+
+
+def weighted_table(weights_by_value, trait_type):
+    try:
+        return AliasTable(
+            values=list(weights_by_value.keys()),
+            weights=list(weights_by_value.values()),
+        )
+    except (AttributeError, ValueError):
+        raise ValueError(f"bad rarity in {trait_type=}")
+
+
+class TraitSampler:
+    """trait config compiled once into alias tables
+
+    Root nodes are drawn first, dependent nodes then use the selected root
+    values to pick their table. Every node consumes exactly one uniform per
+    token, whether or not it ends up in the attributes.
+    """
+
+    def __init__(self, roots, dependents):
+        """
+        Args:
+            roots (list of TraitNode): flat nodes, drawn first
+            dependents (list of TraitNode): nodes with root parents
+        """
+        self.roots = roots
+        self.dependents = dependents
+        self.nodes = roots + dependents
+
+    @classmethod
+    def from_traits(cls, traits):
+        """
+        Args:
+            traits (dict): config[project_name]["traits"]
+        """
+        if traits.get("trait_algorithm") == "combo":
+            return cls.from_traits_combo(traits)
+        return cls.from_traits_basic(traits)
+
+    @classmethod
+    def from_traits_basic(cls, traits):
+        """basic and restricted algorithms, same selection as the original
+        generate_random_attributes: restrictions first, then the other trait
+        types from the table of the selected restriction value
+        """
+        tv = traits["trait_values"]
+        try:
+            trait_restrictions = traits["trait_restrictions"]
+        except KeyError:
+            trait_restrictions = []
+
+        restricted_types = [
+            tt for tt in traits["trait_types"] if tt in trait_restrictions
+        ]
+        unrestricted_types = [
+            tt for tt in traits["trait_types"] if tt not in trait_restrictions
+        ]
+
+        roots = [
+            TraitNode(tt, {None: weighted_table(tv[tt], tt)}) for tt in restricted_types
+        ]
+        dependents = []
+        for tt in unrestricted_types:
+            if restricted_types:
+                for restriction in restricted_types:
+                    for restriction_value in tv[restriction]:
+                        if restriction_value not in tv[tt]:
+                            raise ValueError(
+                                f"missing {restriction_value=} in {tt} trait_values"
+                            )
+                tables = {
+                    key: weighted_table(weights, tt) for key, weights in tv[tt].items()
+                }
+                dependents.append(TraitNode(tt, tables, parents=restricted_types))
+            else:
+                roots.append(TraitNode(tt, {None: weighted_table(tv[tt], tt)}))
+        return cls(roots=roots, dependents=dependents)
+
+    @classmethod
+    def from_traits_combo(cls, traits):
+        """combo algorithm, same selection as the original
+        TokenTool.random_attributes: wildcard "any" levels first, then every
+        sublevel named after a selected wildcard value
+        """
+        tv = traits["trait_values"]
+        wildcard_types = [tt for tt in tv if "any" in tv[tt]]
+
+        roots = [
+            TraitNode(tt, {None: weighted_table(tv[tt]["any"], tt)})
+            for tt in wildcard_types
+        ]
+        dependents = []
+        for tt in tv:
+            tables = {
+                key: weighted_table(weights, tt)
+                for key, weights in tv[tt].items()
+                if key != "any"
+            }
+            if tables:
+                dependents.append(TraitNode(tt, tables, parents=wildcard_types))
+        return cls(roots=roots, dependents=dependents)
+
+    def sample_row(self, uniforms=None, rng=random):
+        """draw one token as value codes
+
+        Args:
+            uniforms (optional, list of float): one per node, default draws
+                them from rng
+            rng (random.Random): used without uniforms
+
+        Returns:
+            list of int: codes index into node.values, -1 where absent
+        """
+        if uniforms is None:
+            uniforms = [rng.random() for _ in self.nodes]
+
+        row = []
+        selected = {}
+        for node, u in zip(self.roots, uniforms):
+            table = node.tables[None]
+            code = node.code_lists[None][table.draw(u)]
+            selected[node.trait_type] = node.values[code]
+            row.append(code)
+
+        for node, u in zip(self.dependents, uniforms[len(self.roots) :]):
+            key, table = node.table_for(selected)
+            if table is None:
+                row.append(-1)
+            else:
+                row.append(node.code_lists[key][table.draw(u)])
+        return row
+
+    def sample(self, uniforms=None, rng=random):
+        """draw one token
+
+        Args:
+            uniforms (optional, list of float): one per node, default draws
+                them from rng
+            rng (random.Random): used without uniforms
+
+        Returns:
+            dict: key=trait_type, value=trait_value in metadata order
+        """
+        return self.decode(self.sample_row(uniforms=uniforms, rng=rng))
+
+    def sample_codes(self, uniforms):
+        """draw a batch of tokens as value codes
+
+        Args:
+            uniforms (numpy.ndarray): (num_tokens, len(nodes)) in [0, 1)
+
+        Returns:
+            numpy.ndarray: int32 (num_tokens, len(nodes)), codes index into
+                node.values, -1 where the trait is absent
+        """
+        num_tokens = uniforms.shape[0]
+        codes = np.full((num_tokens, len(self.nodes)), -1, dtype=np.int32)
+
+        for i, node in enumerate(self.roots):
+            table = node.tables[None]
+            codes[:, i] = node.code_maps[None][table.draw_batch(uniforms[:, i])]
+
+        for j, node in enumerate(self.dependents, start=len(self.roots)):
+            for key, rows in self.table_rows(node, codes):
+                table = node.tables[key]
+                draws = table.draw_batch(uniforms[rows, j])
+                codes[rows, j] = node.code_maps[key][draws]
+        return codes
+
+    def table_rows(self, node, codes):
+        """group the tokens of a batch by the table of a dependent node
+
+        Args:
+            node (TraitNode): one of dependents
+            codes (numpy.ndarray): batch with the root columns filled in
+
+        Yields:
+            tuple: table key, numpy.ndarray of row indices drawing from it
+        """
+        columns = {root.trait_type: i for i, root in enumerate(self.roots)}
+        # the last parent whose selected value has a table picks it
+        table_keys = list(node.tables)
+        picked = np.full(codes.shape[0], -1, dtype=np.int32)
+        for parent in node.parents:
+            parent_codes = codes[:, columns[parent]]
+            parent_node = self.roots[columns[parent]]
+            for k, key in enumerate(table_keys):
+                try:
+                    parent_code = parent_node.codes[key]
+                except KeyError:
+                    continue
+                picked[parent_codes == parent_code] = k
+
+        for k, key in enumerate(table_keys):
+            rows = np.nonzero(picked == k)[0]
+            if len(rows):
+                yield key, rows
+
+    def decode(self, row):
+        """
+        Args:
+            row (sequence of int): codes of one token, see sample_codes
+
+        Returns:
+            dict: key=trait_type, value=trait_value in metadata order
+        """
+        selected = {}
+        dependent_selected = {}
+        for i, (node, code) in enumerate(zip(self.nodes, row)):
+            if code < 0:
+                continue
+            if i < len(self.roots):
+                selected[node.trait_type] = node.values[code]
+            else:
+                dependent_selected[node.trait_type] = node.values[code]
+        return {**selected, **dependent_selected}
+
+    def sample_batch(self, num_tokens, rng=None):
+        """
+        Args:
+            num_tokens (int): number of tokens
+            rng (optional, numpy.random.Generator): default is unseeded
+
+        Returns:
+            list of dict: attributes per token, see sample
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        codes = self.sample_codes(rng.random((num_tokens, len(self.nodes))))
+        return [self.decode(row) for row in codes.tolist()]
+
+    def capacity(self):
+        """
+        Returns:
+            int: number of distinct attribute combinations with a positive
+                probability
+        """
+        parent_types = {parent for node in self.dependents for parent in node.parents}
+        parent_roots = [node for node in self.roots if node.trait_type in parent_types]
+        capacity = 1
+        for node in self.roots:
+            if node.trait_type not in parent_types:
+                capacity *= sum(p > 0 for p in node.tables[None].probabilities)
+
+        dependent_capacity = 0
+        for parent_values in itertools.product(
+            *[
+                [
+                    v
+                    for v, p in zip(n.tables[None].values, n.tables[None].probabilities)
+                    if p > 0
+                ]
+                for n in parent_roots
+            ]
+        ):
+            selected = {n.trait_type: v for n, v in zip(parent_roots, parent_values)}
+            combinations = 1
+            for node in self.dependents:
+                _, table = node.table_for(selected)
+                if table is not None:
+                    combinations *= sum(p > 0 for p in table.probabilities)
+            dependent_capacity += combinations
+        return capacity * dependent_capacity
+
+    def _choices(self, node, key, table):
+        return [
+            (node.code_lists[key][i], p)
+            for i, p in enumerate(table.probabilities)
+            if p > 0
+        ]
+
+    def enumerate_rows(self):
+        """every combination with a positive probability
+
+        Yields:
+            tuple: (list of int, float) codes as in sample_row, probability
+        """
+        root_choices = [
+            self._choices(node, None, node.tables[None]) for node in self.roots
+        ]
+        for root_combo in itertools.product(*root_choices):
+            selected = {
+                node.trait_type: node.values[code]
+                for node, (code, _) in zip(self.roots, root_combo)
+            }
+            dependent_choices = []
+            for node in self.dependents:
+                key, table = node.table_for(selected)
+                if table is None:
+                    dependent_choices.append([(-1, 1.0)])
+                else:
+                    dependent_choices.append(self._choices(node, key, table))
+            for dependent_combo in itertools.product(*dependent_choices):
+                combo = root_combo + dependent_combo
+                yield [code for code, _ in combo], math.prod(p for _, p in combo)
+
+
+class UniqueIndex:
+    """attribute combinations already drawn, each packed into one integer"""
+
+    def __init__(self, sampler):
+        # 0 is reserved for absent traits
+        self.radices = [len(node.values) + 1 for node in sampler.nodes]
+        self.keys = set()
+
+    def key(self, row):
+        key = 0
+        for code, radix in zip(row, self.radices):
+            key = key * radix + code + 1
+        return key
+
+    def add(self, row):
+        """
+        Returns:
+            bool: False if the combination was already drawn
+        """
+        key = self.key(row)
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        return True
+
+
+# keeps without-replacement uniforms apart from the per-token draws
+EXHAUSTIVE_OFFSET = 1 << 32
+# enumerating holds every combination in memory, only when the collection
+# is a large share of the capacity and the capacity is small
+EXHAUSTIVE_MAX_RATIO = 20
+EXHAUSTIVE_MAX_COMBINATIONS = 10_000_000
+
+
+def dominant_value(sampler):
+    """
+    Returns:
+        tuple: (trait_type, value, probability) of the most likely value
+    """
+    return max(
+        (
+            (node.trait_type, value, p)
+            for node in sampler.nodes
+            for table in node.tables.values()
+            for value, p in zip(table.values, table.probabilities)
+        ),
+        key=lambda item: item[2],
+    )
+
+
+def unique_rows(
+    sampler, rng, num_tokens, start=0, end=None, max_attempts=100, exhaustive_ratio=0.5
+):
+    """draw tokens whose attribute combinations are all different
+
+    Collisions are redrawn from the next uniforms of the same token. Close to
+    the capacity of the trait tree, or when redraws keep colliding and the
+    capacity is small enough to hold in memory, every combination is
+    enumerated and num_tokens are sampled without replacement
+    (Efraimidis-Spirakis keys), so the run always terminates.
+
+    Tokens depend on the ones drawn before them, and whether the collection
+    falls back to enumerating depends on every token, so a range replays the
+    whole collection and returns its slice. Shards then match a full run.
+
+    Args:
+        sampler (TraitSampler): compiled traits
+        rng (TokenRNG): seeded uniforms
+        num_tokens (int): size of the whole collection
+        start (int): first token returned
+        end (optional, int): last token returned + 1, default is num_tokens
+        max_attempts (int): redraws per token before enumerating
+        exhaustive_ratio (float): enumerate from num_tokens / capacity
+
+    Returns:
+        list of tuple: (token_num, row) for start to end
+
+    Raises:
+        ValueError: more tokens than combinations, or redraws keep colliding
+            and there are too many combinations to enumerate
+    """
+    end = num_tokens if end is None else end
+    capacity = sampler.capacity()
+    if num_tokens > capacity:
+        raise ValueError(f"{num_tokens=} exceeds {capacity} unique combinations")
+
+    if num_tokens < exhaustive_ratio * capacity:
+        rows = []
+        index = UniqueIndex(sampler)
+        num_draws = len(sampler.nodes)
+        num_collisions = 0
+        for token_num in range(0, num_tokens):
+            for attempt in range(max_attempts):
+                uniforms = rng.uniforms(
+                    token_num=token_num,
+                    num_draws=num_draws,
+                    offset=attempt * num_draws,
+                )
+                row = sampler.sample_row(uniforms=uniforms)
+                if index.add(row):
+                    break
+                num_collisions += 1
+            else:
+                if capacity > min(
+                    EXHAUSTIVE_MAX_RATIO * num_tokens, EXHAUSTIVE_MAX_COMBINATIONS
+                ):
+                    trait_type, value, p = dominant_value(sampler)
+                    raise ValueError(
+                        f"token {token_num} still collides after {max_attempts} "
+                        f"redraws and {capacity} combinations are too many to "
+                        f"enumerate, {trait_type}={value!r} has {p:.4%} of its "
+                        f"weight, lower it or disable trait_unique"
+                    )
+                logger.warning(
+                    f"token {token_num} still collides after {max_attempts} redraws, "
+                    f"sampling without replacement"
+                )
+                break
+            rows.append((token_num, row))
+        else:
+            logger.info(f"unique tokens: {num_collisions} collisions redrawn")
+            return rows[start:end]
+
+    logger.info(f"sampling {num_tokens} of {capacity} combinations without replacement")
+    keyed = []
+    for combo_num, (row, p) in enumerate(sampler.enumerate_rows()):
+        u = rng.uniforms(token_num=combo_num, num_draws=1, offset=EXHAUSTIVE_OFFSET)[0]
+        # log of u ** (1 / p), the largest keys are a weighted sample
+        keyed.append((math.log(1.0 - u) / p, row))
+    keyed.sort(key=lambda pair: pair[0], reverse=True)
+    return [(token_num, keyed[token_num][1]) for token_num in range(start, end)]
+
+
+def largest_remainder(probabilities, total):
+    """
+    Args:
+        probabilities (list of float): sum to 1
+        total (int): number to split
+
+    Returns:
+        list of int: counts summing to total, each within 1 of its share
+    """
+    shares = [p * total for p in probabilities]
+    counts = [math.floor(share) for share in shares]
+    by_remainder = sorted(
+        range(len(shares)), key=lambda i: shares[i] - counts[i], reverse=True
+    )
+    for i in by_remainder[: total - sum(counts)]:
+        counts[i] += 1
+    return counts
+
+
+# keeps the shuffles of quota allocation apart from the per-token draws
+QUOTA_OFFSET = 1 << 33
+
+ALLOCATIONS = ["random", "quota"]
+
+
+def quota_codes(sampler, rng, num_tokens):
+    """allocate exact counts of every trait value, then shuffle them over tokens
+
+    Root values get their largest remainder share of num_tokens. Dependent
+    values get their share of the tokens whose parent value selects their
+    table, so sublevels keep their weights within every parent value. Each
+    column is assigned in an order given by sorting per-token uniforms, which
+    keeps the allocation a pure function of the seed.
+
+    Args:
+        sampler (TraitSampler): compiled traits
+        rng (TokenRNG): seeded uniforms
+        num_tokens (int): size of the whole collection
+
+    Returns:
+        numpy.ndarray: int32 (num_tokens, len(nodes)), see sample_codes
+    """
+    codes = np.full((num_tokens, len(sampler.nodes)), -1, dtype=np.int32)
+    shuffle_keys = rng.uniforms_batch(
+        np.arange(num_tokens), num_draws=len(sampler.nodes), offset=QUOTA_OFFSET
+    )
+
+    def assign(rows, j, node, key):
+        table = node.tables[key]
+        counts = largest_remainder(table.probabilities, len(rows))
+        order = rows[np.argsort(shuffle_keys[rows, j], kind="stable")]
+        codes[order, j] = np.repeat(node.code_maps[key], counts)
+
+    all_rows = np.arange(num_tokens)
+    for j, node in enumerate(sampler.roots):
+        assign(all_rows, j, node, None)
+    for j, node in enumerate(sampler.dependents, start=len(sampler.roots)):
+        for key, rows in sampler.table_rows(node, codes):
+            assign(rows, j, node, key)
+    return codes
+
+
+# tokens drawn per batch of uniforms, bounds the float64 temporaries
+BATCH_TOKENS = 65536
+
+
+def generate_codes(
+    sampler, rng, start, end, num_tokens=None, unique=False, allocation="random"
+):
+    """
+    Args:
+        sampler (TraitSampler): compiled traits
+        rng (TokenRNG): seeded uniforms
+        start (int): first token
+        end (int): last token + 1
+        num_tokens (optional, int): size of the whole collection, required
+            when unique or allocating quotas
+        unique (bool): no two tokens share an attribute combination
+        allocation (str): random draws each token independently, quota gives
+            every value its exact share of the collection
+
+    Returns:
+        numpy.ndarray: int32 (end - start, len(nodes)), see sample_codes
+    """
+    if allocation not in ALLOCATIONS:
+        raise ValueError(f"invalid {allocation=}, choose from {ALLOCATIONS}")
+
+    if allocation == "quota":
+        if unique:
+            raise ValueError("trait_unique is not supported with quota allocation")
+        codes = quota_codes(sampler=sampler, rng=rng, num_tokens=num_tokens)
+        return codes[start:end]
+
+    if unique:
+        rows = unique_rows(
+            sampler=sampler, rng=rng, num_tokens=num_tokens, start=start, end=end
+        )
+        codes = np.array([row for _, row in rows], dtype=np.int32)
+        return codes.reshape(end - start, len(sampler.nodes))
+
+    # same draws as rng.uniforms per token, a batch at a time
+    num_draws = len(sampler.nodes)
+    codes = np.empty((end - start, num_draws), dtype=np.int32)
+    for batch_start in range(start, end, BATCH_TOKENS):
+        batch_end = min(batch_start + BATCH_TOKENS, end)
+        uniforms = rng.uniforms_batch(
+            np.arange(batch_start, batch_end), num_draws=num_draws
+        )
+        codes[batch_start - start : batch_end - start] = sampler.sample_codes(uniforms)
+    return codes
+
+
+def generate_attributes(
+    sampler, rng, start, end, num_tokens=None, unique=False, allocation="random"
+):
+    """
+    Args:
+        see generate_codes
+
+    Yields:
+        tuple: (token_num, dict) attributes of each token, see sample
+    """
+    if allocation == "random" and not unique:
+        # stream batches, so the first tokens are not held up by the last
+        for batch_start in range(start, end, BATCH_TOKENS):
+            batch_end = min(batch_start + BATCH_TOKENS, end)
+            codes = generate_codes(
+                sampler=sampler, rng=rng, start=batch_start, end=batch_end
+            )
+            for token_num, row in enumerate(codes.tolist(), start=batch_start):
+                yield token_num, sampler.decode(row)
+        return
+
+    codes = generate_codes(
+        sampler=sampler,
+        rng=rng,
+        start=start,
+        end=end,
+        num_tokens=num_tokens,
+        unique=unique,
+        allocation=allocation,
+    )
+    for token_num, row in enumerate(codes.tolist(), start=start):
+        yield token_num, sampler.decode(row)
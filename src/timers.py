@@ -0,0 +1,219 @@
+"""opt-in timers and counters for profiling runs
+
+Disabled by default, timer() then returns a shared no-op context manager so
+instrumented hot paths cost one function call. Once enabled, every timer
+adds to per-name totals and, when tracing, records a Chrome trace event.
+Compositing workers collect into their own process and send a snapshot back
+with their results, see merge.
+
+Usage:
+    st.enable(trace=True)
+    with st.timer("images.encode"):
+        ...
+    st.count("images.saved")
+    logger.info(st.summary_table())
+    st.write_trace("trace.json")
+"""
+
+import json
+import os
+import threading
+import time
+
+_ENABLED = False
+_TRACE = False
+_LOCK = threading.Lock()
+# name -> [calls, total seconds, max seconds]
+_TIMERS = {}
+_COUNTERS = {}
+_EVENTS = []
+
+
+def enable(trace=False):
+    """
+    Args:
+        trace (bool): also keep one Chrome trace event per timer
+    """
+    global _ENABLED, _TRACE
+    _ENABLED = True
+    _TRACE = trace
+
+
+def disable():
+    global _ENABLED, _TRACE
+    _ENABLED = False
+    _TRACE = False
+
+
+def enabled():
+    return _ENABLED
+
+
+def tracing():
+    return _TRACE
+
+
+def reset():
+    with _LOCK:
+        _TIMERS.clear()
+        _COUNTERS.clear()
+        _EVENTS.clear()
+
+
+def add_time(name, seconds, wall_start_us=None):
+    with _LOCK:
+        stats = _TIMERS.get(name)
+        if stats is None:
+            _TIMERS[name] = [1, seconds, seconds]
+        else:
+            stats[0] += 1
+            stats[1] += seconds
+            if seconds > stats[2]:
+                stats[2] = seconds
+        if _TRACE and wall_start_us is not None:
+            _EVENTS.append(
+                {
+                    "name": name,
+                    "cat": name.split(".")[0],
+                    "ph": "X",
+                    "ts": wall_start_us,
+                    "dur": seconds * 1e6,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                }
+            )
+
+
+def count(name, n=1):
+    if not _ENABLED:
+        return
+    with _LOCK:
+        _COUNTERS[name] = _COUNTERS.get(name, 0) + n
+
+
+class _Timer:
+    __slots__ = ("name", "start", "wall_start_us")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        # wall clock lines up events of several processes in the trace
+        self.wall_start_us = time.time_ns() // 1000 if _TRACE else None
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        add_time(self.name, time.perf_counter() - self.start, self.wall_start_us)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name):
+    """
+    Args:
+        name (str): dotted name, the first part is the trace category
+
+    Returns:
+        context manager timing its block while profiling is enabled
+    """
+    if not _ENABLED:
+        return _NULL_TIMER
+    return _Timer(name)
+
+
+def timed_iter(name, iterable):
+    """
+    Args:
+        name (str): see timer
+        iterable (iterable): lazy stage, i.e. a generator planning jobs
+
+    Returns:
+        iterable: same items, producing each one is timed
+    """
+    if not _ENABLED:
+        return iterable
+    return _timed_iter(name, iterable)
+
+
+def _timed_iter(name, iterable):
+    iterator = iter(iterable)
+    while True:
+        with timer(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def snapshot():
+    """
+    Returns:
+        dict: plain copy of timers, counters and trace events, picklable
+    """
+    with _LOCK:
+        return {
+            "timers": {name: list(stats) for name, stats in _TIMERS.items()},
+            "counters": dict(_COUNTERS),
+            "events": list(_EVENTS),
+        }
+
+
+def merge(other):
+    """add a snapshot of another process, i.e. a compositing worker"""
+    with _LOCK:
+        for name, (calls, total, longest) in other["timers"].items():
+            stats = _TIMERS.get(name)
+            if stats is None:
+                _TIMERS[name] = [calls, total, longest]
+            else:
+                stats[0] += calls
+                stats[1] += total
+                stats[2] = max(stats[2], longest)
+        for name, n in other["counters"].items():
+            _COUNTERS[name] = _COUNTERS.get(name, 0) + n
+        _EVENTS.extend(other["events"])
+
+
+def summary_table():
+    """
+    Returns:
+        str: timers by total time, then counters
+    """
+    data = snapshot()
+    lines = [
+        f"{'timer':<28} {'calls':>9} {'total s':>10} {'mean ms':>10} {'max ms':>10}"
+    ]
+    timers = sorted(data["timers"].items(), key=lambda item: item[1][1], reverse=True)
+    for name, (calls, total, longest) in timers:
+        lines.append(
+            f"{name:<28} {calls:>9} {total:>10.3f} "
+            f"{1000 * total / calls:>10.3f} {1000 * longest:>10.3f}"
+        )
+    if data["counters"]:
+        lines.append(f"{'counter':<28} {'count':>9}")
+        for name, n in sorted(data["counters"].items()):
+            lines.append(f"{name:<28} {n:>9}")
+    return "\n".join(lines)
+
+
+def write_trace(fpath):
+    """
+    Args:
+        fpath (str): Chrome trace json, open in chrome://tracing or Perfetto
+    """
+    with open(fpath, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": snapshot()["events"]}, f)
@@ -1,16 +1,31 @@
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
 from datetime import datetime, timezone
-from pprint import pformat
-from shutil import copyfile
+from itertools import islice
+from shutil import copyfile, rmtree
 import copy
 import csv
 import json
 import os
-import random
 import re
 import subprocess
-
-# third-party
-from PIL import Image
+import sys
+
+# src
+import src.collection as scol
+import src.compositing as sc
+import src.encoders as se
+import src.layers as sl
+import src.manifest as sm
+import src.progress as sp
+import src.rarity as sr
+import src.sampler as ss
+import src.timers as st
+import src.writers as sw
 
 # logging
 import logging
@@ -51,53 +66,45 @@ class TokenTool:
     def __init__(self, config, project_name):
         self.config = config
         self.project_name = project_name
+        self._sampler = None
+        self._trait_index = None
+        self._project_metadata = None
+
+    @property
+    def sampler(self):
+        """trait config compiled once per TokenTool"""
+        if self._sampler is None:
+            self._sampler = ss.TraitSampler.from_traits_combo(
+                self.config[self.project_name]["traits"]
+            )
+        return self._sampler
 
-    def random_attributes(self):
-        traits = self.config[self.project_name]["traits"]
+    @property
+    def trait_index(self):
+        """layer of every trait value, resolved once per TokenTool
 
-        # wildcard
-        wildcard_categories = {}
-        for trait in traits["trait_values"]:
-            try:
-                wildcard_values = traits["trait_values"][trait]["any"]
-            except KeyError:
-                pass
-            else:
-                wildcard_categories[trait] = wildcard_values
-        logger.info(pformat(wildcard_categories))
-
-        # select wildcard for any
-        selected_wildcards = {}
-        for k, v in wildcard_categories.items():
-            logger.info(f"{k} {v}")
-            selections = random.choices(
-                population=list(v.keys()),
-                weights=list(v.values()),
+        Layers are not required to exist yet, call trait_index.check() before
+        compositing.
+        """
+        if self._trait_index is None:
+            project_fdpath = get_project_fdpath(
+                config=self.config, project_name=self.project_name
             )
-            selected_wildcards[k] = selections[0]
-        logger.info(pformat(selected_wildcards))
-
-        # select sublevels
-        selected_sublevels = {}
-        for trait in traits["trait_values"]:
-            if trait in wildcard_categories.keys():
-                logger.info(f"Skip wildcard {trait=}")
-
-            for k, v in selected_wildcards.items():
-                try:
-                    x = traits["trait_values"][trait][v]
-                except KeyError:
-                    continue
-                selections = random.choices(
-                    population=list(x.keys()),
-                    weights=list(x.values()),
-                )
-                selected_sublevels[trait] = selections[0]
-        logger.info(pformat(selected_sublevels))
+            self._trait_index = sl.TraitIndex.from_traits(
+                traits=self.config[self.project_name]["traits"],
+                traits_fdpath=os.path.join(project_fdpath, "traits"),
+                check=False,
+            )
+        return self._trait_index
 
-        # combine
-        combo = {**selected_wildcards, **selected_sublevels}
-        logger.info(pformat(combo))
+    def random_attributes(self, uniforms=None):
+        """
+        Args:
+            uniforms (optional, list of float): one per trait, i.e. from
+                ss.TokenRNG, default draws from the random module
+        """
+        combo = self.sampler.sample(uniforms=uniforms)
+        logger.debug("random attributes %s", combo)
         return combo
 
     def set_project_values(self, metadata):
@@ -120,10 +127,7 @@ class TokenTool:
     def set_token_values(self, metadata, token_num, attributes):
         """overwrite token specific placeholders"""
         s = self.config[self.project_name]["settings"]
-        try:
-            image_format = s["image_format"]
-        except KeyError:
-            image_format = "png"
+        image_format = get_image_format(s)
 
         name_prefix = s["name_prefix"]
         image_fname = f"{token_num}.{image_format}"
@@ -134,7 +138,7 @@ class TokenTool:
         metadata["properties"]["files"] = [
             {"type": f"image/{image_format}", "uri": image_fname}
         ]
-        logger.info(metadata)
+        logger.debug("token values %s", metadata)
 
         # new attributes list
         metadata["attributes"] = []
@@ -151,30 +155,94 @@ class TokenTool:
         """
         assert token_num >= 0
 
-        metadata = copy.deepcopy(self.TEMPLATE)
-        self.set_project_values(metadata)
+        if self._project_metadata is None:
+            self._project_metadata = copy.deepcopy(self.TEMPLATE)
+            self.set_project_values(self._project_metadata)
+        # project values are shared, only copy what set_token_values replaces
+        base = self._project_metadata
+        metadata = dict(base)
+        metadata["properties"] = dict(base["properties"])
+        metadata["properties"]["creators"] = [
+            dict(creator) for creator in base["properties"]["creators"]
+        ]
         self.set_token_values(
             metadata=metadata, token_num=token_num, attributes=attributes
         )
 
         return metadata
 
-    def generate_metadatas_combo(self, start, end):
+    def generate_metadatas_combo(self, start, end, seed=None):
         """
         Args:
             start (int): integer
             end (int): integer
+            seed (optional, int): same seed and token_num give the same
+                attributes, whatever the range, default is a random seed
+
+        Returns:
+            list of dict: metadata, see iter_metadatas_combo to stream them
         """
-        metadatas = []
-        for token_num in range(start, end):
-            logger.info(f"Generating {token_num}")
-            attributes = self.random_attributes()
-            md = self.token_metadata_from_attributes(
-                token_num=token_num, attributes=attributes
+        return list(self.iter_metadatas_combo(start=start, end=end, seed=seed))
+
+    def generate_collection(self, start, end, seed):
+        """tokens as trait value codes, i.e. to simulate or score large runs
+
+        Args:
+            start (int): first token
+            end (int): last token + 1
+            seed (int): same tokens as iter_metadatas_combo with this seed
+
+        Returns:
+            scol.Collection
+        """
+        traits = self.config[self.project_name]["traits"]
+        return scol.Collection.generate(
+            sampler=self.sampler,
+            rng=ss.TokenRNG(seed=seed),
+            start=start,
+            end=end,
+            num_tokens=self.config[self.project_name]["settings"]["num_tokens"],
+            unique=get_trait_unique(traits),
+            allocation=get_trait_allocation(traits),
+        )
+
+    def iter_metadatas_combo(self, start, end, seed=None):
+        """
+        Args:
+            start (int): integer
+            end (int): integer
+            seed (optional, int): see generate_metadatas_combo
+
+        Yields:
+            dict: metadata of each token, in token order
+        """
+        if seed is None:
+            seed = ss.make_seed()
+        logger.info(f"Generating tokens {start} to {end} with {seed=}")
+        traits = self.config[self.project_name]["traits"]
+        if get_trait_allocation(traits) == "random" and not get_trait_unique(traits):
+            # independent tokens, stream batches so the first are written
+            # right away
+            tokens = ss.generate_attributes(
+                sampler=self.sampler, rng=ss.TokenRNG(seed=seed), start=start, end=end
             )
-            logger.info(pformat(md))
-            metadatas.append(md)
-        return metadatas
+        else:
+            # quota and unique tokens depend on the whole collection
+            with st.timer("metadata.sample"):
+                collection = self.generate_collection(start=start, end=end, seed=seed)
+            tokens = collection.iter_attributes()
+        progress = sp.Progress("metadata", total=end - start)
+
+        for token_num, attributes in tokens:
+            logger.debug("Generating %s from %s", token_num, attributes)
+            with st.timer("metadata.build"):
+                md = self.token_metadata_from_attributes(
+                    token_num=token_num, attributes=attributes
+                )
+            logger.debug("metadata %s", md)
+            yield md
+            progress.update()
+        progress.done()
 
     def generate_metadatas_csv(self, start, end):
         """Looks for a file named metadata.csv in csv folder
@@ -182,75 +250,94 @@ class TokenTool:
         Args:
             start (int): integer
             end (int): integer
+
+        Returns:
+            list of dict: metadata, see iter_metadatas_csv to stream them
+        """
+        return list(self.iter_metadatas_csv(start=start, end=end))
+
+    def iter_metadatas_csv(self, start, end):
+        """
+        Args:
+            start (int): first token, the first row after the header
+            end (int): last token + 1
+
+        Yields:
+            dict: metadata of each csv row in the range, read one row at a time
         """
         project_fdpath = get_project_fdpath(
             config=self.config, project_name=self.project_name
         )
         csv_fpath = os.path.join(project_fdpath, "csv", "metadata.csv")
-        metadatas = []
-
-        with open(csv_fpath, "r", encoding="utf-8") as f:
-            reader = csv.reader(f)
-            for i, row in enumerate(reader):
-                if i == 0:
-                    header = row
-                    continue
-
-                attributes = {}
-                for ttype, tval in zip(header, row):
-                    attributes[ttype] = tval
-                logger.info(f"{attributes=}")
-
-                token_num = i - 1
-                metadatas.append(
-                    self.token_metadata_from_attributes(
-                        token_num=token_num, attributes=attributes
-                    )
+        traits = self.config[self.project_name]["traits"]
+        try:
+            trait_types = traits["trait_types"]
+        except KeyError:
+            trait_types = None
+        try:
+            skip_empty = traits["trait_skip_empty"]
+        except KeyError:
+            skip_empty = False
+        progress = sp.Progress("metadata", total=end - start)
+
+        for token_num, attributes in iter_csv_attributes(
+            csv_fpath=csv_fpath,
+            start=start,
+            end=end,
+            trait_types=trait_types,
+            skip_empty=skip_empty,
+        ):
+            with st.timer("metadata.build"):
+                md = self.token_metadata_from_attributes(
+                    token_num=token_num, attributes=attributes
                 )
-
-        return metadatas
+            yield md
+            progress.update()
+        progress.done()
 
     def _validate_metadata(self, metadata):
         md = metadata
         token_name = md["name"]
         token_num = int(token_name.split("#")[-1])
-        logger.info(f"{token_name} {token_num=}")
+        logger.debug("validating %s %s", token_name, token_num)
 
         image_fname = md["image"]
         if token_num != int(image_fname.split(".")[0]):
             raise ValueError(f"image fname doesnt match {token_num} {image_fname=}")
 
-        logger.info(pformat(md["properties"]["files"]))
+        logger.debug("files %s", md["properties"]["files"])
         uri_fname = md["properties"]["files"][0]["uri"]
         if token_num != int(uri_fname.split(".")[0]):
             raise ValueError(f"{token_num=} does not match {uri_fname=}")
 
-    def save_metadatas(self, metadatas, overwrite=False):
+    def save_metadatas(self, metadatas, overwrite=False, start=0, end=None):
         """
         Args:
-            metadatas (list of metadata): metadata metaplex formt
+            metadatas (iterable of metadata): metadata metaplex formt
+            start (int): first token of the metadatas
+            end (optional, int): last token + 1, a partial range is saved to
+                its shard folder, see make_metadata_writer
         """
-        project_fdpath = get_project_fdpath(
-            config=self.config, project_name=self.project_name
+        writer = make_metadata_writer(
+            config=self.config,
+            project_name=self.project_name,
+            overwrite=overwrite,
+            start=start,
+            end=end,
         )
-        metadata_fdpath = os.path.join(project_fdpath, "metadata")
-        for md in metadatas:
-            logger.info(f"checking {md=}")
-            self._validate_metadata(metadata=md)
-
-            token_name = md["name"]
-            token_num = int(token_name.split("#")[-1])
+        with writer:
+            for md in metadatas:
+                logger.debug("checking md=%s", md)
+                self._validate_metadata(metadata=md)
 
-            # generate
-            metadata_fname = f"{token_num}.json"
-            fpath = os.path.join(metadata_fdpath, metadata_fname)
-            if os.path.exists(fpath) and not overwrite:
-                logger.warning(f"Skip existing {metadata_fname}")
-                continue
+                token_name = md["name"]
+                token_num = int(token_name.split("#")[-1])
 
-            with open(fpath, "w", encoding="utf-8") as f:
-                json.dump(md, f, indent=4)
-            logger.info(f"Saving {token_name} -> {metadata_fname}")
+                # generate
+                if not writer.write(token_num=token_num, metadata=md):
+                    logger.warning(f"Skip existing {token_num}.json")
+                    continue
+                logger.debug("Saving %s -> %s.json", token_name, token_num)
 
     def create_image_plan(self, metadata):
         """
@@ -259,41 +346,24 @@ class TokenTool:
             token_num (int): token number
             overwrite (bool)
         """
-        attributes = {}
-        for attr_pair in metadata["attributes"]:
-            attributes[attr_pair["trait_type"]] = attr_pair["value"]
-        logger.info(f"attributes: {pformat(attributes)}")
-
-        logger.info(attributes)
-        traits = self.config[self.project_name]["traits"]
-        image_plan = []
-        for trait_type in traits["trait_types"]:
-            if trait_type in traits["trait_hidden"]:
-                logger.info(f"skip hidden {trait_type=}")
-                continue
-
-            # get image fpath
-            try:
-                trait_value = attributes[trait_type]
-            except KeyError:
-                # not all traits are in all images
-                logger.info(f"skip unavailable {trait_type=}")
-                continue
-            logger.info(f"Looking for image fpath for {trait_type} {trait_value=}")
-            image_fpath = self.create_image_fpath(
-                trait_type=trait_type, trait_value=trait_value
-            )
-            logger.info(f"{image_fpath=}")
-            image_plan.append(image_fpath)
+        attributes = flatten_nft_attributes(metadata["attributes"])
+        # hidden and unavailable trait types have no layer
+        image_plan = self.trait_index.plan(attributes)
+        logger.debug("image plan %s -> %s", attributes, image_plan)
         return image_plan
 
     def create_image_plans(self, metadatas):
-        image_plans = {}
+        """
+        Args:
+            metadatas (iterable of metadata): metadata metaplex format
+
+        Yields:
+            tuple: (token_num, image_plan) as each metadata is read
+        """
         for metadata in metadatas:
             token_num = int(metadata["name"].split("#")[-1])
             image_plan = self.create_image_plan(metadata=metadata)
-            image_plans[token_num] = image_plan
-        return image_plans
+            yield token_num, image_plan
 
     def create_image_fpath(self, trait_type, trait_value, extension="png"):
         project_fdpath = get_project_fdpath(
@@ -317,27 +387,74 @@ class TokenTool:
         fname = f"{trait_type}-{sublevel}-{trait_value}.{extension}"
         return os.path.join(project_fdpath, "traits", trait_type, sublevel, fname)
 
-    def save_image_plans(self, image_plans, overwrite=False):
+    def save_image_plans(
+        self,
+        image_plans,
+        overwrite=False,
+        workers=1,
+        incremental=False,
+        shard=None,
+        total=None,
+        preview=False,
+    ):
+        """
+        Args:
+            image_plans (iterable of tuple): (token_num, list of layer fpaths),
+                a dict of token_num to layer fpaths also works
+            overwrite (bool)
+            workers (int): number of compositing processes
+            incremental (bool): also rebuild existing images whose layers,
+                size, compositor or encoder settings changed since they were
+                built, see sm.BuildManifest and image_build_key
+            shard (optional, str): records go to the manifest of this shard,
+                see shard_name
+            total (optional, int): number of image plans, for the ETA
+            preview (bool): fastest encoder settings, see se.ImageEncoder
+        """
         project_fdpath = get_project_fdpath(
             config=self.config, project_name=self.project_name
         )
         image_fdpath = os.path.join(project_fdpath, "images")
-        for token_num, image_plan in image_plans.items():
-            image_fpath = os.path.join(image_fdpath, f"{token_num}.png")
-            if os.path.exists(image_fpath) and not overwrite:
-                logger.info(f"Skipping existing {token_num}.png")
-                continue
-
-            logger.info(f"Processing {token_num} -> ...")
-
-            img = None
-            for input_fpath in image_plan:
-                if img is None:
-                    img = Image.open(input_fpath)
-                    continue
-                layer = Image.open(input_fpath)
-                img.paste(layer, (0, 0), layer)
-            img.save(image_fpath, "PNG")
+        if isinstance(image_plans, dict):
+            image_plans = image_plans.items()
+        manifest = sm.BuildManifest.for_project(project_fdpath, shard=shard)
+        progress = sp.Progress("images", total=total)
+        options = image_options(
+            config=self.config, project_name=self.project_name, preview=preview
+        )
+        encoder = se.ImageEncoder(**options["encoder"])
+        store = preflight_project(
+            config=self.config, project_name=self.project_name, workers=workers
+        )
+        options["atlas"] = store.atlas_fdpath
+        build_key = image_build_key(options=options, store=store)
+
+        def iter_jobs():
+            for token_num, image_plan in image_plans:
+                image_fname = f"{token_num}.{encoder.image_format}"
+                image_fpath = os.path.join(image_fdpath, image_fname)
+                token_digest = manifest.plan_digest(image_plan, build_key)
+                if os.path.exists(image_fpath) and not overwrite:
+                    if not incremental:
+                        logger.debug("Skipping existing %s", image_fname)
+                        progress.update()
+                        continue
+                    if manifest.is_current("images", token_num, token_digest):
+                        logger.debug("Skipping up to date %s", image_fname)
+                        progress.update()
+                        continue
+                    logger.debug("Rebuilding changed %s", image_fname)
+                manifest.record("images", token_num, token_digest)
+                yield token_num, image_fpath, store.plan(image_plan)
+
+        sc.save_image_jobs(
+            jobs=st.timed_iter("images.plan", iter_jobs()),
+            workers=workers,
+            options=options,
+            progress=progress,
+        )
+        progress.done()
+        manifest.save()
 
 
 def find_sublevels(trait_type_levels):
@@ -366,64 +483,32 @@ def validate_config(config, project_name):
     return True
 
 
-def generate_random_attributes(traits):
+def generate_random_attributes(traits, sampler=None, uniforms=None):
     """
     Args:
-        traits (dict): TBD
+        traits (dict): config[project_name]["traits"]
+        sampler (optional, ss.TraitSampler): compiled traits, reuse it when
+            generating many tokens
+        uniforms (optional, list of float): one per trait, i.e. from
+            ss.TokenRNG, default draws from the random module
 
     Returns:
         dict: matches metaplex standard
     """
-    tv = traits["trait_values"]
-    try:
-        trait_restrictions = traits["trait_restrictions"]
-    except KeyError:
-        trait_restrictions = []
+    if sampler is None:
+        sampler = ss.TraitSampler.from_traits_basic(traits)
+    attributes = sampler.sample(uniforms=uniforms)
+    return to_nft_attributes(attributes)
 
-    attributes = {}
 
-    restricted_types = [tt for tt in traits["trait_types"] if tt in trait_restrictions]
-    unrestricted_types = [
-        tt for tt in traits["trait_types"] if tt not in trait_restrictions
-    ]
-    logger.debug(restricted_types)
-    logger.debug(unrestricted_types)
-
-    # select the restrictions first
-    for trait_type in restricted_types:
-        total = sum(tv[trait_type].values())
-        selections = random.choices(
-            population=list(tv[trait_type].keys()),
-            weights=list(tv[trait_type].values()),
-        )
-        selection = selections[0]
-        attributes[trait_type] = selection
-
-    # select non restrictions
-    if restricted_types:
-        for trait_type in unrestricted_types:
-            for restriction in restricted_types:
-                restriction_value = attributes[restriction]
-                total = sum(tv[trait_type][restriction_value].values())
-                selections = random.choices(
-                    population=list(tv[trait_type][restriction_value].keys()),
-                    weights=list(tv[trait_type][restriction_value].values()),
-                )
-                selection = selections[0]
-                attributes[trait_type] = selection
-    else:
-        for trait_type in unrestricted_types:
-            try:
-                total = sum(tv[trait_type].values())
-            except TypeError:
-                raise ValueError(f"bad rarity in {trait_type=}")
-            selections = random.choices(
-                population=list(tv[trait_type].keys()),
-                weights=list(tv[trait_type].values()),
-            )
-            selection = selections[0]
-            attributes[trait_type] = selection
+def to_nft_attributes(attributes):
+    """
+    Args:
+        attributes (dict): key=trait_type, value=trait_value
 
+    Returns:
+        list of dict: matches metaplex standard
+    """
     # build metaplex standard
     nft_attributes = []
     for ttype, tvalue in attributes.items():
@@ -431,6 +516,36 @@ def generate_random_attributes(traits):
     return nft_attributes
 
 
+def get_trait_unique(traits):
+    """no two tokens may share an attribute combination"""
+    try:
+        return traits["trait_unique"]
+    except KeyError:
+        return False
+
+
+def get_trait_allocation(traits):
+    """random draws each token, quota allocates exact counts per value"""
+    try:
+        return traits["trait_allocation"]
+    except KeyError:
+        return "random"
+
+
+def get_image_format(settings):
+    """
+    Args:
+        settings (dict): config[project_name]["settings"]
+
+    Returns:
+        str: extension of images and assets, see se.PIL_FORMATS
+    """
+    try:
+        return settings["image_format"]
+    except KeyError:
+        return se.DEFAULT_IMAGE_FORMAT
+
+
 def flatten_nft_attributes(nft_attributes):
     """
     Args:
@@ -475,6 +590,179 @@ def get_project_fdpath(config, project_name):
     return os.path.join(BASE_DIR, working_dir, project_name)
 
 
+def make_metadata_writer(config, project_name, overwrite=False, start=0, end=None):
+    """
+    Args:
+        start (int): first token written
+        end (optional, int): last token written + 1, default is num_tokens
+
+    Returns:
+        sw.MetadataWriter: writer for projects/<project_name>/metadata, or
+            for projects/<project_name>/.shards/metadata-<start>-<end> when
+            only part of the collection is written, see merge_shards_project
+    """
+    project_fdpath = get_project_fdpath(config=config, project_name=project_name)
+    s = config[project_name]["settings"]
+    try:
+        compact = s["metadata_compact"]
+    except KeyError:
+        compact = False
+
+    shard = shard_name(start=start, end=end, num_tokens=s["num_tokens"])
+    if shard is None:
+        fdpath = os.path.join(project_fdpath, "metadata")
+    else:
+        # shards commit their own folder, swapping metadata would race
+        fdpath = os.path.join(project_fdpath, ".shards", f"metadata-{shard}")
+        ensure_fdpath(os.path.dirname(fdpath))
+
+    return sw.MetadataWriter(fdpath=fdpath, overwrite=overwrite, compact=compact)
+
+
+def parse_token_range(num_tokens, shard=None, token_range=None):
+    """
+    Args:
+        num_tokens (int): size of the collection
+        shard (optional, str): "i/N", the i-th of N contiguous shards, 0 <= i < N
+        token_range (optional, str): "a:b", tokens a to b - 1, either side may
+            be left out
+
+    Returns:
+        tuple: (start, end) tokens start to end - 1
+    """
+    if shard and token_range:
+        raise ValueError("pass either a shard or a token range, not both")
+
+    if shard:
+        try:
+            index, count = [int(x) for x in shard.split("/")]
+        except ValueError:
+            raise ValueError(f"invalid {shard=}, expected i/N")
+        if count < 1 or not 0 <= index < count:
+            raise ValueError(f"invalid {shard=}, expected 0 <= i < N")
+        return index * num_tokens // count, (index + 1) * num_tokens // count
+
+    if token_range:
+        try:
+            start, end = [int(x) if x else None for x in token_range.split(":")]
+        except ValueError:
+            raise ValueError(f"invalid {token_range=}, expected a:b")
+        start = 0 if start is None else start
+        end = num_tokens if end is None else end
+        if not 0 <= start <= end <= num_tokens:
+            raise ValueError(f"invalid {token_range=} for {num_tokens=}")
+        return start, end
+
+    return 0, num_tokens
+
+
+def shard_name(start, end, num_tokens):
+    """
+    Returns:
+        str: "<start>-<end>" naming the outputs of a partial run, None if the
+            range is the whole collection
+    """
+    if end is None:
+        end = num_tokens
+    if start == 0 and end == num_tokens:
+        return None
+    return f"{start}-{end}"
+
+
+def get_image_window(settings):
+    """jobs sorted together to share partial composites, see sc.save_image_jobs"""
+    try:
+        return settings["image_window"]
+    except KeyError:
+        return sc.DEFAULT_WINDOW
+
+
+def image_options(config, project_name, preview=False):
+    """compositing options from project settings, see sc.save_image_jobs
+
+    Args:
+        preview (bool): fastest encoder settings, see se.ImageEncoder
+    """
+    s = config[project_name]["settings"]
+    try:
+        layer_cache_mb = s["layer_cache_mb"]
+    except KeyError:
+        layer_cache_mb = sc.DEFAULT_LAYER_CACHE_MB
+
+    try:
+        prefix_cache_depth = s["prefix_cache_depth"]
+    except KeyError:
+        prefix_cache_depth = None
+
+    try:
+        compositor = s["compositor"]
+    except KeyError:
+        compositor = "pil"
+
+    return {
+        "layer_cache_bytes": int(layer_cache_mb * 1024 * 1024),
+        "prefix_cache_depth": prefix_cache_depth,
+        "compositor": compositor,
+        "window": get_image_window(s),
+        "encoder": se.ImageEncoder.from_settings(s, preview=preview).to_options(),
+    }
+
+
+def image_build_key(options, store):
+    """
+    Args:
+        options (dict): see image_options
+        store (sl.LayerStore): preflighted layers of the project
+
+    Returns:
+        str: settings that change the composited images, part of the image
+            digest so images are rebuilt when they change
+    """
+    encoder = se.ImageEncoder(**options["encoder"])
+    return repr(
+        [
+            ("encoder", encoder.key()),
+            ("compositor", options["compositor"]),
+            ("image_size", store.size),
+            ("layer_atlas", store.atlas_fdpath is not None),
+        ]
+    )
+
+
+def preflight_project(config, project_name, workers=1):
+    """normalize trait layers into the canonical store read by compositing
+
+    Args:
+        workers (int): number of conversion threads
+
+    Returns:
+        sl.LayerStore: store of the project, every layer current, with an atlas
+            if settings.layer_atlas is true
+    """
+    project_fdpath = get_project_fdpath(config=config, project_name=project_name)
+    s = config[project_name]["settings"]
+    try:
+        size = s["image_size"]
+    except KeyError:
+        size = None
+
+    try:
+        layer_atlas = s["layer_atlas"]
+    except KeyError:
+        layer_atlas = False
+
+    store = sl.LayerStore(
+        traits_fdpath=os.path.join(project_fdpath, "traits"),
+        cache_fdpath=os.path.join(project_fdpath, ".cache", "layers"),
+        size=size,
+    )
+    with st.timer("layers.preflight"):
+        store.preflight(workers=workers)
+    if layer_atlas:
+        store.build_atlas()
+    return store
+
+
 def create_scaffolding_basic(project_fdpath, traits):
     """
     Args:
@@ -584,7 +872,9 @@ def initialize_project_folder(config, project_name):
     logger.info(f"DONE!  Please place your images in {project_fdpath}/traits")
 
 
-def generate_metadata_project_basic(config, project_name, overwrite=False):
+def generate_metadata_project_basic(
+    config, project_name, overwrite=False, seed=None, start=0, end=None
+):
     project_fdpath = get_project_fdpath(config=config, project_name=project_name)
     settings = config[project_name]["settings"]
     num_tokens = int(settings["num_tokens"])
@@ -594,6 +884,7 @@ def generate_metadata_project_basic(config, project_name, overwrite=False):
     symbol = settings["symbol"]
     collection = settings["collection"]
     seller_fee_basis_points = int(settings["seller_fee_basis_points"])
+    image_format = get_image_format(settings)
 
     logger.info(f"Generating metadata for {num_tokens}")
     TEMPLATE = {
@@ -615,7 +906,7 @@ def generate_metadata_project_basic(config, project_name, overwrite=False):
             ],
             "files": [
                 {
-                    "type": "image/png",
+                    "type": f"image/{image_format}",
                     "uri": None,
                 }
             ],
@@ -623,31 +914,59 @@ def generate_metadata_project_basic(config, project_name, overwrite=False):
         "seller_fee_basis_points": seller_fee_basis_points,
         "symbol": symbol,
     }
-    for token_num in range(0, num_tokens):
-        metadata = TEMPLATE.copy()
-        image_fname = f"{token_num}.png"
-        metadata["image"] = image_fname
-        metadata["name"] = f"{name_prefix} #{token_num}"
-        metadata["properties"]["files"][0]["uri"] = image_fname
-        metadata["attributes"] = generate_random_attributes(
-            traits=config[project_name]["traits"]
-        )
+    traits = config[project_name]["traits"]
+    sampler = ss.TraitSampler.from_traits_basic(traits)
+    if seed is None:
+        seed = ss.make_seed()
+    logger.info(f"Using {seed=}")
+    rng = ss.TokenRNG(seed=seed)
+    writer = make_metadata_writer(
+        config=config,
+        project_name=project_name,
+        overwrite=overwrite,
+        start=start,
+        end=end,
+    )
+    progress = sp.Progress("metadata", total=(end or num_tokens) - start)
+    with writer:
+        for token_num, attributes in ss.generate_attributes(
+            sampler=sampler,
+            rng=rng,
+            start=start,
+            end=num_tokens if end is None else end,
+            num_tokens=num_tokens,
+            unique=get_trait_unique(traits),
+            allocation=get_trait_allocation(traits),
+        ):
+            metadata = TEMPLATE.copy()
+            image_fname = f"{token_num}.{image_format}"
+            metadata["image"] = image_fname
+            metadata["name"] = f"{name_prefix} #{token_num}"
+            metadata["properties"]["files"][0]["uri"] = image_fname
+            metadata["attributes"] = to_nft_attributes(attributes)
 
-        metadata_fname = f"{token_num}.json"
-        metadata_fpath = os.path.join(project_fdpath, "metadata", metadata_fname)
-        if os.path.exists(metadata_fpath) and not overwrite:
-            logger.warning(
-                f"{metadata_fname} already exists. You must pass --overwrite to overwrite"
-            )
-            continue
+            metadata_fname = f"{token_num}.json"
+            progress.update()
+            if not writer.write(token_num=token_num, metadata=metadata):
+                logger.warning(
+                    f"{metadata_fname} already exists. You must pass --overwrite to overwrite"
+                )
+                continue
 
-        logger.info(f"Generating metadata for token {token_num} -> {metadata}")
-        logger.info(f"Creating {metadata_fpath}")
-        with open(metadata_fpath, "w", encoding="utf-8") as f:
-            json.dump(metadata, f, indent=4)
+            logger.debug("Generating metadata for token %s -> %s", token_num, metadata)
+    progress.done()
 
 
-def generate_images_project_basic(config, project_name, overwrite=False):
+def generate_images_project_basic(
+    config,
+    project_name,
+    overwrite=False,
+    workers=1,
+    incremental=False,
+    start=0,
+    end=None,
+    preview=False,
+):
 
     # paths
     project_fdpath = get_project_fdpath(config=config, project_name=project_name)
@@ -666,54 +985,131 @@ def generate_images_project_basic(config, project_name, overwrite=False):
         logger.error(f"🔴invalid number of files in metadata, need {num_tokens}")
         sys.exit(1)
 
-    for i, fname in enumerate(fnames):
-        assert i == int(fname.split(".")[0])
+    def iter_jobs():
+        for i, fname in enumerate(fnames[start:end], start=start):
+            assert i == int(fname.split(".")[0])
 
-        img_fname = f"{i}.png"
-        dest_img_fpath = os.path.join(images_fdpath, img_fname)
-        if os.path.exists(dest_img_fpath) and not overwrite:
-            logger.warning(
-                f"{img_fname} already exists. You must pass --overwrite to overwrite"
-            )
-            continue
+            img_fname = f"{i}.{encoder.image_format}"
+            dest_img_fpath = os.path.join(images_fdpath, img_fname)
+            exists = os.path.exists(dest_img_fpath) and not overwrite
+            if exists and not incremental:
+                logger.warning(
+                    f"{img_fname} already exists. You must pass --overwrite to overwrite"
+                )
+                progress.update()
+                continue
 
-        logger.info(f"{i:05} \t Generating image from {fname}")
-        fpath = os.path.join(metadata_fdpath, fname)
-        with open(fpath, "r", encoding="utf-8") as f:
-            payload = json.load(f)
-        flattened = flatten_nft_attributes(payload["attributes"])
-        logger.debug(flattened)
+            logger.debug("%05d \t Generating image from %s", i, fname)
+            fpath = os.path.join(metadata_fdpath, fname)
+            with open(fpath, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+            flattened = flatten_nft_attributes(payload["attributes"])
+
+            # layers in trait_types order
+            layer_ids = index.plan_ids(flattened)
+            img_fpaths = [index.fpaths[layer_id] for layer_id in layer_ids]
+            logger.debug("%s -> %s", flattened, img_fpaths)
+            token_digest = manifest.plan_digest(img_fpaths, build_key)
+            if exists and manifest.is_current("images", i, token_digest):
+                logger.debug("Skipping up to date %s", img_fname)
+                progress.update()
+                continue
+            manifest.record("images", i, token_digest)
+            yield i, dest_img_fpath, [canonical_fpaths[j] for j in layer_ids]
+
+    manifest = sm.BuildManifest.for_project(
+        project_fdpath, shard=shard_name(start=start, end=end, num_tokens=num_tokens)
+    )
+    progress = sp.Progress("images", total=len(fnames[start:end]))
+    options = image_options(config=config, project_name=project_name, preview=preview)
+    encoder = se.ImageEncoder(**options["encoder"])
+    index = sl.TraitIndex.from_traits(
+        traits=config[project_name]["traits"], traits_fdpath=traits_fdpath
+    )
+    store = preflight_project(config=config, project_name=project_name, workers=workers)
+    canonical_fpaths = store.plan(index.fpaths)
+    options["atlas"] = store.atlas_fdpath
+    build_key = image_build_key(options=options, store=store)
+    sc.save_image_jobs(
+        jobs=st.timed_iter("images.plan", iter_jobs()),
+        workers=workers,
+        options=options,
+        progress=progress,
+    )
+    progress.done()
+    manifest.save()
+
+
+def csv_header_columns(header, trait_types=None):
+    """
+    Args:
+        header (list of str): first row of metadata.csv
+        trait_types (optional, list of str): config traits.trait_types, the
+            header must have exactly these columns, in any order
+
+    Returns:
+        list of tuple: (trait_type, column index) in attribute order, which is
+            trait_types order when given, else header order
+    """
+    if not all(header):
+        raise ValueError(f"empty trait type in csv {header=}")
+    duplicates = sorted({ttype for ttype in header if header.count(ttype) > 1})
+    if duplicates:
+        raise ValueError(f"duplicate trait types {duplicates} in csv header")
+    if trait_types is None:
+        return list(zip(header, range(len(header))))
+
+    missing = [ttype for ttype in trait_types if ttype not in header]
+    unexpected = [ttype for ttype in header if ttype not in trait_types]
+    if missing or unexpected:
+        raise ValueError(
+            f"csv header does not match trait_types, {missing=} {unexpected=}"
+        )
+    return [(ttype, header.index(ttype)) for ttype in trait_types]
+
+
+def iter_csv_attributes(
+    csv_fpath, start=0, end=None, trait_types=None, skip_empty=False
+):
+    """stream attributes of metadata.csv, one row per token after the header
 
-        # use order to create
+    Rows before start are parsed but not decoded and reading stops at end, so
+    memory does not grow with the file.
+
+    Args:
+        csv_fpath (str): metadata.csv
+        start (int): first token
+        end (optional, int): last token + 1, default is the last row
+        trait_types (optional, list of str): see csv_header_columns
+        skip_empty (bool): leave empty cells out of the attributes, i.e. a
+            token without a hat, default keeps them as empty values
+
+    Yields:
+        tuple: (token_num, dict of key=trait_type, value=trait_value)
+    """
+    with open(csv_fpath, "r", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
         try:
-            restrictions = config[project_name]["traits"]["trait_restrictions"]
-        except KeyError:
-            restrictions = []
-
-        img_fpaths = []
-        for ttype in config[project_name]["traits"]["trait_types"]:
-            source_img_fname = flattened[ttype] + ".png"
-            if restrictions and ttype in restrictions:
-                source_img_fpath = os.path.join(traits_fdpath, ttype, source_img_fname)
-            elif restrictions and ttype not in restrictions:
-                restriction_fdname = flattened[restrictions[0]]
-                source_img_fpath = os.path.join(
-                    traits_fdpath, ttype, restriction_fdname, source_img_fname
+            header = next(reader)
+        except StopIteration:
+            raise ValueError(f"{csv_fpath} is empty, expected a header row")
+        columns = csv_header_columns(header=header, trait_types=trait_types)
+        num_columns = len(header)
+
+        token_num = start
+        for row in islice(reader, start, end):
+            if len(row) != num_columns:
+                raise ValueError(
+                    f"{token_num=} has {len(row)} cells, header has {num_columns}"
                 )
+            if skip_empty:
+                yield token_num, {ttype: row[i] for ttype, i in columns if row[i]}
             else:
-                source_img_fpath = os.path.join(traits_fdpath, ttype, source_img_fname)
-            logger.info(f"{ttype=} {source_img_fname} {source_img_fpath}")
-
-            img_fpaths.append(source_img_fpath)
-        logger.debug(img_fpaths)
-        img = None
-        for img_fpath in img_fpaths:
-            if img is None:
-                img = Image.open(img_fpath)
-                continue
-            layer = Image.open(img_fpath)
-            img.paste(layer, (0, 0), layer)
-        img.save(dest_img_fpath, "PNG")
+                yield token_num, {ttype: row[i] for ttype, i in columns}
+            token_num += 1
+
+    if end is not None and token_num < end:
+        logger.warning(f"{csv_fpath} ends at token {token_num}, expected {end}")
 
 
 def load_csv_map(config, project_name, fdname="translations"):
@@ -757,15 +1153,85 @@ def load_csv_map(config, project_name, fdname="translations"):
     return translation
 
 
-def combine_assets_project(config, project_name, overwrite=False):
+def run_token_tasks(fn, token_nums, workers=1, max_in_flight=None, progress=None):
+    """call fn(token_num) for every token, optionally on a thread pool
+
+    Stops submitting on the first failure, lets running tokens finish, logs
+    every failure with its token number and raises the first one.
+
+    Args:
+        fn (callable): called with a token number
+        token_nums (iterable of int): token numbers
+        workers (int): number of threads, 1 runs in the current thread
+        max_in_flight (optional, int): bound on submitted but unfinished tokens,
+            default is 4 per worker
+        progress (optional, sp.Progress): updated as tokens finish
+    """
+    if workers is None or workers <= 1:
+        for token_num in token_nums:
+            try:
+                fn(token_num)
+            except Exception:
+                logger.error(f"🔴failed token {token_num}")
+                raise
+            if progress is not None:
+                progress.update()
+        return
+
+    max_in_flight = max_in_flight or workers * 4
+    failures = []
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for token_num in token_nums:
+            if len(in_flight) >= max_in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    done_token_num = in_flight.pop(future)
+                    if future.exception() is not None:
+                        failures.append((done_token_num, future.exception()))
+                    elif progress is not None:
+                        progress.update()
+            if failures:
+                break
+            in_flight[executor.submit(fn, token_num)] = token_num
+
+        for future in as_completed(in_flight):
+            if future.exception() is not None:
+                failures.append((in_flight[future], future.exception()))
+            elif progress is not None:
+                progress.update()
+
+    if failures:
+        failures.sort(key=lambda failure: failure[0])
+        for token_num, e in failures:
+            logger.error(f"🔴failed token {token_num}: {e!r}")
+        raise failures[0][1]
+
+
+def combine_assets_project(
+    config,
+    project_name,
+    overwrite=False,
+    link_mode="copy",
+    workers=1,
+    incremental=False,
+    start=0,
+    end=None,
+):
+    """
+    Args:
+        link_mode (str): how images get into assets, see sw.LINK_MODES
+        workers (int): number of threads, combining is mostly waiting on io
+        incremental (bool): recombine existing assets whose image, metadata,
+            translations or media hosts changed, see sm.BuildManifest
+        start (int): first token
+        end (optional, int): last token + 1, default is num_tokens
+    """
     # paths
     project_fdpath = get_project_fdpath(config=config, project_name=project_name)
     s = config[project_name]["settings"]
     num_tokens = s["num_tokens"]
-    try:
-        image_format = s["image_format"]
-    except KeyError:
-        image_format = "png"
+    image_format = get_image_format(s)
 
     metadata_fdpath = os.path.join(project_fdpath, "metadata")
     images_fdpath = os.path.join(project_fdpath, "images")
@@ -784,9 +1250,15 @@ def combine_assets_project(config, project_name, overwrite=False):
         config=config, project_name=project_name, fdname="media_hosts"
     )
     logger.info(f"{media_host=}")
+    placer = sw.FilePlacer(link_mode=link_mode)
+    if end is None:
+        end = num_tokens
+    manifest = sm.BuildManifest.for_project(
+        project_fdpath, shard=shard_name(start=start, end=end, num_tokens=num_tokens)
+    )
+    maps_digest = sm.digest(json.dumps([translation, media_host], sort_keys=True))
 
-    # tokens
-    for token_num in range(0, num_tokens):
+    def combine_token(token_num):
 
         # source
         image_fname = f"{token_num}.{image_format}"
@@ -798,20 +1270,36 @@ def combine_assets_project(config, project_name, overwrite=False):
         fpath_image_dest = os.path.join(assets_fdpath, image_fname)
         fpath_metadata_dest = os.path.join(assets_fdpath, metadata_fname)
 
-        if not overwrite and (
+        exists = not overwrite and (
             os.path.exists(fpath_image_dest) or os.path.exists(fpath_metadata_dest)
-        ):
+        )
+        if exists and not incremental:
             logger.warning(
                 f"{image_fname} or {metadata_fname} already exist. You must pass --overwrite to overwrite"
             )
-            continue
-
-        logger.info(f"Combining assets for {token_num}")
-        copyfile(fpath_image_source, fpath_image_dest)
+            return
 
+        token_digest = sm.digest(
+            manifest.file_hash(fpath_image_source),
+            manifest.file_hash(fpath_metadata_source),
+            maps_digest,
+        )
+        if exists and manifest.is_current("assets", token_num, token_digest):
+            logger.debug("Skipping up to date assets for %s", token_num)
+            return
+
+        logger.debug("Combining assets for %s", token_num)
+        with st.timer("assets.place"):
+            placer.place(fpath_image_source, fpath_image_dest)
+        with st.timer("assets.metadata"):
+            write_metadata(fpath_metadata_source, fpath_metadata_dest)
+        manifest.record("assets", token_num, token_digest)
+        st.count("assets.combined")
+
+    def write_metadata(fpath_metadata_source, fpath_metadata_dest):
         if translation is None and media_host is None:
             copyfile(fpath_metadata_source, fpath_metadata_dest)
-            continue
+            return
 
         # translate metadata and write to final
         with open(fpath_metadata_source, "r", encoding="utf-8") as f:
@@ -833,6 +1321,20 @@ def combine_assets_project(config, project_name, overwrite=False):
         with open(fpath_metadata_dest, "w", encoding="utf-8") as f:
             json.dump(working_metadata, f, indent=4)
 
+    # tokens, a failed run still records the tokens it finished
+    progress = sp.Progress("assets", total=end - start)
+    try:
+        run_token_tasks(
+            fn=combine_token,
+            token_nums=range(start, end),
+            workers=workers,
+            progress=progress,
+        )
+    finally:
+        manifest.save()
+    progress.done()
+    placer.log_stats(label="images")
+
 
 def react_env_for_project(
     config,
@@ -901,160 +1403,347 @@ def react_env_for_project(
         print(f"{k}={v}")
 
 
-def generate_metadata_project(config, project_name, overwrite=False):
+def generate_metadata_project(
+    config, project_name, overwrite=False, seed=None, start=0, end=None
+):
+    """
+    Args:
+        start (int): first token
+        end (optional, int): last token + 1, default is num_tokens, a partial
+            range needs a seed so every shard samples the same collection
+    """
     tt = TokenTool(config=config, project_name=project_name)
     num_tokens = config[project_name]["settings"]["num_tokens"]
     trait_algorithm = config[project_name]["traits"]["trait_algorithm"]
+    if end is None:
+        end = num_tokens
+    shard = shard_name(start=start, end=end, num_tokens=num_tokens)
+    if shard is not None and seed is None and trait_algorithm != "csv":
+        raise ValueError(f"pass a seed to generate metadata for tokens {shard}")
 
     # generate
     if trait_algorithm == "basic":
         generate_metadata_project_basic(
-            config=config, project_name=project_name, overwrite=overwrite
+            config=config,
+            project_name=project_name,
+            overwrite=overwrite,
+            seed=seed,
+            start=start,
+            end=end,
         )
     elif trait_algorithm == "combo":
-        metadatas = tt.generate_metadatas_combo(0, num_tokens)
+        metadatas = tt.iter_metadatas_combo(start, end, seed=seed)
     elif trait_algorithm == "csv":
-        metadatas = tt.generate_metadatas_csv(0, num_tokens)
+        metadatas = tt.iter_metadatas_csv(start, end)
     else:
         raise ValueError(f"invalid {trait_algorithm}")
 
     if trait_algorithm in ["combo", "csv"]:
-        tt.save_metadatas(metadatas=metadatas, overwrite=overwrite)
+        tt.save_metadatas(
+            metadatas=metadatas, overwrite=overwrite, start=start, end=end
+        )
+
+
+def merge_shards_project(config, project_name):
+    """move shard metadata into projects/<project_name>/metadata in one commit,
+    fold shard manifests into the project manifest, then verify every stage
+
+    Returns:
+        bool: True if verify_project_stages passed
+    """
+    project_fdpath = get_project_fdpath(config=config, project_name=project_name)
+    shards_fdpath = os.path.join(project_fdpath, ".shards")
+    try:
+        shard_fdnames = [
+            fdname
+            for fdname in os.listdir(shards_fdpath)
+            if fdname.startswith("metadata-")
+        ]
+    except FileNotFoundError:
+        shard_fdnames = []
+    shard_fdnames.sort(key=lambda f: [int(x) for x in f.split("-")[1:]])
+
+    if shard_fdnames:
+        seen = set()
+        writer = make_metadata_writer(
+            config=config, project_name=project_name, overwrite=True
+        )
+        with writer:
+            for shard_fdname in shard_fdnames:
+                shard_fdpath = os.path.join(shards_fdpath, shard_fdname)
+                fnames = scan_fnames(shard_fdpath)
+                logger.info(f"Merging {len(fnames)} metadata from {shard_fdname}")
+                for fname in fnames:
+                    token_num = int(fname.split(".")[0])
+                    if token_num in seen:
+                        logger.warning(f"{token_num} in several shards, using last")
+                    seen.add(token_num)
+                    with open(os.path.join(shard_fdpath, fname), "rb") as f:
+                        writer.write(token_num=token_num, metadata=json.loads(f.read()))
+        for shard_fdname in shard_fdnames:
+            rmtree(os.path.join(shards_fdpath, shard_fdname))
+
+    sm.merge_manifests(project_fdpath)
+    return verify_project_stages(config=config, project_name=project_name)
+
+
+def verify_project_stages(config, project_name):
+    """every token has metadata, and images and assets once those stages ran
 
+    Returns:
+        bool: True if no stage is missing tokens
+    """
+    project_fdpath = get_project_fdpath(config=config, project_name=project_name)
+    s = config[project_name]["settings"]
+    num_tokens = s["num_tokens"]
+    image_format = get_image_format(s)
 
-def validate_project(config, project_name):
+    stages = {
+        "metadata": ("metadata", ["json"]),
+        "images": ("images", [image_format]),
+        "assets": ("assets", ["json", image_format]),
+    }
+    success = True
+    for stage, (fdname, extensions) in stages.items():
+        fnames = scan_fnames(os.path.join(project_fdpath, fdname))
+        if not fnames and stage != "metadata":
+            logger.info(f"{stage}: not generated yet")
+            continue
+        missing = [
+            token_num
+            for token_num in range(0, num_tokens)
+            if any(f"{token_num}.{ext}" not in fnames for ext in extensions)
+        ]
+        if missing:
+            success = False
+            logger.error(
+                f"🔴{stage}: missing {len(missing)} tokens, i.e. {missing[:10]}"
+            )
+        else:
+            logger.info(f"{stage}: all {num_tokens} tokens")
+    return success
+
+
+def scan_fnames(fdpath):
+    """
+    Returns:
+        set of str: fnames of regular files in fdpath, from one directory read
+    """
+    try:
+        with os.scandir(fdpath) as entries:
+            return {entry.name for entry in entries if entry.is_file()}
+    except FileNotFoundError:
+        return set()
+
+
+def expected_trait_values(config, project_name):
+    """
+    Returns:
+        set of str or None: values every collection must contain, after
+            translation, None if unsupported for the trait algorithm
+    """
+    trait_algorithm = config[project_name]["traits"]["trait_algorithm"]
+    if trait_algorithm != "combo":
+        return None
+
+    trait_values = config[project_name]["traits"]["trait_values"]
+    expected_values = set()
+    for level2_blob in trait_values.values():
+        for level3_blob in level2_blob.values():
+            expected_values.update(level3_blob.keys())
+
+    translation = load_csv_map(
+        config=config, project_name=project_name, fdname="translations"
+    )
+    if translation:
+        expected_values = {translation[k] for k in expected_values}
+    return expected_values
+
+
+def validate_project(config, project_name, report_fpath=None, rarity_fpath=None):
+    """check assets in one pass: one directory scan, each metadata read once
+
+    Args:
+        report_fpath (optional, str): json report, default is
+            projects/<project_name>/validation.json
+        rarity_fpath (optional, str): rarity ranks of every token, see
+            sr.Rarity.write_csv, default is projects/<project_name>/rarity.csv
+
+    Returns:
+        bool: True if every check passed
+    """
     # paths
     project_fdpath = get_project_fdpath(config=config, project_name=project_name)
-    metadata_fdpath = os.path.join(project_fdpath, "metadata")
-    images_fdpath = os.path.join(project_fdpath, "images")
     assets_fdpath = os.path.join(project_fdpath, "assets")
+    if report_fpath is None:
+        report_fpath = os.path.join(project_fdpath, "validation.json")
+    if rarity_fpath is None:
+        rarity_fpath = os.path.join(project_fdpath, "rarity.csv")
 
     # settings
     s = config[project_name]["settings"]
     num_tokens = s["num_tokens"]
-    try:
-        image_format = s["image_format"]
-    except KeyError:
-        image_format = "png"
+    image_format = get_image_format(s)
 
     # checks
-    failures = {}
-    rarity = {}
-    success = True
+    failures = {
+        "missing_images": [],
+        "missing_metadatas": [],
+        "low_rarity": [],
+        "missing_values": [],
+        "duplicate_attributes": [],
+    }
 
-    # images
-    for token_num in range(0, num_tokens):
-        image_fpath = os.path.join(assets_fdpath, f"{token_num}.{image_format}")
+    # assets, images and metadata
+    asset_fnames = scan_fnames(assets_fdpath)
 
-        # image exists
-        if not os.path.exists(image_fpath):
-            failures.setdefault("missing_images", [])
-            failures["missing_images"].append(token_num)
-            success = False
+    def iter_attributes():
+        for token_num in range(0, num_tokens):
+            if f"{token_num}.{image_format}" not in asset_fnames:
+                failures["missing_images"].append(token_num)
 
-    # metadata
-    for token_num in range(0, num_tokens):
-        metadata_fpath = os.path.join(assets_fdpath, f"{token_num}.json")
+            metadata_fname = f"{token_num}.json"
+            if metadata_fname not in asset_fnames:
+                failures["missing_metadatas"].append(token_num)
+                continue
 
-        try:
-            with open(metadata_fpath, "r", encoding="utf-8") as f:
-                metadata = json.load(f)
-        except FileNotFoundError:
-            # metadata exists
-            failures.setdefault("missing_metadatas", [])
-            failures["missing_metadatas"].append(token_num)
-            success = False
-        else:
-            # attributes rarity
-            for attribute in metadata["attributes"]:
-                tt = attribute["trait_type"]
-                tv = attribute["value"]
+            with st.timer("validate.read"):
+                with open(os.path.join(assets_fdpath, metadata_fname), "rb") as f:
+                    metadata = json.loads(f.read())
+            yield token_num, flatten_nft_attributes(metadata["attributes"])
 
-                # types
-                rarity.setdefault("trait_types", {})
-                rarity["trait_types"].setdefault(tt, 0)
-                rarity["trait_types"][tt] += 1
+    # attributes rarity, counted per trait type
+    try:
+        trait_types = config[project_name]["traits"]["trait_types"]
+    except KeyError:
+        trait_types = None
+    collection = scol.Collection.from_attributes(
+        iter_attributes(), trait_types=trait_types
+    )
+    with st.timer("validate.rarity"):
+        rarity = sr.Rarity(collection)
+    trait_value_counts = rarity.trait_value_counts()
 
-                # values
-                rarity.setdefault("trait_values", {})
-                rarity["trait_values"].setdefault(tv, 0)
-                rarity["trait_values"][tv] += 1
+    # check unique combinations
+    if get_trait_unique(config[project_name]["traits"]):
+        failures["duplicate_attributes"] = collection.duplicates()
 
     # check rarity
     try:
         min_rarity_basis = config[project_name]["validation"]["min_rarity_basis"]
         logger.info(f"{min_rarity_basis=}")
     except KeyError:
-        pass
+        min_rarity_basis = None
     else:
-        for value_name, value_counts in rarity["trait_values"].items():
-            rarity_basis = int(10000 * value_counts / num_tokens)
-            logger.debug(
-                f"{value_name} ({value_counts}/{num_tokens}) -> {rarity_basis=}"
-            )
-            if rarity_basis < min_rarity_basis:
-                failures.setdefault("low_rarity", [])
-                failures["low_rarity"].append(value_name)
-                success = False
+        for trait_type, value_counts in trait_value_counts.items():
+            for value_name, value_count in value_counts.items():
+                rarity_basis = int(10000 * value_count / num_tokens)
+                if rarity_basis < min_rarity_basis:
+                    failures["low_rarity"].append([trait_type, value_name])
 
     # check missing value
-    translation = load_csv_map(
-        config=config, project_name=project_name, fdname="translations"
-    )
-    trait_algorithm = config[project_name]["traits"]["trait_algorithm"]
-    trait_values = config[project_name]["traits"]["trait_values"]
-    expected_values = []
-    if trait_algorithm == "combo":
-        logger.info(f"checking missing values for {trait_algorithm=}")
-        for level1_name, level2_blob in trait_values.items():
-            for level2_name, level3_blob in trait_values[level1_name].items():
-                logger.debug(f"level3_blob {pformat(level3_blob)}")
-                level_expected_values = list(level3_blob.keys())
-                expected_values.extend(level_expected_values)
-        raw_expected_values = list(set(expected_values))
-        if not translation:
-            expected_values = raw_expected_values
-        else:
-            expected_values = [translation[k] for k in raw_expected_values]
-
+    expected_values = expected_trait_values(config=config, project_name=project_name)
+    if expected_values is None:
+        trait_algorithm = config[project_name]["traits"]["trait_algorithm"]
+        logger.warning(f"missing values check unsupported for {trait_algorithm=}")
+    else:
         logger.info(f"num expected values: {len(expected_values)}")
-
-        for ev in expected_values:
-            if ev not in rarity["trait_values"].keys():
-                failures.setdefault("missing_values", [])
+        found_values = {
+            value
+            for value_counts in trait_value_counts.values()
+            for value in value_counts
+        }
+        for ev in sorted(expected_values):
+            if ev not in found_values:
                 failures["missing_values"].append(ev)
-                logger.error(f"missing value {ev}")
-                success = False
-
-    else:
-        logger.warning(f"missing values check unsupported for {trait_algorithm=}")
 
     # results
+    success = not any(failures.values())
+    report = {
+        "project": project_name,
+        "success": success,
+        "num_tokens": num_tokens,
+        "min_rarity_basis": min_rarity_basis,
+        "failures": failures,
+        "rarity": {
+            "trait_types": rarity.trait_type_counts(),
+            "trait_values": trait_value_counts,
+        },
+        "rarity_fpath": rarity_fpath,
+    }
+    with open(report_fpath, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    rarity.write_csv(rarity_fpath)
+
+    for check, values in failures.items():
+        if values:
+            logger.error(f"{check}: {len(values)}")
     if not success:
-        logger.error(pformat(failures))
-        logger.error(f"FAILED validation for {project_name}")
+        logger.error(f"FAILED validation for {project_name}, see {report_fpath}")
     else:
-        logger.info(f"SUCCESS validated {project_name}")
+        logger.info(f"SUCCESS validated {project_name}, see {report_fpath}")
 
     return success
 
 
-def generate_images_project(config, project_name, overwrite=False):
+def generate_images_project(
+    config,
+    project_name,
+    overwrite=False,
+    workers=1,
+    incremental=False,
+    start=0,
+    end=None,
+    preview=False,
+):
+    """
+    Args:
+        incremental (bool): rebuild existing images whose layers or encoder
+            settings changed
+        start (int): first token
+        end (optional, int): last token + 1, default is num_tokens
+        preview (bool): fastest encoder settings, i.e. to check layers before
+            the final run
+    """
     trait_algorithm = config[project_name]["traits"]["trait_algorithm"]
     if trait_algorithm == "basic":
         generate_images_project_basic(
-            config=config, project_name=project_name, overwrite=overwrite
+            config=config,
+            project_name=project_name,
+            overwrite=overwrite,
+            workers=workers,
+            incremental=incremental,
+            start=start,
+            end=end,
+            preview=preview,
         )
     elif trait_algorithm == "combo":
         generate_images_project_combo(
-            config=config, project_name=project_name, overwrite=overwrite
+            config=config,
+            project_name=project_name,
+            overwrite=overwrite,
+            workers=workers,
+            incremental=incremental,
+            start=start,
+            end=end,
+            preview=preview,
         )
     else:
         raise ValueError(f"invalid {trait_algorithm=}")
 
 
-def generate_images_project_combo(config, project_name, overwrite=False):
+def generate_images_project_combo(
+    config,
+    project_name,
+    overwrite=False,
+    workers=1,
+    incremental=False,
+    start=0,
+    end=None,
+    preview=False,
+):
     tt = TokenTool(config=config, project_name=project_name)
+    tt.trait_index.check()
     project_fdpath = get_project_fdpath(config=config, project_name=project_name)
     input_fdpath = os.path.join(project_fdpath, "metadata")
 
@@ -1063,17 +1752,45 @@ def generate_images_project_combo(config, project_name, overwrite=False):
     input_fnames = [x for x in input_fnames if ".json" in x]
     input_fnames.sort(key=lambda f: int(re.sub("\D", "", f)))
     logger.info(f"found {len(input_fnames)} files")
-
-    metadatas = []
-    for input_fname in input_fnames:
-        logger.info(f"{input_fname} ->")
-        input_fpath = os.path.join(input_fdpath, input_fname)
-        with open(input_fpath, "r", encoding="utf-8") as f:
-            input_payload = json.load(f)
-        metadatas.append(input_payload)
-
-    image_plans = tt.create_image_plans(metadatas=metadatas)
-    tt.save_image_plans(image_plans=image_plans, overwrite=overwrite)
+    num_tokens = config[project_name]["settings"]["num_tokens"]
+    if end is None:
+        end = num_tokens
+    input_fnames = [f for f in input_fnames if start <= int(f.split(".")[0]) < end]
+
+    def iter_attributes():
+        for input_fname in input_fnames:
+            logger.debug("%s ->", input_fname)
+            input_fpath = os.path.join(input_fdpath, input_fname)
+            with open(input_fpath, "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+            token_num = int(metadata["name"].split("#")[-1])
+            yield token_num, flatten_nft_attributes(metadata["attributes"])
+
+    def iter_image_plans():
+        # one window of tokens at a time, so the first images come out right
+        # away, each planned from its code matrix
+        window = get_image_window(config[project_name]["settings"])
+        tokens = iter_attributes()
+        while True:
+            with st.timer("images.read"):
+                collection = scol.Collection.from_attributes(
+                    islice(tokens, window),
+                    trait_types=config[project_name]["traits"]["trait_types"],
+                )
+            if not len(collection):
+                return
+            yield from collection.iter_plans(tt.trait_index)
+
+    image_plans = iter_image_plans()
+    tt.save_image_plans(
+        image_plans=image_plans,
+        overwrite=overwrite,
+        workers=workers,
+        incremental=incremental,
+        shard=shard_name(start=start, end=end, num_tokens=num_tokens),
+        total=len(input_fnames),
+        preview=preview,
+    )
 
 
 def apply_translation(metadata, translation=None, handle_missing="fail"):
@@ -0,0 +1,362 @@
+from shutil import copyfile, rmtree
+import errno
+import fcntl
+import json
+import os
+import stat
+import threading
+import uuid
+
+# src
+import src.timers as st
+
+# logging
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def dumps_metadata(metadata, compact=False):
+    """
+    Args:
+        metadata (dict): metaplex metadata
+        compact (bool): no indentation or whitespace between separators
+
+    Returns:
+        bytes: utf-8 json
+    """
+    if compact:
+        return json.dumps(metadata, separators=(",", ":")).encode("utf-8")
+    return json.dumps(metadata, indent=4).encode("utf-8")
+
+
+LINK_MODES = ["copy", "hardlink", "symlink", "reflink"]
+
+# linux ioctl to share extents between files, btrfs/xfs/zfs
+FICLONE = 0x40049409
+
+# errors meaning the filesystem cannot link, as opposed to a bad path
+UNSUPPORTED_ERRNOS = {
+    errno.EXDEV,
+    errno.EPERM,
+    errno.EMLINK,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+}
+
+
+def temp_fpath_for(fpath):
+    """hidden sibling, so a rename replaces fpath atomically"""
+    fdpath, fname = os.path.split(fpath)
+    return os.path.join(fdpath, f".{fname}.tmp")
+
+
+def unique_temp_fpath_for(fpath):
+    """hidden sibling of this writer only, for files that several processes or
+    machines sharing storage may write at the same time, i.e. the layer cache
+    """
+    fdpath, fname = os.path.split(fpath)
+    return os.path.join(fdpath, f".{fname}.{uuid.uuid4().hex}.tmp")
+
+
+def replace_from_temp(fpath, write):
+    """write a unique temp file, then rename it over fpath
+
+    Args:
+        fpath (str): destination
+        write (callable): temp fpath -> None, writes the new content
+    """
+    temp_fpath = unique_temp_fpath_for(fpath)
+    try:
+        write(temp_fpath)
+        os.replace(temp_fpath, fpath)
+    except BaseException:
+        try:
+            os.remove(temp_fpath)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def copy_file_range(source_fpath, dest_fpath):
+    """in kernel copy, falls back to copyfile where copy_file_range is missing"""
+    try:
+        with open(source_fpath, "rb") as fsrc, open(dest_fpath, "wb") as fdst:
+            remaining = os.fstat(fsrc.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+    except (AttributeError, OSError) as e:
+        if isinstance(e, OSError) and e.errno not in UNSUPPORTED_ERRNOS:
+            raise
+        copyfile(source_fpath, dest_fpath)
+
+
+def reflink(source_fpath, dest_fpath):
+    with open(source_fpath, "rb") as fsrc, open(dest_fpath, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+class FilePlacer:
+    """put files into place by copying or linking, falling back to copy
+
+    The first time the filesystem refuses the requested link mode, the rest of
+    the run copies instead. Files are created under a temporary name and renamed
+    over the destination, so an existing destination, even a hard link to the
+    source, is replaced instead of written through.
+    """
+
+    def __init__(self, link_mode="copy"):
+        """
+        Args:
+            link_mode (str): copy, hardlink, symlink or reflink
+        """
+        if link_mode not in LINK_MODES:
+            raise ValueError(f"invalid {link_mode=}, choose from {LINK_MODES}")
+        self.link_mode = link_mode
+        self.copied_files = 0
+        self.copied_bytes = 0
+        self.linked_files = 0
+        self.linked_bytes = 0
+        # placers are shared by the threads of a combine run
+        self.lock = threading.Lock()
+
+    def _link(self, source_fpath, temp_fpath, dest_fpath):
+        if self.link_mode == "hardlink":
+            os.link(source_fpath, temp_fpath)
+        elif self.link_mode == "symlink":
+            source_relpath = os.path.relpath(source_fpath, os.path.dirname(dest_fpath))
+            os.symlink(source_relpath, temp_fpath)
+        elif self.link_mode == "reflink":
+            reflink(source_fpath, temp_fpath)
+        else:
+            raise ValueError(f"invalid {self.link_mode=}")
+
+    def place(self, source_fpath, dest_fpath):
+        nbytes = os.stat(source_fpath).st_size
+        temp_fpath = temp_fpath_for(dest_fpath)
+        if os.path.lexists(temp_fpath):
+            os.unlink(temp_fpath)
+
+        if self.link_mode != "copy":
+            try:
+                self._link(source_fpath, temp_fpath, dest_fpath)
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_ERRNOS:
+                    raise
+                with self.lock:
+                    if self.link_mode != "copy":
+                        logger.warning(
+                            f"{self.link_mode} unsupported ({e}), copying instead"
+                        )
+                    self.link_mode = "copy"
+                if os.path.lexists(temp_fpath):
+                    os.unlink(temp_fpath)
+            else:
+                os.replace(temp_fpath, dest_fpath)
+                # rename is a no-op when dest is already a hard link to source
+                if os.path.lexists(temp_fpath):
+                    os.unlink(temp_fpath)
+                with self.lock:
+                    self.linked_files += 1
+                    self.linked_bytes += nbytes
+                return
+
+        copy_file_range(source_fpath, temp_fpath)
+        os.replace(temp_fpath, dest_fpath)
+        with self.lock:
+            self.copied_files += 1
+            self.copied_bytes += nbytes
+
+    def stats(self):
+        return {
+            "copied_files": self.copied_files,
+            "copied_bytes": self.copied_bytes,
+            "linked_files": self.linked_files,
+            "linked_bytes": self.linked_bytes,
+        }
+
+    def log_stats(self, label="files"):
+        logger.info(
+            f"{label}: copied {self.copied_files} ({self.copied_bytes} bytes), "
+            f"linked {self.linked_files} ({self.linked_bytes} bytes)"
+        )
+
+
+def link_or_copy(source_fpath, dest_fpath):
+    try:
+        os.link(source_fpath, dest_fpath)
+    except OSError:
+        copyfile(source_fpath, dest_fpath)
+
+
+class MetadataWriter:
+    """write token metadata into a staging folder, then swap it in as a whole
+
+    Serialized metadata is buffered and flushed in batches. Nothing in the
+    destination changes until commit, so a crashed run leaves the previous
+    collection in place. Existing files that are not overwritten are hard linked
+    into the staging folder, so the committed folder is complete.
+
+    Usage:
+        with MetadataWriter(metadata_fdpath) as writer:
+            writer.write(token_num, metadata)
+    """
+
+    def __init__(self, fdpath, overwrite=False, compact=False, batch_size=1000):
+        """
+        Args:
+            fdpath (str): destination folder, i.e. projects/example/metadata
+            overwrite (bool): replace existing token metadata
+            compact (bool): see dumps_metadata
+            batch_size (int): number of serialized tokens held before a flush
+        """
+        self.fdpath = os.path.normpath(fdpath)
+        self.overwrite = overwrite
+        self.compact = compact
+        self.batch_size = batch_size
+
+        parent_fdpath, name = os.path.split(self.fdpath)
+        self.parent_fdpath = parent_fdpath
+        self.staging_prefix = f".{name}-staging-"
+        self.backup_fdpath = os.path.join(parent_fdpath, f".{name}-backup")
+        self.staging_fdpath = None
+        self.existing_fnames = set()
+        self.written_fnames = set()
+        self.buffer = []
+        self.num_written = 0
+        self.num_skipped = 0
+
+    def recover(self):
+        """finish or roll back a commit interrupted between its two renames"""
+        if os.path.exists(self.backup_fdpath):
+            if os.path.exists(self.fdpath):
+                rmtree(self.backup_fdpath)
+            else:
+                logger.warning(f"Restoring {self.fdpath} from interrupted commit")
+                os.rename(self.backup_fdpath, self.fdpath)
+
+        for fdname in os.listdir(self.parent_fdpath):
+            if fdname.startswith(self.staging_prefix):
+                logger.warning(f"Removing abandoned staging folder {fdname}")
+                rmtree(os.path.join(self.parent_fdpath, fdname))
+
+    def open(self):
+        self.recover()
+        try:
+            self.existing_fnames = set(os.listdir(self.fdpath))
+        except FileNotFoundError:
+            self.existing_fnames = set()
+        self.staging_fdpath = self.make_staging_fdpath()
+        return self
+
+    def make_staging_fdpath(self):
+        """unique staging folder with the permissions of the destination
+
+        mkdtemp would create it 0700, and commit renames it over the
+        destination, hiding metadata from other users of shared storage.
+
+        Returns:
+            str: staging fdpath
+        """
+        while True:
+            staging_fdpath = os.path.join(
+                self.parent_fdpath, f"{self.staging_prefix}{uuid.uuid4().hex}"
+            )
+            try:
+                # the umask applies, like any folder the project creates
+                os.mkdir(staging_fdpath, 0o777)
+            except FileExistsError:
+                continue
+            break
+        try:
+            mode = os.stat(self.fdpath).st_mode
+        except FileNotFoundError:
+            pass
+        else:
+            os.chmod(staging_fdpath, stat.S_IMODE(mode))
+        return staging_fdpath
+
+    def exists(self, token_num):
+        return f"{token_num}.json" in self.existing_fnames
+
+    def write(self, token_num, metadata):
+        """
+        Args:
+            token_num (int): token number
+            metadata (dict): metaplex metadata
+
+        Returns:
+            bool: False if the token already exists and overwrite is off
+        """
+        if self.exists(token_num) and not self.overwrite:
+            self.num_skipped += 1
+            return False
+
+        fname = f"{token_num}.json"
+        with st.timer("metadata.dumps"):
+            payload = dumps_metadata(metadata, compact=self.compact)
+        self.buffer.append((fname, payload))
+        self.written_fnames.add(fname)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+        return True
+
+    def flush(self):
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+        with st.timer("metadata.flush"):
+            for fname, payload in self.buffer:
+                fd = os.open(os.path.join(self.staging_fdpath, fname), flags, 0o644)
+                try:
+                    os.write(fd, payload)
+                finally:
+                    os.close(fd)
+        st.count("metadata.written", len(self.buffer))
+        self.num_written += len(self.buffer)
+        self.buffer = []
+
+    def commit(self):
+        self.flush()
+        if not self.num_written:
+            logger.info(f"No new metadata, {self.num_skipped} skipped existing")
+            self.abort()
+            return
+
+        # carry over what was not rewritten
+        for fname in self.existing_fnames - self.written_fnames:
+            link_or_copy(
+                os.path.join(self.fdpath, fname),
+                os.path.join(self.staging_fdpath, fname),
+            )
+
+        if os.path.exists(self.fdpath):
+            os.rename(self.fdpath, self.backup_fdpath)
+        os.rename(self.staging_fdpath, self.fdpath)
+        self.staging_fdpath = None
+        if os.path.exists(self.backup_fdpath):
+            rmtree(self.backup_fdpath)
+        logger.info(
+            f"Committed {self.num_written} metadata to {self.fdpath}, "
+            f"skipped {self.num_skipped} existing"
+        )
+
+    def abort(self):
+        self.buffer = []
+        if self.staging_fdpath is not None:
+            rmtree(self.staging_fdpath)
+            self.staging_fdpath = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+        return False
@@ -0,0 +1,94 @@
+from collections import Counter
+import os
+import sys
+
+# third-party
+import numpy as np
+import pytest
+
+# src
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(TEST_DIR, ".."))
+import src.collection as scol
+import src.layers as sl
+import src.sampler as ss
+
+RESTRICTED_TRAITS = {
+    "trait_algorithm": "basic",
+    "trait_types": ["class", "body", "head"],
+    "trait_restrictions": ["class"],
+    "trait_values": {
+        "class": {"archer": 2, "warrior": 1},
+        "body": {"archer": {"orange": 1, "white": 1}, "warrior": {"white": 1}},
+        "head": {"archer": {"normal": 1, "angry": 3}, "warrior": {"angry": 1}},
+    },
+}
+
+COMBO_TRAITS = {
+    "trait_algorithm": "combo",
+    "trait_types": ["funbox", "special", "strength"],
+    "trait_hidden": ["strength"],
+    "trait_values": {
+        "funbox": {"any": {"ghost": 1, "cupcake": 3}},
+        "special": {
+            "ghost": {"ghost_special_1": 1, "ghost_special_2": 1},
+            "cupcake": {"cupcake_special_1": 1},
+        },
+        "strength": {"any": {"strength_1": 1, "strength_2": 1}},
+    },
+}
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [{}, {"allocation": "quota"}, {"unique": True}],
+)
+def test_collection_matches_generate_attributes(kwargs):
+    sampler = ss.TraitSampler.from_traits(COMBO_TRAITS)
+    num_tokens = 6 if kwargs.get("unique") else 200
+    kwargs = {"start": 2, "end": num_tokens, "num_tokens": num_tokens, **kwargs}
+
+    collection = scol.Collection.generate(
+        sampler=sampler, rng=ss.TokenRNG(seed=5), **kwargs
+    )
+    expected = list(
+        ss.generate_attributes(sampler=sampler, rng=ss.TokenRNG(seed=5), **kwargs)
+    )
+    assert collection.codes.dtype == np.int16
+    assert list(collection.token_nums) == [token_num for token_num, _ in expected]
+    assert list(collection.iter_attributes()) == expected
+    assert collection.attributes(3) == dict(expected)[3]
+
+    # counts straight from the codes
+    counts = collection.value_counts()
+    for column, trait_type in enumerate(collection.trait_types):
+        by_value = Counter(a[trait_type] for _, a in expected if trait_type in a)
+        values = collection.values[column]
+        assert {values[c]: n for c, n in enumerate(counts[column]) if n} == by_value
+    if kwargs.get("unique"):
+        assert collection.duplicates() == []
+
+
+def test_collection_duplicates():
+    collection = scol.Collection(
+        trait_types=["a", "b"],
+        values=[["x", "y"], ["z"]],
+        codes=[[0, 0], [1, -1], [0, 0], [1, -1], [1, 0]],
+        start=10,
+    )
+    assert collection.duplicates() == [12, 13]
+    assert collection.attributes(11) == {"a": "y"}
+    assert collection.nbytes == 5 * 2 * 2
+
+
+@pytest.mark.parametrize("traits", [COMBO_TRAITS, RESTRICTED_TRAITS])
+def test_collection_plans_match_trait_index(traits, tmp_path):
+    sampler = ss.TraitSampler.from_traits(traits)
+    collection = scol.Collection.generate(
+        sampler=sampler, rng=ss.TokenRNG(seed=1), start=0, end=100
+    )
+    index = sl.TraitIndex.from_traits(traits, str(tmp_path), check=False)
+    for (token_num, plan), (_, attributes) in zip(
+        collection.iter_plans(index), collection.iter_attributes()
+    ):
+        assert plan == index.plan(attributes)
@@ -0,0 +1,172 @@
+import os
+import sys
+
+# third-party
+from PIL import Image
+import numpy as np
+
+# src
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(TEST_DIR, ".."))
+import src.compositing as sc
+import src.layers as sl
+
+
+def make_layers(fdpath, num_layers=3, size=(16, 16)):
+    fpaths = []
+    for i in range(num_layers):
+        img = Image.new("RGBA", size, (0, 0, 0, 0))
+        for x in range(size[0]):
+            for y in range(size[1]):
+                if (x + y + i) % (i + 2) == 0:
+                    img.putpixel((x, y), (40 * i, 255 - 30 * i, 7 * x, 60 + 60 * i))
+        fpath = os.path.join(fdpath, f"layer{i}.png")
+        img.save(fpath, "PNG")
+        fpaths.append(fpath)
+    return fpaths
+
+
+def test_save_image_jobs_workers_match_serial(tmp_path):
+    layers = make_layers(str(tmp_path))
+    plans = [layers, layers[:2], [layers[0], layers[2]], layers[1:]]
+
+    outputs = {}
+    for workers in [1, 2]:
+        out_fdpath = tmp_path / f"out{workers}"
+        out_fdpath.mkdir()
+        jobs = [(i, str(out_fdpath / f"{i}.png"), plan) for i, plan in enumerate(plans)]
+        stats = sc.save_image_jobs(jobs=jobs, workers=workers)
+        assert stats["saved"] == len(plans)
+        outputs[workers] = [
+            (out_fdpath / f"{i}.png").read_bytes() for i in range(len(plans))
+        ]
+
+    assert outputs[1] == outputs[2]
+
+
+def test_layer_cache_hits_and_eviction(tmp_path):
+    layers = make_layers(str(tmp_path), size=(8, 8))
+    layer_nbytes = 8 * 8 * 4
+
+    cache = sc.LayerCache(max_bytes=2 * layer_nbytes)
+    cache.get(layers[0])
+    cache.get(layers[1])
+    cache.get(layers[0])
+    assert cache.stats() == {"hits": 1, "misses": 2, "evictions": 0}
+
+    # layers[1] is least recently used
+    cache.get(layers[2])
+    assert cache.stats()["evictions"] == 1
+    assert cache.num_bytes == 2 * layer_nbytes
+    cache.get(layers[0])
+    assert cache.hits == 2
+
+    # layers are stat once per build
+    os.utime(layers[0], ns=(0, 0))
+    cache.get(layers[0])
+    assert cache.misses == 3
+
+    # modified layers are decoded again by the next build
+    cache.start_build("next")
+    cache.get(layers[0])
+    assert cache.misses == 4
+
+
+def test_prefix_compositor_matches_full_composite(tmp_path):
+    layers = make_layers(str(tmp_path), num_layers=4)
+    plans = sorted(
+        [
+            layers,
+            layers[:3],
+            layers[:2] + layers[3:],
+            layers,
+            [layers[0], layers[2], layers[3]],
+            layers[1:],
+        ]
+    )
+
+    for max_depth in [None, 1]:
+        layer_cache = sc.LayerCache()
+        compositor = sc.PrefixCompositor(layer_cache=layer_cache, max_depth=max_depth)
+        for plan in plans:
+            expected = sc.composite_image_plan(image_plan=plan, layer_cache=layer_cache)
+            img = compositor.composite(image_plan=plan)
+            assert img.tobytes() == expected.tobytes()
+        if max_depth is None:
+            assert compositor.reused_blends > 0
+
+
+def test_numpy_backend_matches_pil(tmp_path):
+    rng = np.random.default_rng(0)
+    layers = []
+    for i in range(4):
+        rgba = rng.integers(0, 256, size=(24, 32, 4), dtype=np.uint8)
+        # fully transparent and fully opaque pixels take their own paths in PIL
+        rgba[:4, :, 3] = 0
+        rgba[4:8, :, 3] = 255
+        if i == 2:
+            # only blended within the bounding box of non transparent pixels
+            box = np.zeros((24, 32), dtype=bool)
+            box[6:20, 5:25] = True
+            rgba[~box, 3] = 0
+        elif i == 3:
+            rgba[..., 3] = 0
+        fpath = str(tmp_path / f"random{i}.png")
+        Image.fromarray(rgba, "RGBA").save(fpath, "PNG")
+        layers.append(fpath)
+    plans = sorted([layers, layers[:2], layers[1:], [layers[0], layers[3]]])
+
+    backend = sc.NumpyBackend()
+    compositor = sc.PrefixCompositor(
+        layer_cache=sc.LayerCache(loader=backend.load), backend=backend
+    )
+    for plan in plans:
+        expected = sc.composite_image_plan(image_plan=plan)
+        img = compositor.composite(image_plan=plan)
+        assert img.mode == "RGBA"
+        assert img.tobytes() == expected.tobytes()
+
+
+def test_save_image_jobs_streams_windows(tmp_path):
+    layers = make_layers(str(tmp_path))
+    plans = [layers, layers[:2], [layers[0], layers[2]], layers[1:], layers[2:]]
+    out_fdpath = tmp_path / "out"
+    out_fdpath.mkdir()
+
+    def iter_jobs():
+        for i, plan in enumerate(plans):
+            # the previous window is saved before this one is planned
+            if i >= 2:
+                assert (out_fdpath / f"{i - 2}.png").exists()
+            yield i, str(out_fdpath / f"{i}.png"), plan
+
+    stats = sc.save_image_jobs(jobs=iter_jobs(), options={"window": 2})
+    assert stats["saved"] == len(plans)
+    for i, plan in enumerate(plans):
+        expected = sc.composite_image_plan(image_plan=plan)
+        with Image.open(out_fdpath / f"{i}.png") as img:
+            assert img.tobytes() == expected.tobytes()
+
+
+def test_atlas_layers_match_decoded(tmp_path):
+    traits_fdpath = tmp_path / "traits"
+    traits_fdpath.mkdir()
+    layers = make_layers(str(traits_fdpath), num_layers=4)
+    store = sl.LayerStore(
+        traits_fdpath=str(traits_fdpath), cache_fdpath=str(tmp_path / "cache")
+    )
+    store.preflight()
+    assert store.build_atlas()
+    assert not store.build_atlas()
+    plans = sorted([store.plan(plan) for plan in [layers, layers[1:], layers[:2]]])
+
+    for compositor in ["pil", "numpy"]:
+        options = {"compositor": compositor, "atlas": store.atlas_fdpath}
+        for i, plan in enumerate(plans):
+            out_fpath = str(tmp_path / f"{compositor}{i}.png")
+            sc.save_image_jobs(jobs=[(i, out_fpath, plan)], options=options)
+            expected = sc.composite_image_plan(image_plan=plan)
+            with Image.open(out_fpath) as img:
+                assert img.tobytes() == expected.tobytes()
+        # layers are views into the atlas, nothing is held per layer
+        assert sc.get_compositor(options).layer_cache.num_bytes == 0
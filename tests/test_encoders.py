@@ -0,0 +1,68 @@
+import os
+import sys
+
+# third-party
+from PIL import Image
+import pytest
+
+# src
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(TEST_DIR, ".."))
+import src.encoders as se
+
+
+def make_image():
+    img = Image.new("RGBA", (8, 8), (0, 0, 0, 0))
+    img.paste((200, 10, 10, 255), (2, 2, 6, 6))
+    return img
+
+
+def test_png_roundtrip_keeps_pixels(tmp_path):
+    img = make_image()
+    for encoder in [
+        se.ImageEncoder(),
+        se.ImageEncoder(compress_level=9, optimize=True),
+        se.ImageEncoder(preview=True),
+    ]:
+        fpath = str(tmp_path / "0.png")
+        encoder.save(img, fpath)
+        with Image.open(fpath) as f:
+            assert f.format == "PNG"
+            assert f.convert("RGBA").tobytes() == img.tobytes()
+
+
+def test_jpeg_flattens_alpha(tmp_path):
+    fpath = str(tmp_path / "0.jpg")
+    se.ImageEncoder(image_format="jpg", quality=95).save(make_image(), fpath)
+    with Image.open(fpath) as f:
+        assert (f.format, f.mode) == ("JPEG", "RGB")
+        # transparent pixels become the background
+        assert all(v > 240 for v in f.getpixel((0, 0)))
+
+
+def test_quantize_keeps_alpha(tmp_path):
+    fpath = str(tmp_path / "0.png")
+    se.ImageEncoder(quantize=16).save(make_image(), fpath)
+    with Image.open(fpath) as f:
+        assert f.mode == "P"
+        assert f.convert("RGBA").getpixel((0, 0))[3] == 0
+        assert f.convert("RGBA").getpixel((3, 3)) == (200, 10, 10, 255)
+
+
+def test_encoder_settings():
+    settings = {"image_format": "webp", "image_quality": 80, "image_method": 6}
+    encoder = se.ImageEncoder.from_settings(settings)
+    assert encoder.save_kwargs() == {"format": "WEBP", "quality": 80, "method": 6}
+    preview = se.ImageEncoder.from_settings(settings, preview=True)
+    assert preview.save_kwargs()["method"] == se.PREVIEW_METHOD
+    assert preview.key() != encoder.key()
+    assert se.ImageEncoder(**encoder.to_options()).key() == encoder.key()
+
+    for kwargs in [
+        {"image_format": "gif"},
+        {"image_format": "jpg", "quantize": 16},
+        {"compress_level": 10},
+        {"quality": 0},
+    ]:
+        with pytest.raises(ValueError):
+            se.ImageEncoder(**kwargs)
@@ -0,0 +1,187 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+
+# third-party
+from PIL import Image
+import pytest
+
+# src
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(TEST_DIR, ".."))
+import src.collection as scol
+import src.layers as sl
+
+
+def make_traits(traits_fdpath):
+    os.makedirs(traits_fdpath / "body")
+    os.makedirs(traits_fdpath / "hat")
+    Image.new("RGB", (8, 8), (10, 20, 30)).save(traits_fdpath / "body" / "blue.png")
+    Image.new("LA", (8, 8), (100, 128)).save(traits_fdpath / "hat" / "grey.png")
+    palette = Image.new("P", (8, 8), 1)
+    palette.putpalette([0, 0, 0, 255, 0, 0] + [0] * 762)
+    palette.save(traits_fdpath / "hat" / "red.png")
+
+
+def make_store(tmp_path, size=None):
+    return sl.LayerStore(
+        traits_fdpath=str(tmp_path / "traits"),
+        cache_fdpath=str(tmp_path / ".cache" / "layers"),
+        size=size,
+    )
+
+
+def test_preflight_converts_once(tmp_path):
+    make_traits(tmp_path / "traits")
+    store = make_store(tmp_path)
+    assert store.preflight() == 3
+
+    fpath = str(tmp_path / "traits" / "hat" / "red.png")
+    cached_fpath = store.cached_fpath(fpath)
+    assert cached_fpath == str(
+        tmp_path / ".cache" / "layers" / "8x8" / "hat" / "red.png"
+    )
+    assert store.plan([fpath]) == [cached_fpath]
+    with Image.open(cached_fpath) as f:
+        assert (f.mode, f.size) == ("RGBA", (8, 8))
+        assert f.getpixel((0, 0)) == (255, 0, 0, 255)
+
+    # cached until the source changes
+    assert make_store(tmp_path).preflight() == 0
+    os.utime(fpath, ns=(os.stat(cached_fpath).st_mtime_ns + 1,) * 2)
+    assert make_store(tmp_path).preflight() == 1
+
+    # an older source restored in place, i.e. cp -p, is converted again
+    Image.new("RGBA", (8, 8), (0, 0, 255, 255)).save(fpath)
+    os.utime(fpath, ns=(0, 0))
+    assert make_store(tmp_path).preflight() == 1
+    with Image.open(cached_fpath) as f:
+        assert f.getpixel((0, 0)) == (0, 0, 255, 255)
+    assert make_store(tmp_path).preflight() == 0
+
+
+def test_preflight_shared_cache(tmp_path):
+    make_traits(tmp_path / "traits")
+    # two shards preflight the same fresh cache
+    stores = [make_store(tmp_path), make_store(tmp_path)]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        assert list(executor.map(lambda store: store.preflight(), stores)) == [3, 3]
+    layers_fdpath = stores[0].layers_fdpath
+    assert not [f for f in os.listdir(layers_fdpath) if f.endswith(".tmp")]
+
+    # sources saved by one shard are kept when another saves
+    stores[0].sources = {"hat/red.png": stores[0].sources["hat/red.png"]}
+    stores[0].save_sources()
+    assert make_store(tmp_path).preflight() == 0
+
+
+def test_preflight_fails_on_size(tmp_path):
+    make_traits(tmp_path / "traits")
+    Image.new("RGBA", (9, 8)).save(tmp_path / "traits" / "hat" / "big.png")
+    with pytest.raises(sl.PreflightError, match="hat/big.png is 9x8"):
+        make_store(tmp_path).preflight()
+    assert not os.path.exists(tmp_path / ".cache")
+
+    # unless every layer is resized
+    store = make_store(tmp_path, size=(4, 4))
+    assert store.preflight() == 4
+    with Image.open(store.cached_fpath(tmp_path / "traits" / "hat" / "big.png")) as f:
+        assert f.size == (4, 4)
+
+
+def test_atlas_views_match_cached_layers(tmp_path):
+    make_traits(tmp_path / "traits")
+    Image.new("RGBA", (8, 8)).save(tmp_path / "traits" / "hat" / "none.png")
+    store = make_store(tmp_path)
+    store.preflight()
+    store.build_atlas()
+
+    atlas = sl.LayerAtlas(store.atlas_fdpath)
+    for fpath in store.layers:
+        rgba, bbox = atlas.get(store.cached_fpath(fpath))
+        with Image.open(store.cached_fpath(fpath)) as f:
+            assert rgba.tobytes() == f.tobytes()
+        assert not rgba.flags.writeable
+        assert bbox == (None if fpath.endswith("none.png") else (0, 8, 0, 8))
+
+
+def test_trait_index_combo(tmp_path):
+    traits = {
+        "trait_algorithm": "combo",
+        "trait_types": ["base", "hat", "strength"],
+        "trait_hidden": ["strength"],
+        "trait_values": {
+            "base": {"any": {"cat": 1, "dog": 1}},
+            "hat": {"cat": {"cap": 1}, "dog": {"crown": 1}},
+            "strength": {"any": {"weak": 1}},
+        },
+    }
+    index = sl.TraitIndex.from_traits(traits, str(tmp_path), check=False)
+    assert index.trait_types == ["base", "hat"]
+    assert index.sublevels == ["any", "any", "cat", "dog"]
+    attributes = {"base": "dog", "hat": "crown", "strength": "weak"}
+    assert index.plan_ids(attributes) == [1, 3]
+    assert index.plan(attributes) == [
+        str(tmp_path / "base" / "any" / "base-any-dog.png"),
+        str(tmp_path / "hat" / "dog" / "hat-dog-crown.png"),
+    ]
+    # not all traits are in all tokens
+    assert index.plan_ids({"base": "cat"}) == [0]
+    with pytest.raises(sl.PreflightError, match="hat='top'"):
+        index.plan_ids({"base": "cat", "hat": "top"})
+
+    with pytest.raises(sl.PreflightError, match="4 layers missing"):
+        sl.TraitIndex.from_traits(traits, str(tmp_path))
+
+
+def test_trait_index_combo_without_trait_values(tmp_path):
+    traits = {
+        "trait_algorithm": "combo",
+        "trait_types": ["base", "hat"],
+        "trait_hidden": [],
+        "trait_values": {"base": {"any": {"dog": 1}}},
+    }
+    index = sl.TraitIndex.from_traits(traits, str(tmp_path), check=False)
+    # hat has no trait_values, its layers are in the any sublevel
+    assert index.plan({"base": "dog", "hat": "crown"}) == [
+        str(tmp_path / "base" / "any" / "base-any-dog.png"),
+        str(tmp_path / "hat" / "any" / "hat-any-crown.png"),
+    ]
+    assert index.plan_ids({"hat": "crown"}) == [1]
+    assert index.sublevels == ["any", "any"]
+
+    collection = scol.Collection.from_attributes([(0, {"hat": "top", "base": "dog"})])
+    assert list(collection.iter_plans(index)) == [
+        (
+            0,
+            [
+                str(tmp_path / "base" / "any" / "base-any-dog.png"),
+                str(tmp_path / "hat" / "any" / "hat-any-top.png"),
+            ],
+        )
+    ]
+
+
+def test_trait_index_restricted(tmp_path):
+    traits = {
+        "trait_algorithm": "basic",
+        "trait_types": ["body", "hat"],
+        "trait_restrictions": ["body"],
+        "trait_values": {
+            "body": {"blue": 1, "red": 1},
+            "hat": {"blue": {"cap": 1}, "red": {"cap": 1, "crown": 1}},
+        },
+    }
+    for relpath in ["body/blue.png", "body/red.png", "hat/blue/cap.png"]:
+        os.makedirs(os.path.dirname(tmp_path / relpath), exist_ok=True)
+        Image.new("RGBA", (8, 8)).save(tmp_path / relpath)
+    with pytest.raises(sl.PreflightError, match=r"\['hat/red/cap.png'"):
+        sl.TraitIndex.from_traits(traits, str(tmp_path))
+
+    index = sl.TraitIndex.from_traits(traits, str(tmp_path), check=False)
+    # the same value has a layer per restriction value
+    assert index.plan({"body": "red", "hat": "cap"}) == [
+        str(tmp_path / "body" / "red.png"),
+        str(tmp_path / "hat" / "red" / "cap.png"),
+    ]
+    assert index.plan_ids({"body": "blue", "hat": "cap"}) == [0, 2]
@@ -0,0 +1,33 @@
+import os
+import sys
+
+# src
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(TEST_DIR, ".."))
+import src.manifest as sm
+
+
+def test_manifest_detects_changed_layers(tmp_path):
+    layers = []
+    for i in range(2):
+        fpath = tmp_path / f"layer{i}.png"
+        fpath.write_bytes(b"layer %d" % i)
+        layers.append(str(fpath))
+
+    manifest = sm.BuildManifest.for_project(str(tmp_path))
+    token_digest = manifest.plan_digest(layers)
+    manifest.record("images", 0, token_digest)
+    manifest.save()
+    assert manifest.num_hashed == 2
+
+    # unchanged files are not hashed again
+    manifest = sm.BuildManifest.for_project(str(tmp_path))
+    assert manifest.is_current("images", 0, manifest.plan_digest(layers))
+    assert not manifest.is_current("images", 1, token_digest)
+    assert manifest.plan_digest(layers[::-1]) != token_digest
+    assert manifest.num_hashed == 0
+
+    with open(layers[1], "wb") as f:
+        f.write(b"fixed layer 1")
+    assert not manifest.is_current("images", 0, manifest.plan_digest(layers))
+    assert manifest.num_hashed == 1
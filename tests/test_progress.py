@@ -0,0 +1,29 @@
+import logging
+import os
+import sys
+
+# src
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(TEST_DIR, ".."))
+import src.progress as sp
+
+
+def test_progress_logs_rate_and_eta(caplog):
+    now = [100.0]
+    progress = sp.Progress("images", total=100, interval=5.0, clock=lambda: now[0])
+
+    with caplog.at_level(logging.INFO, logger="src.progress"):
+        for _ in range(10):
+            now[0] += 1.0
+            progress.update(n=2)
+    # one line per interval, not per token
+    assert [r.getMessage() for r in caplog.records] == [
+        "images: 10/100 tokens, 2.0 tokens/s, ETA 45s",
+        "images: 20/100 tokens, 2.0 tokens/s, ETA 40s",
+    ]
+
+
+def test_format_duration():
+    assert sp.format_duration(59) == "59s"
+    assert sp.format_duration(61) == "1m01s"
+    assert sp.format_duration(3 * 3600 + 120) == "3h02m"
@@ -0,0 +1,89 @@
+import csv
+import math
+import os
+import sys
+
+# third-party
+import numpy as np
+
+# src
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(TEST_DIR, ".."))
+import src.collection as scol
+import src.rarity as sr
+
+TOKENS = [
+    (0, {"body": "red", "hat": "red"}),
+    (1, {"body": "red", "hat": "cap"}),
+    (2, {"body": "blue", "hat": "cap"}),
+    (4, {"body": "red"}),
+    (5, {"body": "red", "hat": "cap"}),
+]
+
+
+def test_rarity_counts_per_trait_type():
+    collection = scol.Collection.from_attributes(TOKENS, trait_types=["body"])
+    assert collection.token_nums.tolist() == [0, 1, 2, 4, 5]
+    assert collection.attributes(4) == {"body": "red"}
+
+    rarity = sr.Rarity(collection)
+    # red of body and red of hat are different values
+    assert rarity.trait_value_counts() == {
+        "body": {"red": 4, "blue": 1},
+        "hat": {"red": 1, "cap": 3},
+    }
+    assert rarity.trait_type_counts() == {"body": 5, "hat": 4}
+
+    # frequencies include the absent hat of token 4
+    frequencies = {
+        ("body", "red"): 4 / 5,
+        ("body", "blue"): 1 / 5,
+        ("hat", "red"): 1 / 5,
+        ("hat", "cap"): 3 / 5,
+        ("hat", None): 1 / 5,
+    }
+    token_frequencies = [
+        [frequencies[(t, a.get(t))] for t in ["body", "hat"]] for _, a in TOKENS
+    ]
+    assert np.allclose(
+        rarity.information_scores,
+        [-sum(math.log2(f) for f in fs) for fs in token_frequencies],
+    )
+    assert np.allclose(
+        rarity.rarity_scores, [sum(1 / f for f in fs) for fs in token_frequencies]
+    )
+    # 2 is rarest, 0 and 4 tie through a rare hat and a missing hat
+    assert rarity.information_ranks.tolist() == [2, 4, 1, 2, 4]
+    assert rarity.rarity_ranks.tolist() == [2, 4, 1, 2, 4]
+
+
+def test_rarity_ranks_differ():
+    # one rare value against several uncommon ones
+    values = [("x", "c", "c")] + [("y", "y", "y")] * 3 + [("z", "w", "w")]
+    values += [("z", "c", "c")] * 5
+    tokens = [
+        (token_num, dict(zip(["a", "b", "c"], row)))
+        for token_num, row in enumerate(values)
+    ]
+    rarity = sr.Rarity(scol.Collection.from_attributes(tokens))
+    # 0.1 * 0.6 * 0.6 is a likelier combination than 0.3 * 0.3 * 0.3
+    assert rarity.information_ranks[:5].tolist() == [5, 2, 2, 2, 1]
+    # but 1 / 0.1 outweighs 3 / 0.3
+    assert rarity.rarity_ranks[:5].tolist() == [2, 3, 3, 3, 1]
+
+
+def test_rarity_csv_rarest_first(tmp_path):
+    rarity = sr.Rarity(scol.Collection.from_attributes(TOKENS))
+    fpath = str(tmp_path / "rarity.csv")
+    rarity.write_csv(fpath)
+    with open(fpath, "r", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert [row["token_num"] for row in rows] == ["2", "0", "4", "1", "5"]
+    assert rows[2]["hat"] == sr.ABSENT_VALUE
+    assert rows[-1]["information_rank"] == "4"
+
+
+def test_competition_ranks():
+    scores = np.array([0.5, 0.1, 0.5, 0.9])
+    assert sr.competition_ranks(scores).tolist() == [2, 1, 2, 4]
+    assert sr.competition_ranks(scores, descending=True).tolist() == [2, 4, 2, 1]
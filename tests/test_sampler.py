@@ -0,0 +1,205 @@
+import os
+import sys
+
+# third-party
+import numpy as np
+import pytest
+
+# src
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(TEST_DIR, ".."))
+import src.sampler as ss
+
+RESTRICTED_TRAITS = {
+    "trait_types": ["class", "body", "head"],
+    "trait_restrictions": ["class"],
+    "trait_values": {
+        "class": {"archer": 2, "warrior": 1},
+        "body": {"archer": {"orange": 1, "white": 1}, "warrior": {"white": 1}},
+        "head": {"archer": {"normal": 1, "angry": 3}, "warrior": {"angry": 1}},
+    },
+}
+
+COMBO_TRAITS = {
+    "trait_algorithm": "combo",
+    "trait_types": ["funbox", "special", "strength"],
+    "trait_values": {
+        "funbox": {"any": {"ghost": 1, "cupcake": 3}},
+        "special": {
+            "ghost": {"ghost_special_1": 1, "ghost_special_2": 1},
+            "cupcake": {"cupcake_special_1": 1},
+        },
+        "strength": {"any": {"strength_1": 1, "strength_2": 1}},
+    },
+}
+
+
+def test_alias_table_frequencies():
+    table = ss.AliasTable(values=["a", "b", "c", "d"], weights=[1, 2, 0, 5])
+    u = np.random.default_rng(0).random(200000)
+    counts = np.bincount(table.draw_batch(u), minlength=4) / len(u)
+    assert counts[2] == 0
+    assert np.allclose(counts, [1 / 8, 2 / 8, 0, 5 / 8], atol=0.01)
+
+    # scalar draws agree with batch draws
+    assert [table.draw(x) for x in u[:1000]] == table.draw_batch(u[:1000]).tolist()
+
+
+def test_alias_table_bad_weights():
+    with pytest.raises(ValueError):
+        ss.AliasTable(values=["a"], weights=[0])
+    with pytest.raises(ValueError):
+        ss.TraitSampler.from_traits_basic(
+            {"trait_types": ["top"], "trait_values": {"top": {"black": {"x": 1}}}}
+        )
+
+
+@pytest.mark.parametrize("traits", [RESTRICTED_TRAITS, COMBO_TRAITS])
+def test_sample_codes_matches_sample(traits):
+    sampler = ss.TraitSampler.from_traits(traits)
+    uniforms = np.random.default_rng(1).random((500, len(sampler.nodes)))
+    codes = sampler.sample_codes(uniforms)
+    for row, token_uniforms in zip(codes.tolist(), uniforms.tolist()):
+        attributes = sampler.sample(uniforms=token_uniforms)
+        assert sampler.decode(row) == attributes
+        assert list(sampler.decode(row)) == list(attributes)
+
+
+def test_sample_combo_respects_sublevels():
+    sampler = ss.TraitSampler.from_traits(COMBO_TRAITS)
+    for attributes in sampler.sample_batch(1000, rng=np.random.default_rng(2)):
+        assert list(attributes) == ["funbox", "strength", "special"]
+        assert attributes["special"].startswith(attributes["funbox"])
+
+
+def test_token_rng_is_counter_based():
+    rng = ss.TokenRNG(seed=42)
+    batch = rng.uniforms_batch(token_nums=[0, 7, 2**40], num_draws=5)
+    assert batch.tolist()[1] == rng.uniforms(token_num=7, num_draws=5)
+    assert batch.tolist()[2] == rng.uniforms(token_num=2**40, num_draws=5)
+    assert rng.uniforms(7, 3, offset=2) == rng.uniforms(7, 5)[2:]
+    assert ss.TokenRNG(seed=43).uniforms(7, 5) != rng.uniforms(7, 5)
+    assert ((batch >= 0) & (batch < 1)).all()
+
+    u = rng.uniforms_batch(token_nums=np.arange(20000), num_draws=2)
+    assert abs(u.mean() - 0.5) < 0.01
+
+
+def test_capacity_counts_combinations():
+    assert ss.TraitSampler.from_traits(COMBO_TRAITS).capacity() == 6
+    assert ss.TraitSampler.from_traits(RESTRICTED_TRAITS).capacity() == 5
+
+    rows = list(ss.TraitSampler.from_traits(COMBO_TRAITS).enumerate_rows())
+    assert len(rows) == 6
+    assert sum(prob for _, prob in rows) == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("num_tokens", [4, 6])
+def test_unique_attributes_are_distinct(num_tokens):
+    sampler = ss.TraitSampler.from_traits(COMBO_TRAITS)
+    rng = ss.TokenRNG(seed=3)
+    tokens = list(
+        ss.generate_attributes(
+            sampler=sampler,
+            rng=rng,
+            start=0,
+            end=num_tokens,
+            num_tokens=num_tokens,
+            unique=True,
+        )
+    )
+    assert [token_num for token_num, _ in tokens] == list(range(num_tokens))
+    combos = {tuple(attributes.items()) for _, attributes in tokens}
+    assert len(combos) == num_tokens
+
+    # a range of the collection matches the same tokens of a full run
+    partial = ss.generate_attributes(
+        sampler=sampler, rng=rng, start=2, end=4, num_tokens=num_tokens, unique=True
+    )
+    assert list(partial) == tokens[2:4]
+
+
+def test_unique_more_tokens_than_combinations():
+    sampler = ss.TraitSampler.from_traits(COMBO_TRAITS)
+    with pytest.raises(ValueError):
+        ss.unique_rows(sampler=sampler, rng=ss.TokenRNG(seed=0), num_tokens=7)
+
+
+def test_unique_skewed_weights_fail_fast():
+    values = {f"value_{i}": 1 for i in range(20)}
+    values["value_0"] = 1e6
+    trait_types = [f"type_{i}" for i in range(8)]
+    sampler = ss.TraitSampler.from_traits(
+        {
+            "trait_algorithm": "combo",
+            "trait_types": trait_types,
+            "trait_values": {ttype: {"any": values} for ttype in trait_types},
+        }
+    )
+    assert sampler.capacity() == 20**8
+    # too many combinations to enumerate, the dominant value is named instead
+    with pytest.raises(ValueError, match="type_0='value_0'"):
+        ss.unique_rows(sampler=sampler, rng=ss.TokenRNG(seed=0), num_tokens=50)
+
+
+def test_unique_shards_match_full_run():
+    sampler = ss.TraitSampler.from_traits(
+        {
+            "trait_algorithm": "combo",
+            "trait_types": ["a", "b"],
+            "trait_values": {
+                "a": {"any": {"x": 99, "y": 0.5, "z": 0.5}},
+                "b": {"any": {"p": 99, "q": 0.5, "r": 0.5}},
+            },
+        }
+    )
+    for seed in range(50):
+        kwargs = {"sampler": sampler, "num_tokens": 4, "unique": True}
+        full = ss.generate_codes(rng=ss.TokenRNG(seed=seed), start=0, end=4, **kwargs)
+        shards = [
+            ss.generate_codes(
+                rng=ss.TokenRNG(seed=seed), start=start, end=end, **kwargs
+            )
+            for start, end in [(0, 2), (2, 4)]
+        ]
+        assert np.concatenate(shards).tolist() == full.tolist()
+        assert len({tuple(row) for row in full.tolist()}) == 4
+
+
+def test_largest_remainder_sums_to_total():
+    assert ss.largest_remainder([0.25, 0.75], 4) == [1, 3]
+    assert ss.largest_remainder([1 / 3, 1 / 3, 1 / 3], 10) == [4, 3, 3]
+    assert sum(ss.largest_remainder([0.1, 0.2, 0.7], 7)) == 7
+
+
+@pytest.mark.parametrize("traits", [RESTRICTED_TRAITS, COMBO_TRAITS])
+def test_quota_allocation_is_exact(traits):
+    sampler = ss.TraitSampler.from_traits(traits)
+    rng = ss.TokenRNG(seed=5)
+    num_tokens = 120
+    codes = ss.quota_codes(sampler=sampler, rng=rng, num_tokens=num_tokens)
+
+    root = sampler.roots[0]
+    root_counts = np.bincount(codes[:, 0], minlength=len(root.values))
+    expected = ss.largest_remainder(root.tables[None].probabilities, num_tokens)
+    assert root_counts.tolist() == [expected[root.codes[v]] for v in root.values]
+
+    # sublevels keep their weights within each parent value
+    for j, node in enumerate(sampler.dependents, start=len(sampler.roots)):
+        for key, rows in sampler.table_rows(node, codes):
+            table = node.tables[key]
+            counts = ss.largest_remainder(table.probabilities, len(rows))
+            for value, count in zip(table.values, counts):
+                assert (codes[rows, j] == node.codes[value]).sum() == count
+
+    tokens = list(
+        ss.generate_attributes(
+            sampler=sampler,
+            rng=rng,
+            start=10,
+            end=20,
+            num_tokens=num_tokens,
+            allocation="quota",
+        )
+    )
+    assert tokens == [(i, sampler.decode(codes[i].tolist())) for i in range(10, 20)]
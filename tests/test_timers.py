@@ -0,0 +1,48 @@
+import json
+import os
+import sys
+
+# src
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(TEST_DIR, ".."))
+import src.timers as st
+
+
+def test_timers_disabled_are_noop():
+    st.disable()
+    st.reset()
+    with st.timer("images.encode"):
+        pass
+    st.count("images.saved")
+    assert list(st.timed_iter("images.plan", [1, 2])) == [1, 2]
+    assert st.snapshot() == {"timers": {}, "counters": {}, "events": []}
+
+
+def test_timers_merge_and_trace(tmp_path):
+    st.enable(trace=True)
+    st.reset()
+    try:
+        with st.timer("images.encode"):
+            pass
+        assert list(st.timed_iter("images.plan", [1, 2])) == [1, 2]
+        st.count("images.saved", n=2)
+        worker = st.snapshot()
+        st.merge(worker)
+
+        data = st.snapshot()
+        assert data["timers"]["images.encode"][0] == 2
+        # one call per item and one for the exhausted iterator
+        assert data["timers"]["images.plan"][0] == 6
+        assert data["counters"] == {"images.saved": 4}
+        assert "images.encode" in st.summary_table()
+
+        fpath = str(tmp_path / "trace.json")
+        st.write_trace(fpath)
+        with open(fpath, "r", encoding="utf-8") as f:
+            events = json.load(f)["traceEvents"]
+        assert len(events) == 8
+        assert {e["ph"] for e in events} == {"X"}
+        assert {e["cat"] for e in events} == {"images"}
+    finally:
+        st.disable()
+        st.reset()
@@ -1,3 +1,5 @@
+import csv
+import json
 import os
 import sys
 
@@ -260,3 +262,305 @@ def test_apply_media_host_with_missing():
     )
     assert metadata["image"] == "0.png"
     assert metadata["properties"]["files"][0]["uri"] == "0.png"
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_run_token_tasks(workers):
+    seen = []
+    su.run_token_tasks(fn=seen.append, token_nums=range(100), workers=workers)
+    assert sorted(seen) == list(range(100))
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_run_token_tasks_fail_fast(workers):
+    seen = []
+
+    def fn(token_num):
+        if token_num == 7:
+            raise ValueError(f"translation is missing translation for {token_num}")
+        seen.append(token_num)
+
+    with pytest.raises(ValueError, match="7"):
+        su.run_token_tasks(
+            fn=fn, token_nums=range(1000), workers=workers, max_in_flight=8
+        )
+    assert len(seen) < 100
+
+
+def make_combo_config(working_dir, num_tokens=4):
+    return yaml.safe_load(
+        f"""combo:
+  settings:
+    working_dir: {working_dir}
+    address: OK
+    num_tokens: {num_tokens}
+    name_prefix: combo
+    description: combo description
+    collection: combo collection
+    symbol: LCR
+    seller_fee_basis_points: 100
+  validation:
+    min_rarity_basis: 100
+  traits:
+    trait_algorithm: combo
+    trait_types:
+      - funbox
+      - special
+    trait_hidden:
+      - funbox
+    trait_values:
+      funbox:
+        any:
+          ghost: 1
+          spoon: 1
+      special:
+        ghost:
+          ghost_special_1: 1
+          ghost_special_2: 1
+        spoon:
+          spoon_special_1: 1
+"""
+    )
+
+
+def test_validate_project(tmp_path):
+    config = make_combo_config(working_dir=str(tmp_path))
+    assets_fdpath = tmp_path / "combo" / "assets"
+    assets_fdpath.mkdir(parents=True)
+    values = [("ghost", "ghost_special_1"), ("spoon", "spoon_special_1")] * 2
+    for token_num, (funbox, special) in enumerate(values):
+        if token_num != 3:
+            (assets_fdpath / f"{token_num}.png").write_bytes(b"")
+        metadata = {
+            "attributes": [
+                {"trait_type": "funbox", "value": funbox},
+                {"trait_type": "special", "value": special},
+            ]
+        }
+        (assets_fdpath / f"{token_num}.json").write_text(json.dumps(metadata))
+
+    config["combo"]["traits"]["trait_unique"] = True
+    assert not su.validate_project(config=config, project_name="combo")
+    with open(tmp_path / "combo" / "validation.json", "r", encoding="utf-8") as f:
+        report = json.load(f)
+    assert report["failures"]["duplicate_attributes"] == [2, 3]
+    assert report["failures"]["missing_images"] == [3]
+    assert report["failures"]["missing_metadatas"] == []
+    assert report["failures"]["missing_values"] == ["ghost_special_2"]
+    # counted per trait type, never merged by value name
+    assert report["rarity"]["trait_values"]["funbox"] == {"ghost": 2, "spoon": 2}
+    assert report["rarity"]["trait_types"]["special"] == 4
+    with open(tmp_path / "combo" / "rarity.csv", "r", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert sorted(int(row["token_num"]) for row in rows) == [0, 1, 2, 3]
+    assert {row["information_rank"] for row in rows} == {"1"}
+
+
+def test_generate_metadatas_combo_seeded_ranges(tmp_path):
+    config = make_combo_config(working_dir=str(tmp_path), num_tokens=10)
+    tt = su.TokenTool(config=config, project_name="combo")
+    full = tt.generate_metadatas_combo(0, 10, seed=7)
+    shard = tt.generate_metadatas_combo(6, 10, seed=7)
+    assert full[6:] == shard
+    assert tt.generate_metadatas_combo(0, 10, seed=8) != full
+
+
+def test_generate_images_incremental(tmp_path):
+    from PIL import Image
+
+    config = make_combo_config(working_dir=str(tmp_path), num_tokens=8)
+    su.initialize_project_folder(config=config, project_name="combo")
+    tt = su.TokenTool(config=config, project_name="combo")
+    special_values = config["combo"]["traits"]["trait_values"]["special"]
+    for sublevel, values in special_values.items():
+        for i, value in enumerate(values):
+            fpath = tt.create_image_fpath(trait_type="special", trait_value=value)
+            Image.new("RGBA", (4, 4), (i * 50, 0, 0, 255)).save(fpath)
+    su.generate_metadata_project(config=config, project_name="combo", seed=1)
+    su.generate_images_project(config=config, project_name="combo")
+
+    images_fdpath = tmp_path / "combo" / "images"
+    inodes = {f: os.stat(images_fdpath / f).st_ino for f in os.listdir(images_fdpath)}
+    changed_fpath = tt.create_image_fpath(
+        trait_type="special", trait_value="spoon_special_1"
+    )
+    Image.new("RGBA", (4, 4), (0, 0, 255, 255)).save(changed_fpath)
+    su.generate_images_project(config=config, project_name="combo", incremental=True)
+
+    num_rebuilt = 0
+    for token_num in range(8):
+        with open(tmp_path / "combo" / "metadata" / f"{token_num}.json") as f:
+            special = json.load(f)["attributes"][1]["value"]
+        rebuilt = os.stat(images_fdpath / f"{token_num}.png").st_ino
+        assert (rebuilt != inodes[f"{token_num}.png"]) == (special == "spoon_special_1")
+        num_rebuilt += rebuilt != inodes[f"{token_num}.png"]
+    assert 0 < num_rebuilt < 8
+
+
+def test_parse_token_range():
+    assert su.parse_token_range(num_tokens=10) == (0, 10)
+    assert su.parse_token_range(num_tokens=10, shard="0/3") == (0, 3)
+    assert su.parse_token_range(num_tokens=10, shard="2/3") == (6, 10)
+    assert su.parse_token_range(num_tokens=10, token_range="4:") == (4, 10)
+    assert su.parse_token_range(num_tokens=10, token_range=":4") == (0, 4)
+    for kwargs in [{"shard": "3/3"}, {"shard": "1"}, {"token_range": "5:11"}]:
+        with pytest.raises(ValueError):
+            su.parse_token_range(num_tokens=10, **kwargs)
+
+
+def test_merge_shards_project(tmp_path):
+    config = make_combo_config(working_dir=str(tmp_path), num_tokens=10)
+    su.initialize_project_folder(config=config, project_name="combo")
+    metadata_fdpath = tmp_path / "combo" / "metadata"
+    su.generate_metadata_project(config=config, project_name="combo", seed=3)
+    full = {f: (metadata_fdpath / f).read_bytes() for f in os.listdir(metadata_fdpath)}
+
+    for start, end in [(0, 4), (4, 10)]:
+        su.generate_metadata_project(
+            config=config,
+            project_name="combo",
+            overwrite=True,
+            seed=3,
+            start=start,
+            end=end,
+        )
+    # shards leave the committed metadata alone until merged
+    assert sorted(os.listdir(tmp_path / "combo" / ".shards")) == [
+        "metadata-0-4",
+        "metadata-4-10",
+    ]
+    assert su.merge_shards_project(config=config, project_name="combo")
+    assert not os.listdir(tmp_path / "combo" / ".shards")
+    merged = {
+        f: (metadata_fdpath / f).read_bytes() for f in os.listdir(metadata_fdpath)
+    }
+    assert merged == full
+
+    with pytest.raises(ValueError):
+        su.generate_metadata_project(
+            config=config, project_name="combo", start=0, end=4
+        )
+
+
+def test_generate_images_preview_then_final(tmp_path):
+    from PIL import Image
+
+    config = make_combo_config(working_dir=str(tmp_path), num_tokens=4)
+    config["combo"]["settings"]["image_format"] = "webp"
+    su.initialize_project_folder(config=config, project_name="combo")
+    tt = su.TokenTool(config=config, project_name="combo")
+    special_values = config["combo"]["traits"]["trait_values"]["special"]
+    for sublevel, values in special_values.items():
+        for i, value in enumerate(values):
+            fpath = tt.create_image_fpath(trait_type="special", trait_value=value)
+            Image.new("RGBA", (4, 4), (i * 50, 0, 0, 255)).save(fpath)
+    su.generate_metadata_project(config=config, project_name="combo", seed=1)
+    su.generate_images_project(config=config, project_name="combo", preview=True)
+
+    images_fdpath = tmp_path / "combo" / "images"
+    assert sorted(os.listdir(images_fdpath)) == [f"{i}.webp" for i in range(4)]
+    with Image.open(images_fdpath / "0.webp") as f:
+        assert f.format == "WEBP"
+    inodes = {f: os.stat(images_fdpath / f).st_ino for f in os.listdir(images_fdpath)}
+
+    # encoder settings are part of the image digest, previews are rebuilt
+    su.generate_images_project(config=config, project_name="combo", incremental=True)
+    for fname, inode in inodes.items():
+        assert os.stat(images_fdpath / fname).st_ino != inode
+    assert su.verify_project_stages(config=config, project_name="combo")
+
+
+def test_iter_metadatas_csv_range(tmp_path):
+    config = make_combo_config(working_dir=str(tmp_path))
+    config["combo"]["traits"]["trait_algorithm"] = "csv"
+    csv_fdpath = tmp_path / "combo" / "csv"
+    csv_fdpath.mkdir(parents=True)
+    rows = ["special,funbox"] + [f"ghost_special_{i},ghost" for i in range(6)]
+    rows[3] = ",spoon"
+    (csv_fdpath / "metadata.csv").write_text("\n".join(rows) + "\n")
+
+    tt = su.TokenTool(config=config, project_name="combo")
+    metadatas = tt.generate_metadatas_csv(1, 4)
+    assert [md["name"] for md in metadatas] == ["combo #1", "combo #2", "combo #3"]
+    # trait_types order, empty cells are kept as empty values
+    assert metadatas[0]["attributes"] == [
+        {"trait_type": "funbox", "value": "ghost"},
+        {"trait_type": "special", "value": "ghost_special_1"},
+    ]
+    assert metadatas[1]["attributes"] == [
+        {"trait_type": "funbox", "value": "spoon"},
+        {"trait_type": "special", "value": ""},
+    ]
+    assert metadatas[0]["properties"] is not metadatas[1]["properties"]
+
+    # unless they are skipped
+    config["combo"]["traits"]["trait_skip_empty"] = True
+    tt = su.TokenTool(config=config, project_name="combo")
+    metadatas = tt.generate_metadatas_csv(1, 4)
+    assert metadatas[1]["attributes"] == [{"trait_type": "funbox", "value": "spoon"}]
+
+    config["combo"]["traits"]["trait_types"] = ["funbox", "hat"]
+    tt = su.TokenTool(config=config, project_name="combo")
+    with pytest.raises(ValueError, match="unexpected=\\['special'\\]"):
+        tt.generate_metadatas_csv(0, 5)
+
+
+def test_generate_images_rebuilt_when_size_changes(tmp_path):
+    from PIL import Image
+
+    config = make_combo_config(working_dir=str(tmp_path), num_tokens=4)
+    su.initialize_project_folder(config=config, project_name="combo")
+    tt = su.TokenTool(config=config, project_name="combo")
+    special_values = config["combo"]["traits"]["trait_values"]["special"]
+    for sublevel, values in special_values.items():
+        for i, value in enumerate(values):
+            fpath = tt.create_image_fpath(trait_type="special", trait_value=value)
+            Image.new("RGBA", (4, 4), (i * 50, 0, 0, 255)).save(fpath)
+    su.generate_metadata_project(config=config, project_name="combo", seed=1)
+    su.generate_images_project(config=config, project_name="combo")
+
+    images_fdpath = tmp_path / "combo" / "images"
+    inodes = {f: os.stat(images_fdpath / f).st_ino for f in os.listdir(images_fdpath)}
+    su.generate_images_project(config=config, project_name="combo", incremental=True)
+    for fname, inode in inodes.items():
+        assert os.stat(images_fdpath / fname).st_ino == inode
+
+    # same layer files, but image_size is part of the image digest
+    config["combo"]["settings"]["image_size"] = [8, 8]
+    su.generate_images_project(config=config, project_name="combo", incremental=True)
+    for fname, inode in inodes.items():
+        assert os.stat(images_fdpath / fname).st_ino != inode
+        with Image.open(images_fdpath / fname) as img:
+            assert img.size == (8, 8)
+
+
+def test_combo_tokens_stream(tmp_path, monkeypatch):
+    from PIL import Image
+
+    config = make_combo_config(working_dir=str(tmp_path), num_tokens=8)
+    config["combo"]["settings"]["image_window"] = 2
+    su.initialize_project_folder(config=config, project_name="combo")
+    tt = su.TokenTool(config=config, project_name="combo")
+    special_values = config["combo"]["traits"]["trait_values"]["special"]
+    for sublevel, values in special_values.items():
+        for i, value in enumerate(values):
+            fpath = tt.create_image_fpath(trait_type="special", trait_value=value)
+            Image.new("RGBA", (4, 4), (i * 50, 0, 0, 255)).save(fpath)
+
+    # the first token is yielded without sampling the whole range
+    metadata = next(tt.iter_metadatas_combo(0, 10**12, seed=1))
+    assert metadata["name"] == "combo #0"
+
+    su.generate_metadata_project(config=config, project_name="combo", seed=1)
+    images_fdpath = tmp_path / "combo" / "images"
+    num_images_by_read = []
+    flatten_nft_attributes = su.flatten_nft_attributes
+
+    def flatten_and_count(attributes):
+        num_images_by_read.append(len(os.listdir(images_fdpath)))
+        return flatten_nft_attributes(attributes)
+
+    monkeypatch.setattr(su, "flatten_nft_attributes", flatten_and_count)
+    su.generate_images_project(config=config, project_name="combo")
+    # metadata is read one window at a time, after the previous window is saved
+    assert num_images_by_read == [0, 0, 2, 2, 4, 4, 6, 6]
@@ -0,0 +1,142 @@
+import json
+import os
+import sys
+
+# third-party
+import pytest
+
+# src
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(TEST_DIR, ".."))
+import src.writers as sw
+
+
+def test_metadata_writer_commit(tmp_path):
+    metadata_fdpath = tmp_path / "metadata"
+    metadata_fdpath.mkdir()
+    (metadata_fdpath / "0.json").write_text('{"name": "existing #0"}')
+
+    with sw.MetadataWriter(str(metadata_fdpath), batch_size=2) as writer:
+        for token_num in range(3):
+            writer.write(token_num=token_num, metadata={"name": f"new #{token_num}"})
+        # nothing is visible before commit
+        assert sorted(os.listdir(metadata_fdpath)) == ["0.json"]
+
+    assert sorted(os.listdir(metadata_fdpath)) == ["0.json", "1.json", "2.json"]
+    assert json.loads((metadata_fdpath / "0.json").read_text())["name"] == "existing #0"
+    assert (metadata_fdpath / "1.json").read_text() == json.dumps(
+        {"name": "new #1"}, indent=4
+    )
+    assert writer.num_skipped == 1
+    assert sorted(os.listdir(tmp_path)) == ["metadata"]
+
+
+def test_metadata_writer_keeps_permissions(tmp_path):
+    metadata_fdpath = tmp_path / "metadata"
+    metadata_fdpath.mkdir()
+    os.chmod(metadata_fdpath, 0o755)
+    with sw.MetadataWriter(str(metadata_fdpath)) as writer:
+        writer.write(token_num=0, metadata={"name": "new #0"})
+    assert os.stat(metadata_fdpath).st_mode & 0o777 == 0o755
+
+    # a new folder follows the umask
+    umask = os.umask(0o022)
+    try:
+        with sw.MetadataWriter(str(tmp_path / "new")) as writer:
+            writer.write(token_num=0, metadata={"name": "new #0"})
+    finally:
+        os.umask(umask)
+    assert os.stat(tmp_path / "new").st_mode & 0o777 == 0o755
+
+
+def test_metadata_writer_overwrite_compact(tmp_path):
+    metadata_fdpath = tmp_path / "metadata"
+    metadata_fdpath.mkdir()
+    (metadata_fdpath / "0.json").write_text('{"name": "existing #0"}')
+
+    with sw.MetadataWriter(str(metadata_fdpath), overwrite=True, compact=True) as w:
+        w.write(token_num=0, metadata={"name": "new #0", "attributes": []})
+
+    assert (
+        metadata_fdpath / "0.json"
+    ).read_text() == '{"name":"new #0","attributes":[]}'
+
+
+def test_metadata_writer_failure_keeps_previous(tmp_path):
+    metadata_fdpath = tmp_path / "metadata"
+    metadata_fdpath.mkdir()
+    (metadata_fdpath / "0.json").write_text('{"name": "existing #0"}')
+
+    with pytest.raises(ValueError):
+        with sw.MetadataWriter(str(metadata_fdpath), overwrite=True) as writer:
+            writer.write(token_num=0, metadata={"name": "new #0"})
+            writer.flush()
+            raise ValueError("crash")
+
+    assert sorted(os.listdir(tmp_path)) == ["metadata"]
+    assert (metadata_fdpath / "0.json").read_text() == '{"name": "existing #0"}'
+
+
+def test_metadata_writer_recovers_interrupted_commit(tmp_path):
+    # crashed after moving the old folder away, before moving the new one in
+    backup_fdpath = tmp_path / ".metadata-backup"
+    backup_fdpath.mkdir()
+    (backup_fdpath / "0.json").write_text('{"name": "existing #0"}')
+    staging_fdpath = tmp_path / ".metadata-staging-abcd"
+    staging_fdpath.mkdir()
+
+    writer = sw.MetadataWriter(str(tmp_path / "metadata"))
+    writer.recover()
+    assert sorted(os.listdir(tmp_path)) == ["metadata"]
+    assert (tmp_path / "metadata" / "0.json").exists()
+
+
+@pytest.mark.parametrize("link_mode", sw.LINK_MODES)
+def test_file_placer(tmp_path, link_mode):
+    source_fpath = tmp_path / "images" / "0.png"
+    source_fpath.parent.mkdir()
+    source_fpath.write_bytes(b"image bytes")
+    dest_fpath = tmp_path / "assets" / "0.png"
+    dest_fpath.parent.mkdir()
+
+    placer = sw.FilePlacer(link_mode=link_mode)
+    placer.place(str(source_fpath), str(dest_fpath))
+    # again over the existing destination, i.e. --overwrite
+    placer.place(str(source_fpath), str(dest_fpath))
+
+    assert dest_fpath.read_bytes() == b"image bytes"
+    assert sorted(os.listdir(dest_fpath.parent)) == ["0.png"]
+    stats = placer.stats()
+    assert stats["copied_bytes"] + stats["linked_bytes"] == 2 * len(b"image bytes")
+    if link_mode in ["copy", "reflink"]:
+        assert not os.path.samefile(source_fpath, dest_fpath)
+    if link_mode == "copy":
+        assert stats["linked_files"] == 0
+    if link_mode == "symlink":
+        assert os.path.islink(dest_fpath)
+        assert stats["linked_files"] == 2
+
+
+def test_file_placer_invalid_mode():
+    with pytest.raises(ValueError):
+        sw.FilePlacer(link_mode="teleport")
+
+
+def test_replace_from_temp(tmp_path):
+    fpath = str(tmp_path / "layer.png")
+    assert sw.unique_temp_fpath_for(fpath) != sw.unique_temp_fpath_for(fpath)
+
+    def write(temp_fpath):
+        with open(temp_fpath, "w") as f:
+            f.write("new")
+
+    sw.replace_from_temp(fpath, write)
+    assert open(fpath).read() == "new"
+
+    def fail(temp_fpath):
+        write(temp_fpath)
+        raise ValueError("crash")
+
+    with pytest.raises(ValueError):
+        sw.replace_from_temp(fpath, fail)
+    assert os.listdir(tmp_path) == ["layer.png"]